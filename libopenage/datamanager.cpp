@@ -22,7 +22,14 @@ void DataManager::initialize(AssetManager *am) {
 	auto gamedata_load_function = [this]() -> std::vector<gamedata::empiresdat> {
 		log::log(MSG(info) << "loading game specification files... stand by, will be faster soon...");
 		util::Dir gamedata_dir = this->assetmanager->get_data_dir()->append("converted/gamedata");
-		return util::recurse_data_files<gamedata::empiresdat>(gamedata_dir, "gamedata-empiresdat.docx");
+
+		// the binary tables are only there if the converter was asked for them.
+		std::string index_file = "gamedata-empiresdat.bin";
+		if (util::file_size(gamedata_dir, index_file) < 0) {
+			index_file = "gamedata-empiresdat.docx";
+		}
+
+		return util::recurse_data_files<gamedata::empiresdat>(gamedata_dir, index_file);
 	};
 
 	// add job
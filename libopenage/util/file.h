@@ -3,6 +3,7 @@
 #ifndef OPENAGE_UTIL_FILE_H_
 #define OPENAGE_UTIL_FILE_H_
 
+#include <cstdint>
 #include <stdlib.h>
 #include <string.h>
 #include <string>
@@ -72,6 +73,99 @@ std::vector<lineformat> read_csv_file(const std::string &fname) {
 	return result;
 }
 
+/**
+ * read a value of a binary data table row, at the given byte offset.
+ * the rows are packed, so the value may be unaligned.
+ */
+template<typename T>
+T read_binary_value(const char *row, size_t offset) {
+	T value;
+	memcpy(&value, row + offset, sizeof(T));
+	return value;
+}
+
+/**
+ * read a string column of a binary data table row, at the given byte offset.
+ * the column holds the offset of the string in the string heap,
+ * which has strings_size bytes and ends with a 0-byte.
+ * returns nullptr if the offset is outside the heap.
+ */
+inline const char *read_binary_string(const char *row, size_t offset,
+                                      const char *strings, size_t strings_size) {
+	uint32_t string_offset = read_binary_value<uint32_t>(row, offset);
+	if (string_offset >= strings_size) {
+		return nullptr;
+	}
+	return strings + string_offset;
+}
+
+
+/**
+ * read a single binary data table file, see binary_snippet.py.
+ * call the destination struct .fill_binary() method for each row.
+ */
+template<class lineformat>
+std::vector<lineformat> read_binary_file(const std::string &fname) {
+	// magic, row count, row size, member count
+	constexpr size_t header_size = 8 + 3 * sizeof(uint32_t);
+
+	char *content;
+	ssize_t content_length = read_whole_file(&content, fname);
+
+	if (content_length < (ssize_t)header_size or memcmp(content, "oa-table", 8) != 0) {
+		delete[] content;
+		throw Error(MSG(err) << "Not a binary data table: " << fname);
+	}
+
+	uint32_t row_count = read_binary_value<uint32_t>(content, 8);
+	uint32_t row_size = read_binary_value<uint32_t>(content, 12);
+	uint32_t member_count = read_binary_value<uint32_t>(content, 16);
+
+	if (row_size != lineformat::binary_row_size or member_count != lineformat::member_count) {
+		delete[] content;
+		throw Error(MSG(err) <<
+			"Failed to read binary data table: " << fname << ": "
+			"rows have " << member_count << " members in " << row_size << " bytes, "
+			"expected " << lineformat::member_count << " members in " <<
+			lineformat::binary_row_size << " bytes");
+	}
+
+	size_t strings_offset = header_size + (size_t)row_count * row_size;
+	if ((ssize_t)strings_offset >= content_length) {
+		delete[] content;
+		throw Error(MSG(err) << "Truncated binary data table: " << fname);
+	}
+
+	// the string heap must end with a 0-byte, so all strings are terminated.
+	if (content[content_length - 1] != '\0') {
+		delete[] content;
+		throw Error(MSG(err) << "Unterminated string heap in binary data table: " << fname);
+	}
+
+	const char *strings = content + strings_offset;
+	size_t strings_size = content_length - strings_offset;
+
+	lineformat current_line_data;
+	auto result = std::vector<lineformat>{};
+	result.reserve(row_count);
+
+	for (size_t row = 0; row < row_count; row++) {
+		int error_column = current_line_data.fill_binary(content + header_size + row * row_size, strings, strings_size);
+		if (error_column != -1) {
+			delete[] content;
+			throw Error(MSG(err) <<
+				"Failed to read binary data table: " <<
+				fname << ": row " << row << ": column " << error_column);
+		}
+
+		result.push_back(current_line_data);
+	}
+
+	delete[] content;
+
+	return result;
+}
+
 /**
  * reads data files recursively.
  * should be called from the .recurse() method of the struct.
@@ -82,7 +176,15 @@ std::vector<lineformat> recurse_data_files(Dir basedir, const std::string &fname
 	std::string merged_filename = basedir.join(fname);
 
 	if (0 < file_size(merged_filename)) {
-		result = read_csv_file<lineformat>(merged_filename);
+		// the binary tables are named *.bin, all other files are csv.
+		const std::string bin_suffix = ".bin";
+		if (fname.size() >= bin_suffix.size() and
+		    fname.compare(fname.size() - bin_suffix.size(), bin_suffix.size(), bin_suffix) == 0) {
+			result = read_binary_file<lineformat>(merged_filename);
+		}
+		else {
+			result = read_csv_file<lineformat>(merged_filename);
+		}
 
 		//the new basedir is the old basedir
 		// + the directory part of the current relative file name
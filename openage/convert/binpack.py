@@ -0,0 +1,398 @@
+# Copyright 2015-2015 the openage authors. See copying.md for legal info.
+
+"""
+Routines for 2D binpacking, used to place the frames of a texture atlas.
+
+All packers take a list of (width, height) sizes, and return the atlas size
+and the (x, y) position of each of them, in the original order.
+"""
+
+import math
+
+
+class Packer:
+    """
+    Base class for all packing strategies.
+
+    margin:       free pixels that are left to the right and below each block.
+    power_of_two: round the atlas width and height up to powers of two.
+    max_size:     maximum atlas width and height, or None.
+    """
+
+    def __init__(self, margin=1, power_of_two=False, max_size=None):
+        self.margin = margin
+        self.power_of_two = power_of_two
+        self.max_size = max_size
+
+    def __repr__(self):
+        return "{}(margin={}, power_of_two={}, max_size={})".format(
+            type(self).__name__, self.margin, self.power_of_two,
+            self.max_size)
+
+    def pack(self, sizes):
+        """
+        Packs the blocks of the given sizes.
+
+        Returns (width, height, [(x, y), ...]).
+        """
+        if not sizes:
+            raise ValueError("can't pack an empty list of blocks")
+
+        widest = max(w for w, _ in sizes)
+        highest = max(h for _, h in sizes)
+        if self.max_size is not None and max(widest, highest) > self.max_size:
+            raise Exception("block of size %dx%d exceeds the maximum atlas "
+                            "size %d" % (widest, highest, self.max_size))
+
+        # the blocks to be packed, including their margins
+        blocks = [(w + self.margin, h + self.margin) for w, h in sizes]
+
+        best = None
+        for width in self.candidate_widths(sizes):
+            positions = self.pack_width(blocks, width)
+            if positions is None:
+                continue
+
+            atlas_w = self.round_size(max(x + w for (x, _), (w, _)
+                                          in zip(positions, sizes)))
+            atlas_h = self.round_size(max(y + h for (_, y), (_, h)
+                                          in zip(positions, sizes)))
+
+            if self.max_size is not None and max(atlas_w, atlas_h) > self.max_size:
+                continue
+
+            # prefer small atlases, then squarish ones.
+            score = (atlas_w * atlas_h, abs(atlas_w - atlas_h))
+            if best is None or score < best[0]:
+                best = score, (atlas_w, atlas_h, positions)
+
+        if best is None:
+            raise Exception("could not pack %d blocks into an atlas of "
+                            "maximum size %s" % (len(sizes), self.max_size))
+
+        return best[1]
+
+    def pack_variants(self, sizes, variant_count):
+        """
+        Packs variant_count copies of the blocks (e.g. the frames of a
+        texture, in multiple player colors). All copies share the same
+        layout, and are placed in a grid.
+
+        Returns (width, height, [(x, y), ...]), where the positions of
+        all blocks of the first copy come first, then the second copy, ...
+        """
+        width, height, positions = self.pack(sizes)
+        if variant_count == 1:
+            return width, height, positions
+
+        # the size of one copy, without rounding
+        cell_w = max(x + w for (x, _), (w, _) in zip(positions, sizes))
+        cell_h = max(y + h for (_, y), (_, h) in zip(positions, sizes))
+        cell_w += self.margin
+        cell_h += self.margin
+
+        best = None
+        for columns in range(1, variant_count + 1):
+            rows = math.ceil(variant_count / columns)
+            atlas_w = self.round_size(columns * cell_w - self.margin)
+            atlas_h = self.round_size(rows * cell_h - self.margin)
+
+            if self.max_size is not None and max(atlas_w, atlas_h) > self.max_size:
+                continue
+
+            # the copies hardly differ in area, so prefer square atlases.
+            score = (max(atlas_w, atlas_h), atlas_w * atlas_h)
+            if best is None or score < best[0]:
+                best = score, (atlas_w, atlas_h, columns)
+
+        if best is None:
+            raise Exception("could not pack %d variants of %d blocks into an "
+                            "atlas of maximum size %s" % (
+                                variant_count, len(sizes), self.max_size))
+
+        atlas_w, atlas_h, columns = best[1]
+
+        return atlas_w, atlas_h, [
+            (x + (variant % columns) * cell_w, y + (variant // columns) * cell_h)
+            for variant in range(variant_count)
+            for x, y in positions
+        ]
+
+    def candidate_widths(self, sizes):
+        """
+        Yields the atlas widths that shall be tried for packing.
+
+        The width includes the block margins.
+        """
+        min_width = max(w for w, _ in sizes) + self.margin
+        area = sum((w + self.margin) * (h + self.margin) for w, h in sizes)
+        base = max(min_width, math.ceil(math.sqrt(area)))
+
+        candidates = {base}
+        for factor in (1.25, 1.5, 2):
+            candidates.add(math.ceil(base * factor))
+
+        if self.power_of_two:
+            candidates = {self.round_size(width) for width in candidates}
+
+        for width in sorted(candidates):
+            if self.max_size is None or width <= self.max_size + self.margin:
+                yield width
+
+    def pack_width(self, blocks, width):
+        """
+        Packs the blocks (which include the margins) into an atlas of the
+        given width and unlimited height.
+
+        Returns [(x, y), ...], or None if the width is unsuitable.
+        """
+        raise NotImplementedError()
+
+    def round_size(self, size):
+        """
+        Applies the power-of-two constraint to an atlas size.
+        """
+        if self.power_of_two:
+            return 1 << max(0, size - 1).bit_length()
+
+        return size
+
+
+class GridPacker(Packer):
+    """
+    Places each block in a square-ish grid, where each cell has the
+    size of the largest block.
+
+    This wastes lots of space, but the layout is simple.
+    """
+
+    def candidate_widths(self, sizes):
+        per_row = math.ceil(math.sqrt(len(sizes)))
+        cell_width = max(w for w, _ in sizes) + self.margin
+
+        yield per_row * cell_width
+
+    def pack_width(self, blocks, width):
+        cell_width = max(w for w, _ in blocks)
+        cell_height = max(h for _, h in blocks)
+        per_row = max(1, width // cell_width)
+
+        return [
+            ((idx % per_row) * cell_width, (idx // per_row) * cell_height)
+            for idx in range(len(blocks))
+        ]
+
+
+class ShelfPacker(Packer):
+    """
+    Sorts the blocks by height, and places them on horizontal shelves.
+
+    Each block is placed on the first shelf where it fits.
+    """
+
+    def pack_width(self, blocks, width):
+        # [y, height, used width] for each shelf
+        shelves = []
+        positions = [None] * len(blocks)
+
+        for idx in sorted(range(len(blocks)),
+                          key=lambda idx: (-blocks[idx][1], -blocks[idx][0])):
+            block_w, block_h = blocks[idx]
+
+            if block_w > width:
+                return None
+
+            for shelf in shelves:
+                # the blocks are sorted by height, so they always fit
+                # into the height of previous shelves.
+                if shelf[2] + block_w <= width:
+                    break
+            else:
+                if shelves:
+                    shelf_y = shelves[-1][0] + shelves[-1][1]
+                else:
+                    shelf_y = 0
+
+                shelf = [shelf_y, block_h, 0]
+                shelves.append(shelf)
+
+            positions[idx] = (shelf[2], shelf[0])
+            shelf[2] += block_w
+
+        return positions
+
+
+class MaxRectsPacker(Packer):
+    """
+    Tracks all maximal free rectangles of the atlas, and places each block
+    in the free rectangle where its bottom edge ends up the highest
+    (bottom-left heuristic).
+
+    Produces tight atlases, but takes more time than the other packers.
+    """
+
+    def pack_width(self, blocks, width):
+        height = sum(h for _, h in blocks)
+
+        # (x, y, w, h) of all maximal free rectangles
+        free_rects = [(0, 0, width, height)]
+        positions = [None] * len(blocks)
+
+        for idx in sorted(range(len(blocks)),
+                          key=lambda idx: (-blocks[idx][1], -blocks[idx][0])):
+            block_w, block_h = blocks[idx]
+
+            best = None
+            for free_x, free_y, free_w, free_h in free_rects:
+                if block_w <= free_w and block_h <= free_h:
+                    score = (free_y + block_h, free_x)
+                    if best is None or score < best:
+                        best = score
+
+            if best is None:
+                return None
+
+            pos_x, pos_y = best[1], best[0] - block_h
+            positions[idx] = (pos_x, pos_y)
+
+            free_rects = self.split_free_rects(
+                free_rects, (pos_x, pos_y, block_w, block_h))
+
+        return positions
+
+    @staticmethod
+    def split_free_rects(free_rects, used):
+        """
+        Removes the used rectangle from all free rectangles it overlaps,
+        and returns the remaining maximal free rectangles.
+        """
+        used_x, used_y, used_w, used_h = used
+        used_r, used_b = used_x + used_w, used_y + used_h
+
+        # the free rectangles that don't overlap stay maximal among each
+        # other, only the split results have to be checked.
+        kept = []
+        new = []
+        for rect in free_rects:
+            free_x, free_y, free_w, free_h = rect
+            free_r, free_b = free_x + free_w, free_y + free_h
+
+            if (used_x >= free_r or used_r <= free_x or
+                    used_y >= free_b or used_b <= free_y):
+                kept.append(rect)
+                continue
+
+            # the up to four parts of the free rectangle around the used one
+            if used_x > free_x:
+                new.append((free_x, free_y, used_x - free_x, free_h))
+            if used_r < free_r:
+                new.append((used_r, free_y, free_r - used_r, free_h))
+            if used_y > free_y:
+                new.append((free_x, free_y, free_w, used_y - free_y))
+            if used_b < free_b:
+                new.append((free_x, used_b, free_w, free_b - used_b))
+
+        def contains(outer, inner):
+            """ True if the inner rectangle is inside the outer one """
+            return (outer[0] <= inner[0] and outer[1] <= inner[1] and
+                    outer[0] + outer[2] >= inner[0] + inner[2] and
+                    outer[1] + outer[3] >= inner[1] + inner[3])
+
+        maximal_new = []
+        for idx, rect in enumerate(new):
+            if any(contains(other, rect) for other in kept):
+                continue
+
+            # of two identical rectangles, keep the first one
+            if any(contains(other, rect) and (other != rect or other_idx < idx)
+                   for other_idx, other in enumerate(new) if other_idx != idx):
+                continue
+
+            maximal_new.append(rect)
+
+        kept = [rect for rect in kept
+                if not any(contains(other, rect) for other in maximal_new)]
+
+        return kept + maximal_new
+
+
+# all available packing strategies, by name
+PACKERS = {
+    "grid": GridPacker,
+    "shelf": ShelfPacker,
+    "maxrects": MaxRectsPacker,
+}
+
+DEFAULT_PACKER = "maxrects"
+
+
+def get_packer(name=DEFAULT_PACKER, **kwargs):
+    """
+    Creates the packer with the given name; kwargs are passed to it.
+    """
+    try:
+        packer_class = PACKERS[name]
+    except KeyError:
+        raise ValueError("unknown packer: " + repr(name)) from None
+
+    return packer_class(**kwargs)
+
+
+def packing_efficiency(sizes, width, height):
+    """
+    Returns the fraction of the atlas area that is covered by the blocks.
+    """
+    return sum(w * h for w, h in sizes) / (width * height)
+
+
+def test():
+    """
+    Packs random blocks with all packers, and verifies the results.
+    """
+    import random
+    from ..testing.testing import TestError, assert_value, assert_raises, result
+
+    rng = random.Random(1337)
+
+    def verify(name, sizes, width, height, positions, power_of_two):
+        """ checks the result of one packing """
+        assert_value(len(positions), len(sizes))
+
+        if power_of_two:
+            assert_value(width & (width - 1), 0)
+            assert_value(height & (height - 1), 0)
+
+        rects = [(x, y, w, h) for (x, y), (w, h)
+                 in zip(positions, sizes)]
+
+        for idx, (x, y, w, h) in enumerate(rects):
+            if x < 0 or y < 0 or x + w > width or y + h > height:
+                raise TestError("%s: block outside of atlas" % name)
+
+            for other_x, other_y, other_w, other_h in rects[:idx]:
+                if (x < other_x + other_w and other_x < x + w and
+                        y < other_y + other_h and other_y < y + h):
+                    raise TestError("%s: overlapping blocks" % name)
+
+    for name in sorted(PACKERS):
+        for power_of_two in (False, True):
+            packer = get_packer(name, power_of_two=power_of_two)
+
+            for count in (1, 2, 7, 40):
+                sizes = [(rng.randint(1, 90), rng.randint(1, 120))
+                         for _ in range(count)]
+
+                width, height, positions = packer.pack(sizes)
+                verify(name, sizes, width, height, positions, power_of_two)
+
+                width, height, positions = packer.pack_variants(sizes, 3)
+                verify(name, sizes * 3, width, height, positions,
+                       power_of_two)
+
+    # the maximum atlas size must be respected
+    packer = get_packer("maxrects", max_size=64)
+    width, height, _ = packer.pack([(30, 30)] * 4)
+    assert_value(max(width, height) <= 64, True)
+
+    with assert_raises(Exception):
+        result(packer.pack([(30, 30)] * 5))
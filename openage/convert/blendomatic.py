@@ -3,51 +3,60 @@
 # TODO pylint: disable=C,R
 
 from math import sqrt
-from struct import Struct, unpack_from
+from struct import Struct
 
 from ..log import spam, dbg, info
 
 from .dataformat.exportable import Exportable
 from .dataformat.data_definition import DataDefinition
 from .dataformat.struct_definition import StructDefinition
+from .png import DEFAULT_COMPRESSION_LEVEL, DEFAULT_FILTER
 
 endianness = "< "
 
 
-class BlendingTile:
-    def __init__(self, data, width, height):
-        self.data = data
-        self.width = width
-        self.height = height
+def rhombus_layout(row_count):
+    """
+    get the positions of the pixels of an isometric tile with row_count rows
 
-    def get_picture_data(self):
-        import numpy
+      ....*....
+      ..*****..
+      *********
+      ..*****..
+      ....*....  like this, only bigger..
 
-        tile_rows = list()
+    we end up drawing the rhombus with 49 rows.
+    the space indicated by . is not stored in the blendomatic data.
 
-        for _, picture_row in enumerate(self.data):
-            tile_row_data = list()
+    returns (index, width): index holds the flat (row * width + column)
+    position of each stored pixel, in the order they are stored.
+    """
+    import numpy
 
-            for _, alpha_data in enumerate(picture_row):
+    half_row_count = row_count // 2
+    width = 2 * row_count - 1
 
-                if alpha_data == -1:
-                    # draw full transparency
-                    alpha = 0
-                    val = 0
-                else:
-                    if alpha_data == 128:
-                        alpha = 255
-                        val = 0
-                    else:
-                        # original data contains 7-bit values only
-                        alpha = 128
-                        val = (127 - (alpha_data & 0x7f)) * 2
+    rows = list()
+    for y in range(row_count):
+        if y < half_row_count:
+            # upper half of the tile
+            # row i+1 has 4 more pixels than row i
+            # another +1 for the middle one
+            read_values = 1 + (4 * y)
+        else:
+            # lower half of tile
+            read_values = ((row_count * 2) - 1) - (4 * (y - half_row_count))
 
-                tile_row_data.append((val, val, val, alpha))
+        if read_values < 0:
+            raise Exception("reading negative count: %d" % read_values)
 
-            tile_rows.append(tile_row_data)
+        # how many empty pixels on the left before the real data begins
+        space_count = row_count - 1 - (read_values // 2)
 
-        return numpy.array(tile_rows)
+        row_start = y * width + space_count
+        rows.append(numpy.arange(row_start, row_start + read_values))
+
+    return numpy.concatenate(rows), width
 
 
 class BlendingMode:
@@ -60,7 +69,12 @@ class BlendingMode:
         to be used for calculations.
 
         the alphamask is used to determine the alpha amount for blending.
+
+        both are stored as stacks of tiles, as uint8 arrays of shape
+        (count, 49, 97). pixels outside the rhombus are 0,
+        self.rhombus is True for all pixels inside of it.
         """
+        import numpy
 
         # should be 2353 -> number of pixels (single alpha byte values)
         self.pxcount = header[0]
@@ -71,6 +85,15 @@ class BlendingMode:
         # as we draw in isometric tile format, this is the row count
         row_count = int(sqrt(self.pxcount)) + 1  # should be 49
 
+        index, width = rhombus_layout(row_count)
+        if len(index) != self.pxcount:
+            raise Exception("a tile of %d rows has %d pixels, not %d" % (
+                row_count, len(index), self.pxcount))
+
+        self.rhombus = numpy.zeros(row_count * width, dtype=bool)
+        self.rhombus[index] = True
+        self.rhombus = self.rhombus.reshape(row_count, width)
+
         # alpha_masks_raw is an array of bytes that will draw 32 images,
         # which are bit masks.
         #
@@ -86,97 +109,75 @@ class BlendingMode:
 
         bitmask_buf_size = self.pxcount * 4
         spam("reading 1bit masks -> %d bytes" % (bitmask_buf_size))
-        alpha_masks_buf = data_file.read(bitmask_buf_size)
-        alpha_masks_raw = unpack_from("%dB" % (bitmask_buf_size),
-                                      alpha_masks_buf)
-
-        # list of alpha-mask tiles
-        self.alphamasks = list()
+        alpha_masks_raw = read_array(data_file, bitmask_buf_size)
 
         spam("reading %d 8-bit tile masks = %d bytes" %
              (tile_count, self.pxcount * tile_count))
 
         # draw mask tiles for this blending mode
-        for _ in range(tile_count):
-            tile_buf = data_file.read(self.pxcount)
-            pixels = unpack_from("%dB" % self.pxcount, tile_buf)
-            self.alphamasks.append(self.get_tile_from_data(row_count, pixels))
-
-        bitvalues = list()
-        for i in alpha_masks_raw:
-            for b_id in range(7, -1, -1):
-                # bitmask from 0b00000001 to 0b10000000
-                bit_mask = 2 ** b_id
-                bit = i & bit_mask
-                bitvalues.append(bit)
-
-        # list of bit-mask tiles
-        self.bitmasks = list()
+        tiles = read_array(data_file, self.pxcount * tile_count)
+        self.alphamasks = draw_tiles(tiles.reshape(tile_count, self.pxcount),
+                                     index, row_count, width)
 
-        # TODO: is 32 really hardcoded?
-        for i in range(32):
-            data_begin = i * self.pxcount
-            data_end = (i + 1) * self.pxcount
-            pixels = bitvalues[data_begin:data_end]
+        # the most significant bit is the first pixel.
+        bitvalues = numpy.unpackbits(alpha_masks_raw)
 
-            self.bitmasks.append(self.get_tile_from_data(row_count, pixels))
+        # TODO: is 32 really hardcoded?
+        self.bitmasks = draw_tiles(bitvalues.reshape(32, self.pxcount),
+                                   index, row_count, width)
 
-    def get_tile_from_data(self, row_count, data):
+    def get_picture_data(self):
+        """
+        returns the rgba images of all alpha mask tiles,
+        as uint8 array of shape (tile_count, 49, 97, 4).
         """
-        get the data pixels, interprete them in isometric tile format
+        import numpy
 
-          ....*....
-          ..*****..
-          *********
-          ..*****..
-          ....*....  like this, only bigger..
+        # the rgba value for each alpha mask byte
+        values = numpy.arange(256)
+        lookup = numpy.empty((256, 4), dtype=numpy.uint8)
 
-        we end up drawing the rhombus with 49 rows.
-        the space indicated by . is added by the function.
-        """
+        # original data contains 7-bit values only
+        lookup[:, :3] = ((127 - (values & 0x7f)) * 2)[:, numpy.newaxis]
+        lookup[:, 3] = 128
+        lookup[128] = (0, 0, 0, 255)
+
+        result = lookup[self.alphamasks]
 
-        half_row_count = row_count // 2
-        tile_size = len(data)
+        # draw full transparency around the rhombus
+        result[:, ~self.rhombus] = 0
 
-        read_so_far = 0
-        max_width = 0
-        tilerows = list()
+        return result
 
-        for y in range(row_count):
-            if y < half_row_count:
-                # upper half of the tile
-                # row i+1 has 4 more pixels than row i
-                # another +1 for the middle one
-                read_values = 1 + (4 * y)
-            else:
-                # lower half of tile
-                read_values = ((row_count * 2) - 1) - (4 * (y - half_row_count))
 
-            if read_values > (tile_size - read_so_far):
-                raise Exception("reading more bytes than tile has left")
-            elif read_values < 0:
-                raise Exception("reading negative count: %d" % read_values)
+def read_array(data_file, size):
+    """
+    reads exactly size bytes from data_file, as uint8 array.
+    """
+    import numpy
 
-            # grab the pixels out of the big list
-            pixels = list(data[read_so_far:(read_so_far + read_values)])
+    buf = data_file.read(size)
+    if len(buf) != size:
+        raise Exception("blendomatic data ended unexpectedly: "
+                        "got %d of %d bytes" % (len(buf), size))
 
-            # how many empty pixels on the left before the real data begins
-            space_count = row_count - 1 - (read_values // 2)
+    return numpy.frombuffer(buf, dtype=numpy.uint8)
 
-            # insert padding to the left and right (-1 for fully transparent)
-            padding = ([-1] * space_count)
-            pixels = padding + pixels + padding
 
-            if len(pixels) > max_width:
-                max_width = len(pixels)
+def draw_tiles(pixels, index, row_count, width):
+    """
+    draws the (count, pxcount) stored pixels of tiles on their rhombus
+    positions, given by rhombus_layout.
 
-            read_so_far += read_values
-            tilerows.append(pixels)
+    returns an uint8 array of shape (count, row_count, width).
+    """
+    import numpy
 
-        if read_so_far != tile_size:
-            raise Exception("got leftover bytes: %d" % (tile_size - read_so_far))
+    tiles = numpy.zeros((pixels.shape[0], row_count * width),
+                        dtype=numpy.uint8)
+    tiles[:, index] = pixels
 
-        return BlendingTile(tilerows, max_width, row_count)
+    return tiles.reshape(pixels.shape[0], row_count, width)
 
 
 class Blendomatic(Exportable):
@@ -221,7 +222,7 @@ class Blendomatic(Exportable):
 
         fileobj.close()
 
-    def get_textures(self):
+    def get_textures(self, packer=None):
         """
         generate a list of textures.
 
@@ -230,7 +231,8 @@ class Blendomatic(Exportable):
         """
 
         from .texture import Texture
-        return [Texture(b_mode) for b_mode in self.blending_modes]
+        return [Texture(b_mode, packer=packer)
+                for b_mode in self.blending_modes]
 
     def dump(self, filename):
         data = [
@@ -243,13 +245,116 @@ class Blendomatic(Exportable):
     def structs(cls):
         return [StructDefinition(cls)]
 
-    def save(self, fslikeobj, path, save_format):
-        for idx, texture in enumerate(self.get_textures()):
+    def save(self, fslikeobj, path, save_format, packer=None,
+             compression_level=DEFAULT_COMPRESSION_LEVEL,
+             png_filter=DEFAULT_FILTER, pool=None):
+        """
+        save the atlas of each blending mode.
+
+        if a pool (concurrent.futures.Executor) is given, the atlases
+        are created and saved in it.
+        """
+
+        from .texture import Texture
+
+        def save_texture(idx, b_mode):
+            """ create and save the atlas of one blending mode """
+            texture = Texture(b_mode, packer=packer)
             name = "mode%02d" % idx
             dbg("saving blending mode %02d texture -> %s" % (idx, name))
-            texture.save(fslikeobj, path + '/' + name, save_format)
+            texture.save(fslikeobj, path + '/' + name, save_format,
+                         compression_level, png_filter)
+
+        if pool is None:
+            for idx, b_mode in enumerate(self.blending_modes):
+                save_texture(idx, b_mode)
+
+        else:
+            futures = [pool.submit(save_texture, idx, b_mode)
+                       for idx, b_mode in enumerate(self.blending_modes)]
+            for future in futures:
+                future.result()
 
         info("blending masks successfully exported")
 
     def __str__(self):
         return str(self.blending_modes)
+
+
+def test():
+    """
+    Reads a synthetic blendomatic file, and checks that the stored pixels
+    are drawn on the rows of the rhombus.
+    """
+    from io import BytesIO
+
+    import numpy
+
+    from ..testing.testing import assert_value, assert_raises, result
+
+    pxcount, tile_count = 2353, 2
+
+    # the alpha values of the two tiles, 1 to 200 resp. 255 to 56
+    stored = numpy.arange(pxcount) % 200
+    tiles = numpy.concatenate((stored + 1, 255 - stored)).astype(numpy.uint8)
+
+    # every 8th bit of the 32 bit masks is set. they are stored as one
+    # stream of bits, so the masks don't start at byte boundaries.
+    data = b"".join((
+        Blendomatic.blendomatic_header.pack(1, tile_count),
+        Struct(endianness + "I %dB" % tile_count).pack(pxcount, 0, 0),
+        b"\x80" * (pxcount * 4),
+        tiles.tobytes(),
+    ))
+
+    blend = Blendomatic(BytesIO(data))
+    mode = blend.blending_modes[0]
+
+    assert_value(mode.alphamasks.shape, (tile_count, 49, 97))
+    assert_value(mode.bitmasks.shape, (32, 49, 97))
+    assert_value(int(mode.rhombus.sum()), pxcount)
+
+    def row(pixels, first_column):
+        """ a row of the tile with pixels starting at first_column """
+        values = [0] * 97
+        values[first_column:first_column + len(pixels)] = pixels
+        return values
+
+    # first row: the first stored pixel in the middle column
+    assert_value(mode.alphamasks[0, 0].tolist(), row([1], 48))
+    assert_value(mode.alphamasks[1, 0].tolist(), row([255], 48))
+
+    # each further row of the upper half is 4 pixels wider
+    assert_value(mode.alphamasks[0, 1].tolist(), row([2, 3, 4, 5, 6], 46))
+    assert_value(mode.alphamasks[0, 23].tolist(),
+                 row([(1035 + idx) % 200 + 1 for idx in range(93)], 2))
+
+    # middle row: the full width, after 24 rows of 1 + 4 * y pixels
+    assert_value(mode.alphamasks[0, 24].tolist(),
+                 [(1128 + idx) % 200 + 1 for idx in range(97)])
+    assert_value(mode.alphamasks[1, 24].tolist(),
+                 [255 - (1128 + idx) % 200 for idx in range(97)])
+
+    # last row: the last stored pixel
+    assert_value(mode.alphamasks[0, 48].tolist(), row([2352 % 200 + 1], 48))
+
+    # the first mask starts with a set bit, the second one at bit 2353
+    assert_value(mode.bitmasks[0, 0].tolist(), row([1], 48))
+    assert_value(mode.bitmasks[0, 1].tolist(), row([0] * 5, 46))
+    assert_value(mode.bitmasks[0, 24].tolist(),
+                 [int(idx % 8 == 0) for idx in range(97)])
+    assert_value(mode.bitmasks[0, 48].tolist(), row([1], 48))
+
+    assert_value(mode.bitmasks[1, 0].tolist(), row([0], 48))
+    assert_value(mode.bitmasks[1, 24].tolist(),
+                 [int(idx % 8 == 7) for idx in range(97)])
+    assert_value(mode.bitmasks[1, 48].tolist(), row([0], 48))
+
+    # pixels outside of the rhombus are transparent
+    rgba = mode.get_picture_data()
+    assert_value(rgba.shape, (tile_count, 49, 97, 4))
+    assert_value(rgba[0, 0, 47].tolist(), [0, 0, 0, 0])
+    assert_value(rgba[0, 0, 48].tolist(), [252, 252, 252, 128])
+
+    with assert_raises(Exception):
+        result(Blendomatic(BytesIO(data[:-1])))
@@ -0,0 +1,165 @@
+# Copyright 2015-2015 the openage authors. See copying.md for legal info.
+
+# TODO pylint: disable=C,R
+
+"""
+binary data tables, the "bin" export format.
+
+a table file stores the data of one DataDefinition:
+
+ * the header (TABLE_HEADER): magic, row count, row size, member count
+ * row count rows of row size bytes. each member is a little-endian column
+   at a fixed offset, see StructDefinition.get_binary_layout.
+ * the string heap: all strings of the table, null-terminated.
+   string columns store the offset of their string in the heap.
+
+the generated fill_binary member functions read one row,
+util/file.h reads whole files.
+"""
+
+import struct
+
+from .content_snippet import ContentSnippet, SectionType
+
+
+TABLE_MAGIC = b"oa-table"
+TABLE_HEADER = struct.Struct("<8sIII")
+
+
+class StringHeap:
+    """
+    the string heap of a binary table.
+    each distinct string is stored once, offset 0 is the empty string.
+    """
+
+    def __init__(self):
+        self.data = bytearray(b"\0")
+        self.offsets = {"": 0}
+
+    def add(self, text):
+        """
+        return the offset of text in the heap.
+        """
+
+        try:
+            return self.offsets[text]
+        except KeyError:
+            pass
+
+        offset = len(self.data)
+        self.data += text.encode("utf-8")
+        self.data.append(0)
+
+        self.offsets[text] = offset
+        return offset
+
+
+class BinarySnippet(ContentSnippet):
+    """
+    the binary table of a DataDefinition.
+
+    like the CSVSnippet, the table is generated in chunks
+    while it is written.
+    """
+
+    def __init__(self, definition, file_name):
+        super().__init__(None, file_name, SectionType.section_body,
+                         orderby=definition.name_struct,
+                         reprtxt="binary table for %s" % definition.name_struct)
+        self.data_ready = False
+
+        self.definition = definition
+
+    def get_data_chunks(self):
+        if self.data_ready:
+            return (self.data,)
+
+        return self.definition.binary_chunks()
+
+    def generate_content(self):
+        self.data = b"".join(self.definition.binary_chunks())
+        self.data_ready = True
+
+    def __hash__(self):
+        return hash((
+            id(self.definition),
+            self.file_name,
+            self.section,
+        ))
+
+    def __eq__(self, other):
+        return (
+            type(other) is type(self) and
+            self.definition is other.definition and
+            self.file_name == other.file_name
+        )
+
+
+def test():
+    """
+    Writes a binary table, and reads it back.
+    """
+    from ...testing.testing import assert_value
+    from .data_definition import DataDefinition
+    from .data_formatter import DataFormatter
+    from .exportable import Exportable
+    from .member_access import READ_EXPORT
+    from .members import ContinueReadMember, EnumMember, SubdataMember
+
+    class Item(Exportable):
+        name_struct        = "item"
+        name_struct_file   = "item"
+        struct_description = "test item"
+
+        data_format = (
+            (READ_EXPORT, "value", "int16_t"),
+        )
+
+    class Entry(Exportable):
+        name_struct        = "entry"
+        name_struct_file   = "entry"
+        struct_description = "test entry"
+
+        data_format = (
+            (READ_EXPORT, "exists", ContinueReadMember("uint8_t")),
+            (READ_EXPORT, "speed", "float"),
+            (READ_EXPORT, "name", "char[name_length]"),
+            (READ_EXPORT, "kind", EnumMember("entry_kind", ["small", "big"])),
+            (READ_EXPORT, "items", SubdataMember(ref_type=Item, length=1)),
+        )
+
+    data = [
+        {"exists": ContinueReadMember.Result.CONTINUE, "speed": 1.5,
+         "name": "first", "kind": "big", "items": "test/entries/0000-items"},
+        {"exists": ContinueReadMember.Result.ABORT, "speed": 0.0,
+         "name": "", "kind": "small", "items": "test/entries/0001-items"},
+        {"exists": ContinueReadMember.Result.CONTINUE, "speed": -2.0,
+         "name": "first", "kind": "small", "items": "test/entries/0002-items"},
+    ]
+    definition = DataDefinition(Entry, data, "test/entries")
+
+    snippet, = definition.generate_binary(DataFormatter)
+    table = snippet.get_data()
+
+    row_format, offsets = definition.get_binary_layout()
+    assert_value(row_format, "<BfIiI")
+    assert_value(offsets, [0, 1, 5, 9, 13])
+
+    magic, row_count, row_size, member_count = TABLE_HEADER.unpack_from(table)
+    assert_value((magic, row_count, row_size, member_count), (TABLE_MAGIC, 3, 17, 5))
+
+    rows = list(struct.iter_unpack(row_format, table[TABLE_HEADER.size:][:3 * 17]))
+    strings = table[TABLE_HEADER.size + 3 * 17:]
+
+    def string(offset):
+        """ the string at offset in the heap """
+        return strings[offset:strings.index(b"\0", offset)].decode()
+
+    assert_value([row[:2] for row in rows], [(1, 1.5), (0, 0.0), (1, -2.0)])
+    assert_value([string(row[2]) for row in rows], ["first", "", "first"])
+    assert_value(rows[0][2], rows[2][2])
+    assert_value([row[3] for row in rows], [1, 0, 0])
+    assert_value(string(rows[1][4]), "entries/0001-items.bin")
+
+    # the table is the same when it's generated in chunks
+    assert_value(b"".join(definition.binary_chunks(chunk_rows=2)), table)
@@ -0,0 +1,478 @@
+# Copyright 2015-2015 the openage authors. See copying.md for legal info.
+
+"""
+Columnar (structure-of-arrays) representation of read Exportable records.
+
+The records of each SubdataMember list are stored as one RecordTable, that
+holds a NumPy array for each member. Nested subdata lists are stored as one
+table of all their entries, plus the offsets of the entries of each record.
+
+Row objects (RecordView) are only created on access, and the columns can be
+used for vectorized queries, e.g.
+
+    units = gamespec.empiresdat[0].civs[1].units["living"]
+    strong = units.rows(numpy.flatnonzero(units.column("hit_points") > 100))
+
+Members of READ_UNKNOWN access are not stored, as their names depend on
+the offset of each record.
+"""
+
+import struct
+from collections.abc import Sequence
+
+import numpy
+
+from .members import SubdataMember
+from .read_plan import Field, DynamicStep, IncludeStep, SubdataStep, get_read_plan
+
+
+def numpy_dtype(symbol):
+    """
+    Returns the numpy dtype for the struct format symbol.
+    """
+    size = struct.calcsize("<" + symbol)
+
+    if symbol in "fd":
+        return numpy.dtype("<f%d" % size)
+    elif symbol.islower():
+        return numpy.dtype("<i%d" % size)
+    else:
+        return numpy.dtype("<u%d" % size)
+
+
+def record_members(cls):
+    """
+    Yields (name, step) for all stored members of the Exportable class,
+    where step is the read plan step (or Field) of the member.
+    """
+    for _, name, _, step in get_read_plan(cls).members:
+        if isinstance(step, IncludeStep):
+            yield from record_members(step.cls)
+        elif isinstance(step, Field) and step.unknown:
+            continue
+        elif isinstance(step, DynamicStep) and step.field.unknown:
+            continue
+        else:
+            yield name, step
+
+            if isinstance(step, SubdataStep) and not step.single_type:
+                # the subtype of the last entry is stored in the record, too.
+                yield step.subtype_name, None
+
+
+# value of members that are not set in a record,
+# e.g. the subtype member if no subtype entries were read.
+MISSING = object()
+
+
+def object_array(values):
+    """
+    Creates an 1D numpy array of the python objects.
+    """
+    data = numpy.empty(len(values), dtype=object)
+    data[:] = values
+    return data
+
+
+class ValueColumn:
+    """
+    Column of one value per record, numeric, str or an arbitrary object.
+    """
+    def __init__(self, data):
+        self.data = data
+
+    def get(self, idx):
+        return self.data.item(idx)
+
+    def __len__(self):
+        return len(self.data)
+
+
+class FixedArrayColumn(ValueColumn):
+    """
+    Column of a static-size array per record, stored as 2D array.
+    """
+    def get(self, idx):
+        return tuple(self.data[idx].tolist())
+
+
+class RaggedColumn:
+    """
+    Column of a dynamic-size array per record.
+
+    The values of record i are values[offsets[i]:offsets[i + 1]].
+    """
+    def __init__(self, offsets, values):
+        self.offsets = offsets
+        self.data = values
+
+    def get(self, idx):
+        return tuple(self.data[self.offsets[idx]:self.offsets[idx + 1]].tolist())
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+class SubdataColumn:
+    """
+    Column of a SubdataMember list per record.
+
+    The entries of record i are rows offsets[i] to offsets[i + 1] of table.
+    """
+    def __init__(self, offsets, table):
+        self.offsets = offsets
+        self.table = table
+
+    def get(self, idx):
+        return TableSlice(self.table, int(self.offsets[idx]), int(self.offsets[idx + 1]))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+class MultisubtypeColumn:
+    """
+    Column of a MultisubtypeMember dict per record:
+    a SubdataColumn for each subtype.
+    """
+    def __init__(self, subtypes):
+        self.subtypes = subtypes
+
+    def get(self, idx):
+        return {name: column.get(idx) for name, column in self.subtypes.items()}
+
+
+def offsets_of(lists):
+    """
+    Returns the offsets of the concatenation of the lists.
+    """
+    offsets = numpy.zeros(len(lists) + 1, dtype=numpy.int64)
+    numpy.cumsum([len(entries) for entries in lists], out=offsets[1:])
+    return offsets
+
+
+def build_field_column(field, values, dynamic):
+    """
+    Creates the column for a member that was read by field.
+    """
+    if field.custom is not None and field.hook:
+        # lookup results, e.g. enum values
+        return ValueColumn(object_array(values))
+
+    if field.symbol == "s":
+        if all(isinstance(value, str) for value in values):
+            return ValueColumn(numpy.array(values, dtype=str))
+
+        return ValueColumn(object_array(values))
+
+    dtype = numpy_dtype(field.symbol)
+
+    if not dynamic and field.count == 1:
+        if all(isinstance(value, (int, float)) for value in values):
+            return ValueColumn(numpy.array(values, dtype=dtype))
+
+    elif not dynamic:
+        if all(isinstance(value, tuple) and len(value) == field.count for value in values):
+            return FixedArrayColumn(numpy.array(values, dtype=dtype).reshape(
+                len(values), field.count))
+
+    elif all(isinstance(value, tuple) for value in values):
+        return RaggedColumn(offsets_of(values), numpy.fromiter(
+            (item for value in values for item in value), dtype=dtype))
+
+    # e.g. the empty values of members after a ContinueReadMember abort
+    return ValueColumn(object_array(values))
+
+
+def build_column(step, values):
+    """
+    Creates the column for the values of the member that was read by step.
+    """
+    if isinstance(step, Field):
+        return build_field_column(step, values, dynamic=False)
+
+    if isinstance(step, DynamicStep):
+        return build_field_column(step.field, values, dynamic=True)
+
+    if isinstance(step, SubdataStep):
+        var_type = step.var_type
+
+        if isinstance(var_type, SubdataMember):
+            if not all(isinstance(value, list) for value in values):
+                return ValueColumn(object_array(values))
+
+            return SubdataColumn(offsets_of(values), RecordTable.from_records(
+                var_type.class_lookup[None],
+                [entry for entries in values for entry in entries],
+                step.passed_args,
+            ))
+
+        elif all(isinstance(value, dict) for value in values):
+            subtypes = {}
+            for name, cls in var_type.class_lookup.items():
+                lists = [entries.get(name, []) for entries in values]
+                subtypes[name] = SubdataColumn(offsets_of(lists), RecordTable.from_records(
+                    cls,
+                    [entry for entries in lists for entry in entries],
+                    step.passed_args,
+                ))
+
+            return MultisubtypeColumn(subtypes)
+
+    return ValueColumn(object_array(values))
+
+
+class RecordTable:
+    """
+    Stores the members of a list of records of the Exportable class cls
+    as columns.
+    """
+
+    def __init__(self, cls, length, columns):
+        self.cls = cls
+        self.length = length
+
+        # member name -> column
+        self.columns = columns
+
+    @classmethod
+    def from_records(cls, record_class, records, extra_members=()):
+        """
+        Creates the table from a list of record_class instances.
+
+        extra_members are names of additional attributes of the records,
+        e.g. the passed_args of their SubdataMember.
+        """
+        columns = {}
+
+        for name in extra_members:
+            columns[name] = ValueColumn(object_array(
+                [getattr(record, name) for record in records]))
+
+        for name, step in record_members(record_class):
+            columns[name] = build_column(
+                step, [getattr(record, name, MISSING) for record in records])
+
+        return cls(record_class, len(records), columns)
+
+    def column(self, name):
+        """
+        Returns the numpy array of the member values, e.g. for queries.
+
+        For dynamic-size arrays, these are the concatenated values.
+        """
+        return self.columns[name].data
+
+    def rows(self, indices):
+        """
+        Returns the RecordViews of the given row indices.
+        """
+        return [RecordView(self, int(idx)) for idx in indices]
+
+    def materialize(self):
+        """
+        Returns all records as instances of their Exportable class.
+        """
+        return [row.materialize() for row in self]
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self.length
+
+        if not 0 <= idx < self.length:
+            raise IndexError("record index out of range: %d" % idx)
+
+        return RecordView(self, idx)
+
+    def __iter__(self):
+        for idx in range(self.length):
+            yield RecordView(self, idx)
+
+    def __repr__(self):
+        return "RecordTable(%s, %d records)" % (self.cls.__name__, self.length)
+
+
+class TableSlice(Sequence):
+    """
+    The rows start to end of a RecordTable,
+    i.e. the SubdataMember list of one record.
+    """
+
+    def __init__(self, table, start, end):
+        self.table = table
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+
+        if idx < 0:
+            idx += len(self)
+
+        if not 0 <= idx < len(self):
+            raise IndexError("record index out of range: %d" % idx)
+
+        return RecordView(self.table, self.start + idx)
+
+    def column(self, name):
+        """
+        Returns the member values of the rows in this slice.
+        """
+        column = self.table.columns[name]
+        if isinstance(column, RaggedColumn):
+            return column.data[column.offsets[self.start]:column.offsets[self.end]]
+
+        return column.data[self.start:self.end]
+
+    def rows(self, indices):
+        """
+        Returns the RecordViews of the given indices in this slice.
+        """
+        return [self[int(idx)] for idx in indices]
+
+    def materialize(self):
+        """
+        Returns the rows as instances of their Exportable class.
+        """
+        return [row.materialize() for row in self]
+
+    def __repr__(self):
+        return "TableSlice(%s, %d:%d)" % (self.table.cls.__name__, self.start, self.end)
+
+
+class RecordView:
+    """
+    One row of a RecordTable. The members are read from the columns
+    on attribute access.
+    """
+
+    __slots__ = ("table", "index")
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    def __getattr__(self, name):
+        try:
+            column = self.table.columns[name]
+        except KeyError:
+            raise AttributeError("%s has no member '%s'" % (
+                self.table.cls.__name__, name)) from None
+
+        value = column.get(self.index)
+        if value is MISSING:
+            raise AttributeError("member '%s' of %s is not set" % (
+                name, self.table.cls.__name__))
+
+        return value
+
+    def materialize(self):
+        """
+        Returns the record as an instance of its Exportable class,
+        with all subdata records materialized as well.
+        """
+        obj = self.table.cls.__new__(self.table.cls)
+
+        for name, column in self.table.columns.items():
+            value = column.get(self.index)
+
+            if value is MISSING:
+                continue
+            elif isinstance(value, TableSlice):
+                value = value.materialize()
+            elif isinstance(column, MultisubtypeColumn):
+                value = {key: entries.materialize() for key, entries in value.items()}
+
+            setattr(obj, name, value)
+
+        return obj
+
+    def __repr__(self):
+        return "RecordView(%s, %d)" % (self.table.cls.__name__, self.index)
+
+
+def to_columnar(obj):
+    """
+    Converts the read Exportable object to the columnar representation,
+    and returns the RecordView of it.
+    """
+    return RecordTable.from_records(type(obj), [obj])[0]
+
+
+def test():
+    """
+    Converts some records, and compares them with the original objects.
+    """
+    from ...testing.testing import assert_value
+    from .exportable import Exportable
+    from .member_access import READ, READ_UNKNOWN
+    from .members import ContinueReadMember
+
+    class Entry(Exportable):
+        """ record with a ContinueReadMember """
+        data_format = (
+            (READ, "exists", ContinueReadMember("uint8_t")),
+            (READ, "value_count", "uint8_t"),
+            (READ, "values", "int16_t[value_count]"),
+        )
+
+    class Record(Exportable):
+        """ record with all kinds of members """
+        data_format = (
+            (READ, "name", "char[4]"),
+            (READ, "speed", "float"),
+            (READ_UNKNOWN, None, "int8_t"),
+            (READ, "position", "int32_t[2]"),
+            (READ, "entry_count", "uint8_t"),
+            (READ, "entries", SubdataMember(
+                ref_type=Entry,
+                length="entry_count",
+            )),
+        )
+
+    class Root(Exportable):
+        """ list of records """
+        data_format = (
+            (READ, "records", SubdataMember(ref_type=Record, length=3)),
+        )
+
+    raw = b""
+    for idx in range(3):
+        raw += struct.pack("<4sfb2iB", b"r%d" % idx, idx / 2, 0, idx, -idx, idx)
+        for entry_idx in range(idx):
+            raw += struct.pack("<BB%dh" % (2 * entry_idx), 1, 2 * entry_idx,
+                               *range(2 * entry_idx))
+
+    root = Root()
+    root.read(raw, 0)
+
+    view = to_columnar(root)
+    records = view.records
+    assert_value(len(records), 3)
+    assert_value(records[2].name, "r2")
+    assert_value(records[1].speed, 0.5)
+    assert_value(records[2].position, (2, -2))
+    assert_value(records[2].entries[1].values, (0, 1))
+    assert_value(records[1].entries[0].values, ())
+    assert_value(list(records.column("speed") > 0.2), [False, True, True])
+    assert_value(records[2].entries.table.column("values").tolist(), [0, 1])
+
+    # the materialized records are equal to the read ones,
+    # except for the unknown members.
+    def members(obj):
+        """ the stored members of the object """
+        if isinstance(obj, list):
+            return [members(entry) for entry in obj]
+        if not isinstance(obj, Exportable):
+            return obj
+        return {key: members(value) for key, value in obj.__dict__.items()
+                if not key.startswith("unknown-")}
+
+    assert_value(members(view.materialize()), members(root))
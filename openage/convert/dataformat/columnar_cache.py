@@ -0,0 +1,512 @@
+# Copyright 2015-2015 the openage authors. See copying.md for legal info.
+
+"""
+Binary cache file for columnar Exportable records (see columnar.py).
+
+The file is not a pickle: it consists of a JSON index that describes all
+tables and columns, followed by the raw column arrays. When a cache file is
+opened, it is memory-mapped, and the arrays are used directly from the
+mapping. Nested tables and object columns are only created on access,
+so consumers that need one table don't pay for the others.
+
+Each cache file stores the schema fingerprint of its root class and the
+key of its source data; it is only used if both match.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+from types import CodeType, FunctionType
+
+import numpy
+
+from .columnar import (RecordTable, ValueColumn, FixedArrayColumn, RaggedColumn,
+                       SubdataColumn, MultisubtypeColumn, MISSING, record_members)
+from .members import ContinueReadMemberResult
+
+
+# increment whenever the file format or the meaning of its contents
+# (e.g. the reading or columnar conversion of the data) change.
+CACHE_VERSION = 1
+
+MAGIC = b"openage-columns\0"
+
+# the index length follows the magic
+HEADER = struct.Struct("<16sQ")
+
+# alignment of the arrays in the file
+ALIGNMENT = 64
+
+# enum types that may be stored in object columns
+ENUMS = {
+    enum.__name__: enum for enum in (ContinueReadMemberResult,)
+}
+
+
+def schema_fingerprint(cls):
+    """
+    Returns a hex digest of the data_format definitions of the Exportable
+    class, including all its included and subdata classes.
+
+    The fingerprint changes whenever a member definition changes.
+    """
+    from .exportable import Exportable
+
+    described = {}
+
+    def describe(value):
+        """ returns a stable string description of a definition value """
+        if isinstance(value, type) and issubclass(value, Exportable):
+            name = value.__module__ + "." + value.__qualname__
+            if name not in described:
+                described[name] = None
+                described[name] = describe(value.data_format)
+            return "class " + name
+
+        if isinstance(value, (tuple, list)):
+            return "(%s)" % ", ".join(describe(item) for item in value)
+
+        if isinstance(value, (set, frozenset)):
+            return "{%s}" % ", ".join(sorted(describe(item) for item in value))
+
+        if isinstance(value, dict):
+            return "{%s}" % ", ".join(sorted(
+                "%s: %s" % (describe(key), describe(item))
+                for key, item in value.items()))
+
+        if isinstance(value, FunctionType):
+            return describe(value.__code__)
+
+        if isinstance(value, CodeType):
+            return "code(%s, %s, %s)" % (value.co_code.hex(),
+                                         describe(value.co_consts),
+                                         describe(value.co_names))
+
+        if hasattr(value, "__dict__") and not isinstance(value, type):
+            # member definitions
+            return "%s%s" % (type(value).__name__, describe(vars(value)))
+
+        return repr(value)
+
+    fingerprint = hashlib.sha256()
+    fingerprint.update(("%d %s" % (CACHE_VERSION, describe(cls))).encode())
+
+    for name, description in sorted(described.items()):
+        fingerprint.update(("\n%s = %s" % (name, description)).encode())
+
+    return fingerprint.hexdigest()
+
+
+def encode_object(value):
+    """
+    Encodes an object column value to a JSON-compatible value.
+
+    tuples, lists, dicts, enum values and MISSING are tagged,
+    so they can be restored exactly.
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+
+    if value is MISSING:
+        return {"missing": True}
+
+    if isinstance(value, tuple):
+        return {"tuple": [encode_object(item) for item in value]}
+
+    if isinstance(value, list):
+        return {"list": [encode_object(item) for item in value]}
+
+    if isinstance(value, dict) and all(isinstance(key, str) for key in value):
+        return {"dict": {key: encode_object(item) for key, item in value.items()}}
+
+    if type(value).__name__ in ENUMS and isinstance(value, ENUMS[type(value).__name__]):
+        return {"enum": [type(value).__name__, value.value]}
+
+    raise ValueError("can't store %s in columnar cache" % type(value).__name__)
+
+
+def decode_object(value):
+    """
+    Inverse of encode_object.
+    """
+    if not isinstance(value, dict):
+        return value
+
+    if "missing" in value:
+        return MISSING
+
+    if "tuple" in value:
+        return tuple(decode_object(item) for item in value["tuple"])
+
+    if "list" in value:
+        return [decode_object(item) for item in value["list"]]
+
+    if "dict" in value:
+        return {key: decode_object(item) for key, item in value["dict"].items()}
+
+    if "enum" in value:
+        enum_name, enum_value = value["enum"]
+        return ENUMS[enum_name](enum_value)
+
+    raise ValueError("invalid object in columnar cache: %s" % value)
+
+
+class CacheWriter:
+    """
+    Collects the arrays of the tables, and writes the cache file.
+    """
+
+    def __init__(self):
+        self.blobs = []
+        self.size = 0
+
+    def add_blob(self, data):
+        """
+        Adds the bytes-like data, returns its offset in the data section.
+        """
+        offset = self.size
+        self.blobs.append(data)
+        self.size += len(data)
+
+        padding = -self.size % ALIGNMENT
+        if padding:
+            self.blobs.append(b"\0" * padding)
+            self.size += padding
+
+        return offset
+
+    def add_array(self, array):
+        """
+        Adds the numpy array, returns its description.
+        """
+        array = numpy.ascontiguousarray(array)
+        if array.dtype == object:
+            raise ValueError("object arrays can't be stored as raw arrays")
+
+        # store all numbers little-endian
+        array = array.astype(array.dtype.newbyteorder("<"), copy=False)
+
+        return {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": self.add_blob(array.data.cast("B") if array.size else b""),
+        }
+
+    def add_column(self, column):
+        """
+        Adds the column, returns its description.
+        """
+        if isinstance(column, SubdataColumn):
+            return {
+                "kind": "subdata",
+                "offsets": self.add_array(column.offsets),
+                "table": self.add_table(column.table),
+            }
+
+        if isinstance(column, MultisubtypeColumn):
+            return {
+                "kind": "multisubtype",
+                "subtypes": {name: self.add_column(subcolumn)
+                             for name, subcolumn in column.subtypes.items()},
+            }
+
+        if isinstance(column, RaggedColumn):
+            return {
+                "kind": "ragged",
+                "offsets": self.add_array(column.offsets),
+                "values": self.add_array(column.data),
+            }
+
+        if isinstance(column, FixedArrayColumn):
+            return {"kind": "fixed", "values": self.add_array(column.data)}
+
+        if column.data.dtype == object:
+            data = json.dumps([encode_object(value) for value in column.data]).encode()
+            return {
+                "kind": "object",
+                "offset": self.add_blob(data),
+                "size": len(data),
+            }
+
+        return {"kind": "value", "values": self.add_array(column.data)}
+
+    def add_table(self, table):
+        """
+        Adds all columns of the table, returns its description.
+        """
+        return {
+            "length": table.length,
+            "columns": {name: self.add_column(column)
+                        for name, column in table.columns.items()},
+        }
+
+    def write(self, outfile, schema, key, table):
+        """
+        Writes the cache file for the table to the binary file-like object.
+        """
+        index = json.dumps({
+            "schema": schema,
+            "key": key,
+            "root": self.add_table(table),
+        }).encode()
+
+        outfile.write(HEADER.pack(MAGIC, len(index)))
+        outfile.write(index)
+        outfile.write(b"\0" * (-(HEADER.size + len(index)) % ALIGNMENT))
+
+        for blob in self.blobs:
+            outfile.write(blob)
+
+
+def write_cache(filename, schema, key, table):
+    """
+    Writes the RecordTable to the cache file.
+
+    The file is replaced atomically, so readers never see partial files.
+    """
+    tmpname = "%s.tmp%d" % (filename, os.getpid())
+
+    try:
+        with open(tmpname, "wb") as outfile:
+            CacheWriter().write(outfile, schema, key, table)
+        os.replace(tmpname, filename)
+
+    finally:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+
+
+class LazyObjectColumn(ValueColumn):
+    """
+    Object column that is decoded from JSON on first access.
+    """
+    def __init__(self, cache, offset, size):
+        # pylint: disable=super-init-not-called
+        self.cache = cache
+        self.offset = offset
+        self.size = size
+        self.values = None
+
+    @property
+    def data(self):
+        """ the decoded object array """
+        if self.values is None:
+            start = self.cache.data_start + self.offset
+            values = json.loads(bytes(self.cache.mapping[start:start + self.size]).decode())
+
+            data = numpy.empty(len(values), dtype=object)
+            data[:] = [decode_object(value) for value in values]
+            self.values = data
+
+        return self.values
+
+
+class LazySubdataColumn(SubdataColumn):
+    """
+    Subdata column whose table is created on first access.
+    """
+    def __init__(self, cache, offsets, cls, description):
+        # pylint: disable=super-init-not-called
+        self.cache = cache
+        self.offsets = offsets
+        self.cls = cls
+        self.description = description
+        self.subtable = None
+
+    @property
+    def table(self):
+        """ the table of the subdata entries """
+        if self.subtable is None:
+            self.subtable = self.cache.open_table(self.cls, self.description)
+
+        return self.subtable
+
+
+class ColumnarCache:
+    """
+    An opened, memory-mapped cache file.
+
+    Use open_cache() to open cache files.
+    """
+
+    def __init__(self, mapping, data_start, index):
+        self.mapping = mapping
+        self.data_start = data_start
+        self.index = index
+
+    def array(self, description):
+        """
+        Returns the numpy array of the description, backed by the mapping.
+        """
+        dtype = numpy.dtype(description["dtype"])
+        shape = tuple(description["shape"])
+        count = int(numpy.prod(shape, dtype=numpy.int64))
+
+        if count == 0:
+            return numpy.empty(shape, dtype=dtype)
+
+        return numpy.frombuffer(
+            self.mapping, dtype=dtype, count=count,
+            offset=self.data_start + description["offset"],
+        ).reshape(shape)
+
+    def open_column(self, step, description):
+        """
+        Creates the column of the description.
+        step is the read plan step of the column's member.
+        """
+        kind = description["kind"]
+
+        if kind == "value":
+            return ValueColumn(self.array(description["values"]))
+
+        if kind == "fixed":
+            return FixedArrayColumn(self.array(description["values"]))
+
+        if kind == "ragged":
+            return RaggedColumn(self.array(description["offsets"]),
+                                self.array(description["values"]))
+
+        if kind == "object":
+            return LazyObjectColumn(self, description["offset"], description["size"])
+
+        if kind == "subdata":
+            return LazySubdataColumn(
+                self, self.array(description["offsets"]),
+                step.var_type.class_lookup[None], description["table"])
+
+        if kind == "multisubtype":
+            return MultisubtypeColumn({
+                name: LazySubdataColumn(
+                    self, self.array(subtype["offsets"]),
+                    step.var_type.class_lookup[name], subtype["table"])
+                for name, subtype in description["subtypes"].items()
+            })
+
+        raise ValueError("unknown column kind in columnar cache: %s" % kind)
+
+    def open_table(self, cls, description):
+        """
+        Creates the RecordTable of the Exportable class from its description.
+        """
+        steps = dict(record_members(cls))
+
+        columns = {}
+        for name, column in description["columns"].items():
+            columns[name] = self.open_column(steps.get(name), column)
+
+        return RecordTable(cls, description["length"], columns)
+
+    def root(self, cls):
+        """
+        Returns the root table, which holds records of the class cls.
+        """
+        return self.open_table(cls, self.index["root"])
+
+
+def open_cache(filename, schema, key=None):
+    """
+    Opens the cache file, and returns the ColumnarCache.
+
+    Returns None if the file doesn't exist, is invalid, or doesn't match
+    the schema or key. If key is None, it is not checked.
+    """
+    try:
+        with open(filename, "rb") as cachefile:
+            mapping = mmap.mmap(cachefile.fileno(), 0, access=mmap.ACCESS_READ)
+
+    except (FileNotFoundError, ValueError):
+        # ValueError: the file is empty
+        return None
+
+    if len(mapping) < HEADER.size:
+        return None
+
+    magic, index_size = HEADER.unpack_from(mapping, 0)
+    if magic != MAGIC:
+        return None
+
+    try:
+        index = json.loads(mapping[HEADER.size:HEADER.size + index_size].decode())
+    except ValueError:
+        return None
+
+    if index.get("schema") != schema:
+        return None
+
+    if key is not None and index.get("key") != key:
+        return None
+
+    data_start = HEADER.size + index_size
+    data_start += -data_start % ALIGNMENT
+
+    return ColumnarCache(mapping, data_start, index)
+
+
+def test():
+    """
+    Writes the columns of some records to a cache file, and reads them again.
+    """
+    import tempfile
+
+    from ...testing.testing import assert_value
+    from .columnar import to_columnar
+    from .exportable import Exportable
+    from .member_access import READ
+    from .members import ContinueReadMember, SubdataMember
+
+    class Entry(Exportable):
+        """ record with a ContinueReadMember """
+        data_format = (
+            (READ, "exists", ContinueReadMember("uint8_t")),
+            (READ, "name", "char[6]"),
+            (READ, "value_count", "uint8_t"),
+            (READ, "values", "int16_t[value_count]"),
+        )
+
+    class Root(Exportable):
+        """ list of entries """
+        data_format = (
+            (READ, "speed", "float"),
+            (READ, "entries", SubdataMember(ref_type=Entry, length=3)),
+        )
+
+    raw = struct.pack("<f", 2.5)
+    raw += struct.pack("<B6sB2h", 1, b"first", 2, 4, -5)
+    raw += struct.pack("<B", 0)
+    raw += struct.pack("<B6sB", 1, b"", 0)
+
+    root = Root()
+    root.read(raw, 0)
+    table = to_columnar(root).table
+
+    schema = schema_fingerprint(Root)
+    assert_value(schema == schema_fingerprint(Entry), False)
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        filename = os.path.join(tmpdirname, "test.columns")
+        assert_value(open_cache(filename, schema), None)
+
+        write_cache(filename, schema, "key", table)
+        assert_value(open_cache(filename, schema, "other key"), None)
+        assert_value(open_cache(filename, schema_fingerprint(Entry)), None)
+
+        loaded = open_cache(filename, schema, "key").root(Root)[0]
+        assert_value(loaded.speed, 2.5)
+        assert_value(loaded.entries[0].name, "first")
+        assert_value(loaded.entries[0].values, (4, -5))
+        assert_value(loaded.entries[1].exists, ContinueReadMember.Result.ABORT)
+        assert_value(loaded.entries[1].values, 0)
+        assert_value(loaded.entries[2].values, ())
+
+        def members(obj):
+            """ the stored members of the object """
+            if isinstance(obj, list):
+                return [members(entry) for entry in obj]
+            if not isinstance(obj, Exportable):
+                return obj
+            return {key: members(value) for key, value in vars(obj).items()}
+
+        assert_value(members(loaded.materialize()), members(root))
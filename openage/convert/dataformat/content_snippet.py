@@ -45,6 +45,13 @@ class ContentSnippet:
             self.generate_content()
         return self.data
 
+    def get_data_chunks(self):
+        """
+        return the snippet content as an iterable of strings.
+        subclasses may generate them while they are written.
+        """
+        return (self.get_data(),)
+
     def generate_content(self):
         # no generation needed by default
         pass
@@ -0,0 +1,82 @@
+# Copyright 2015-2015 the openage authors. See copying.md for legal info.
+
+# TODO pylint: disable=C,R
+
+from .content_snippet import ContentSnippet, SectionType
+
+
+class CSVSnippet(ContentSnippet):
+    """
+    the csv data of a DataDefinition.
+
+    the csv lines are generated in chunks while the snippet is written,
+    so the whole text never has to be in memory.
+    """
+
+    def __init__(self, definition, delimiter, file_name):
+        super().__init__(None, file_name, SectionType.section_body,
+                         orderby=definition.name_struct,
+                         reprtxt="csv for %s" % definition.name_struct)
+        self.data_ready = False
+
+        self.definition = definition
+        self.delimiter = delimiter
+
+    def get_data_chunks(self):
+        if self.data_ready:
+            return (self.data,)
+
+        return self.definition.csv_chunks(self.delimiter)
+
+    def generate_content(self):
+        self.data = "".join(self.definition.csv_chunks(self.delimiter))
+        self.data_ready = True
+
+    def __hash__(self):
+        return hash((
+            id(self.definition),
+            self.file_name,
+            self.section,
+        ))
+
+    def __eq__(self, other):
+        return (
+            type(other) is type(self) and
+            self.definition is other.definition and
+            self.file_name == other.file_name
+        )
+
+
+def test():
+    """
+    Generates the csv text of some data in chunks.
+    """
+    from ...testing.testing import assert_value
+    from .data_definition import DataDefinition
+    from .data_formatter import DataFormatter
+    from .exportable import Exportable
+    from .member_access import READ_EXPORT
+
+    class Entry(Exportable):
+        name_struct        = "entry"
+        name_struct_file   = "entry"
+        struct_description = "test entry\nwith two lines"
+
+        data_format = (
+            (READ_EXPORT, "value", "int16_t"),
+            (READ_EXPORT, "name", "char[8]"),
+        )
+
+    data = [{"value": idx, "name": "a,b\\%d" % idx} for idx in range(5)]
+    definition = DataDefinition(Entry, data, "test/entries")
+
+    snippet, = definition.generate_csv(DataFormatter)
+    chunks = list(definition.csv_chunks(",", chunk_rows=2))
+
+    assert_value(len(chunks), 4)
+    assert_value(chunks[2], "2,a\\,b\\\\2\n3,a\\,b\\\\3\n")
+    assert_value(snippet.get_data(), "".join(chunks))
+    assert_value(snippet.get_data().split("\n")[:4], [
+        "# struct entry", "# test entry", "# with two lines",
+        "# int16_t,std::string[8]",
+    ])
@@ -3,10 +3,14 @@
 # TODO pylint: disable=C,R
 
 import os.path
+from operator import itemgetter
+import struct
 
-from .content_snippet import ContentSnippet, SectionType
+from .binary_snippet import BinarySnippet, StringHeap, TABLE_HEADER, TABLE_MAGIC
+from .csv_snippet import CSVSnippet
 from .generated_file import GeneratedFile
-from .members import EnumMember, MultisubtypeMember
+from .members import (EnumMember, MultisubtypeMember, NumberMember,
+                      ContinueReadMember, CharArrayMember)
 from .util import encode_value, commentify_lines
 from .struct_definition import StructDefinition
 
@@ -27,82 +31,265 @@ class DataDefinition(StructDefinition):
 
     def generate_csv(self, genfile):
         """
-        create a text snippet to represent the csv data
+        create a text snippet to represent the csv data.
+
+        the csv text is generated while the snippet is written,
+        see csv_chunks.
         """
 
-        member_types = self.members.values()
-        csv_column_types = list()
+        return [CSVSnippet(self, genfile.DELIMITER, self.get_snippet_file_name())]
+
+    def generate_binary(self, genfile):
+        """
+        create a snippet for the binary table of the data,
+        see binary_snippet.py.
+        """
+
+        del genfile  # unused
 
-        # create column types line entries as comment in the csv file
-        for c_type in member_types:
-            csv_column_types.append(repr(c_type))
+        return [BinarySnippet(self, self.get_snippet_file_name())]
+
+    def get_snippet_file_name(self):
+        """
+        the name of the file where the data snippets are placed in.
+        """
+
+        if self.prefix:
+            return self.prefix + self.name_data_file
+        else:
+            return self.name_data_file
+
+    def relpath(self, file_name):
+        """
+        make the referenced file_name relative to the current file name.
+        """
+
+        return os.path.relpath(file_name, os.path.dirname(self.name_data_file))
+
+    def csv_chunks(self, delimiter, chunk_rows=1024):
+        """
+        generate the csv text, in chunks of up to chunk_rows lines.
+        """
+
+        member_types = self.members.values()
 
-        # the resulting csv content
-        # begin with the csv information comment header
-        txt = [
+        # begin with the csv information comment header,
+        # the column types and names are comments as well.
+        yield "".join((
             "# struct ", self.name_struct, "\n",
             commentify_lines("# ", self.struct_description),
-            "# ", genfile.DELIMITER.join(csv_column_types), "\n",
-            "# ", genfile.DELIMITER.join(self.members.keys()), "\n",
-        ]
+            "# ", delimiter.join(repr(c_type) for c_type in member_types), "\n",
+            "# ", delimiter.join(self.members.keys()), "\n",
+        ))
+
+        encode_row = self.csv_row_encoder(delimiter)
+
+        # create csv data lines
+        for start in range(0, len(self.data), chunk_rows):
+            yield "".join([
+                encode_row(data_line) + "\n"
+                for data_line in self.data[start:start + chunk_rows]
+            ])
+
+    def csv_row_encoder(self, delimiter):
+        """
+        return a function that creates the csv line for a data entry
+        (without the newline).
+
+        the encoding of each column is determined once by its member type.
+        """
+
+        if not self.members:
+            return lambda data_line: ""
 
         from .multisubtype_base import MultisubtypeBaseFile
 
-        # create csv data lines:
-        for idx, data_line in enumerate(self.data):
-            row_entries = list()
-            for member_name, member_type in self.members.items():
-                entry = data_line[member_name]
-
-                make_relpath = False
-
-                # check if enum data value is valid
-                if isinstance(member_type, EnumMember):
-                    if not member_type.validate_value(entry):
-                        raise Exception("data entry %d '%s'"
-                                        " not a valid %s value" %
-                                        (idx, entry, repr(member_type)))
-
-                # insert filename to read this field
-                if isinstance(member_type, MultisubtypeMember):
-                    # subdata member stores the follow-up filename
-                    entry += GeneratedFile.output_preferences["csv"]["file_suffix"]
-                    make_relpath = True
-
-                if self.target == MultisubtypeBaseFile:
-                    # if the struct definition target is the multisubtype
-                    # base file, it already created the filename entry.
-                    # it needs to be made relative as well.
-                    if member_name == MultisubtypeBaseFile.data_format[1][1]:
-                        # only make the filename entry relative
-                        make_relpath = True
-
-                if make_relpath:
-                    # filename to reference to, make it relative to the
-                    # current file name
-                    entry = os.path.relpath(
-                        entry,
-                        os.path.dirname(self.name_data_file)
-                    )
+        # filenames are stored relative to the current file name
+        suffix = GeneratedFile.output_preferences["csv"]["file_suffix"]
+
+        def relpath(entry):
+            """ encode the relative path to the filename entry """
+            return encode_value(self.relpath(entry))
+
+        def subdata_relpath(entry):
+            """ encode the relative path to the file of a subdata member """
+            return relpath(entry + suffix)
 
+        encoders = list()
+        for member_name, member_type in self.members.items():
+            if isinstance(member_type, EnumMember):
+                encoders.append(self.enum_encoder(member_type))
+
+            elif isinstance(member_type, MultisubtypeMember):
+                # subdata member stores the follow-up filename
+                encoders.append(subdata_relpath)
+
+            elif (self.target == MultisubtypeBaseFile and
+                  member_name == MultisubtypeBaseFile.data_format[1][1]):
+                # if the struct definition target is the multisubtype
+                # base file, it already created the filename entry.
+                # it needs to be made relative as well.
+                encoders.append(relpath)
+
+            elif isinstance(member_type, NumberMember):
+                # numbers don't need escaping
+                encoders.append(str)
+
+            else:
                 # encode each data field, to escape newlines and commas
-                row_entries.append(encode_value(entry))
+                encoders.append(encode_value)
+
+        member_names = list(self.members.keys())
+        if len(member_names) == 1:
+            get_entries = lambda data_line: (data_line[member_names[0]],)
+        else:
+            get_entries = itemgetter(*member_names)
 
-            # create one csv line, separated by DELIMITER (probably a ,)
-            txt.extend((genfile.DELIMITER.join(row_entries), "\n"))
+        def encode_row(data_line):
+            """ create one csv line, separated by the delimiter """
+            return delimiter.join([
+                encode(entry)
+                for encode, entry in zip(encoders, get_entries(data_line))
+            ])
 
-        if self.prefix:
-            snippet_file_name = self.prefix + self.name_data_file
+        return encode_row
+
+    def binary_chunks(self, chunk_rows=1024):
+        """
+        generate the binary table, in chunks of up to chunk_rows rows.
+        """
+
+        row_struct = struct.Struct(self.get_binary_layout()[0])
+        strings = StringHeap()
+        encode_row = self.binary_row_encoder(row_struct, strings)
+
+        yield TABLE_HEADER.pack(TABLE_MAGIC, len(self.data),
+                                row_struct.size, len(self.members))
+
+        for start in range(0, len(self.data), chunk_rows):
+            yield b"".join([
+                encode_row(data_line)
+                for data_line in self.data[start:start + chunk_rows]
+            ])
+
+        # the strings are known after all rows have been encoded.
+        yield bytes(strings.data)
+
+    def binary_row_encoder(self, row_struct, strings):
+        """
+        return a function that packs a data entry to a table row,
+        with its strings added to the strings heap.
+
+        numbers are packed as they are, the other columns are converted
+        first. the conversion of each column is determined once.
+        """
+
+        if not self.members:
+            return lambda data_line: b""
+
+        from .multisubtype_base import MultisubtypeBaseFile
+
+        csv_suffix = GeneratedFile.output_preferences["csv"]["file_suffix"]
+        suffix = GeneratedFile.output_preferences["bin"]["file_suffix"]
+
+        def subdata_filename(entry):
+            """ the relative path to the file of a subdata member """
+            return strings.add(self.relpath(entry + suffix))
+
+        def index_filename(entry):
+            """ the multisubtype base file stores csv file names """
+            if entry.endswith(csv_suffix):
+                entry = entry[:-len(csv_suffix)] + suffix
+
+            return strings.add(self.relpath(entry))
+
+        # (column index, conversion function)
+        converters = list()
+
+        for idx, (member_name, member_type) in enumerate(self.members.items()):
+            if isinstance(member_type, ContinueReadMember):
+                converters.append((idx, self.continue_converter(member_type)))
+
+            elif isinstance(member_type, EnumMember):
+                converters.append((idx, self.enum_encoder(
+                    member_type, {value: value_idx for value_idx, value in reversed(
+                        list(enumerate(member_type.values)))}.__getitem__)))
+
+            elif isinstance(member_type, MultisubtypeMember):
+                converters.append((idx, subdata_filename))
+
+            elif (self.target == MultisubtypeBaseFile and
+                  member_name == MultisubtypeBaseFile.data_format[1][1]):
+                converters.append((idx, index_filename))
+
+            elif isinstance(member_type, CharArrayMember):
+                if member_type.is_dynamic_length():
+                    converters.append((idx, strings.add))
+                else:
+                    converters.append((idx, lambda entry: entry.encode("utf-8")))
+
+            elif isinstance(member_type, NumberMember):
+                # numbers are stored as they are.
+                continue
+
+            else:
+                raise Exception("%s: can't store %s in binary tables" % (
+                    self.name_data_file, repr(member_type)))
+
+        member_names = list(self.members.keys())
+        if len(member_names) == 1:
+            get_entries = lambda data_line: [data_line[member_names[0]]]
         else:
-            snippet_file_name = self.name_data_file
-
-        return [ContentSnippet(
-            "".join(txt),
-            snippet_file_name,
-            SectionType.section_body,
-            orderby=self.name_struct,
-            reprtxt="csv for %s" % self.name_struct,
-        )]
+            getter = itemgetter(*member_names)
+            get_entries = lambda data_line: list(getter(data_line))
+
+        pack = row_struct.pack
+
+        def encode_row(data_line):
+            """ pack one table row """
+            entries = get_entries(data_line)
+            for idx, convert in converters:
+                entries[idx] = convert(entries[idx])
+
+            return pack(*entries)
+
+        return encode_row
+
+    def continue_converter(self, member_type):
+        """
+        return the binary column conversion for a ContinueReadMember.
+        """
+
+        values = {
+            member_type.Result.ABORT:    0,
+            member_type.Result.CONTINUE: 1,
+        }
+
+        def convert(entry):
+            """ 0 if the following members are undefined """
+            try:
+                return values[entry]
+            except KeyError:
+                raise Exception("%s: unexpected value '%s' for %s" % (
+                    self.name_data_file, entry, repr(member_type))) from None
+
+        return convert
+
+    def enum_encoder(self, member_type, encode=encode_value):
+        """
+        return the column encoder for an enum member,
+        which checks if the data values are valid.
+        """
+
+        def encode_enum(entry):
+            """ encode the value, if it's valid """
+            if not member_type.validate_value(entry):
+                raise Exception("%s: data entry '%s' not a valid %s value" % (
+                    self.name_data_file, entry, repr(member_type)))
+
+            return encode(entry)
+
+        return encode_enum
 
     def __str__(self):
         ret = [
@@ -2,6 +2,8 @@
 
 # TODO pylint: disable=C,R
 
+from ...util.profiler import NULL_PROFILER
+
 from . import entry_parser
 from . import util
 from .generated_file import GeneratedFile
@@ -48,6 +50,34 @@ class DataFormatter:
 
 $parsers
 
+\treturn -1;
+}
+""",
+                ),
+            }
+        ),
+        "fill_binary": entry_parser.ParserMemberFunction(
+            func_name = "fill_binary",
+            templates = {
+                0: entry_parser.ParserTemplate(
+                    signature    = "int %sfill_binary(const char * /*row*/, const char * /*strings*/, size_t /*strings_size*/)",
+                    headers      = util.determine_header("size_t"),
+                    impl_headers = set(),
+                    template     = "$signature {\n\treturn -1;\n}"
+                ),
+                None: entry_parser.ParserTemplate(
+                    signature    = "int %sfill_binary(const char *row, const char *strings, size_t strings_size)",
+                    headers      = util.determine_header("size_t"),
+                    impl_headers = set(),
+                    template     = """$signature {
+\t// the columns are at fixed offsets in the row, see binary_snippet.py
+\t// strings are offsets in the string heap of the file,
+\t// which has strings_size bytes.
+\t(void)strings;
+\t(void)strings_size;
+
+$parsers
+
 \treturn -1;
 }
 """,
@@ -120,69 +150,128 @@ $parsers
 
             self.data.append(data_set)
 
-    def export(self, projectdir, requested_formats):
+    def export(self, projectdir, requested_formats, atomic=False,
+               profiler=NULL_PROFILER, obsolete_formats=()):
         """
         Generates files in the requested formats to projectdir.
 
         projectdir is a util.fslike.path.Path.
+
+        If atomic is set, each file is written to a temporary name first,
+        and then renamed.
+        The generation of each file is measured by profiler.
+
+        Files in the obsolete_formats that earlier exports have left in
+        projectdir are removed first, so they can't be mistaken for
+        the current data.
         """
+        # resolve data xrefs for all data sets, once for all formats.
+        # after that, the generated files are independent of each other.
+        for data_set in self.data:
+            data_set.dynamic_ref_update(self.typedefs)
+
+        for format_ in obsolete_formats:
+            for gen_file in self.get_generated_files(format_):
+                outpath = projectdir[gen_file.get_output_name()]
+                if outpath.is_file():
+                    outpath.unlink()
+
         # storage of all needed content snippets
         generate_files = list()
 
         for format_ in requested_formats:
-            files = dict()
+            generate_files.extend(self.get_generated_files(format_))
+
+        # find xref header includes
+        for gen_file in generate_files:
+            # only create headers for non-data files
+            if gen_file.format_ not in {"csv", "bin"}:
+                gen_file.create_xref_headers(generate_files)
+                gen_file.create_forward_declarations(generate_files)
+
+        # we now invoke the content generation for each generated file.
+        # the files are written one after the other: the generation holds
+        # the GIL, and the target directory is locked for each write anyway.
+        for gen_file in generate_files:
+            self.write_file(projectdir, gen_file, atomic, profiler)
 
-            snippets = list()
+    def get_generated_files(self, format_):
+        """
+        Returns the GeneratedFile objects for all stored data sets
+        in the given format, with their snippets assigned.
+        Their content isn't generated yet.
+        """
+        files = dict()
 
-            # iterate over all stored data sets and
-            # generate all data snippets for the requested output formats.
-            for data_set in self.data:
+        snippets = list()
 
-                # resolve data xrefs for this data_set
-                data_set.dynamic_ref_update(self.typedefs)
+        # iterate over all stored data sets and
+        # generate all data snippets for the requested output formats.
+        for data_set in self.data:
 
-                # generate one output chunk list for each requested format
-                if format_ == "csv":
-                    new_snippets = data_set.generate_csv(self)
+            # generate one output chunk list for each requested format
+            if format_ == "csv":
+                new_snippets = data_set.generate_csv(self)
 
-                elif format_ == "struct":
-                    new_snippets = data_set.generate_struct(self)
+            elif format_ == "bin":
+                new_snippets = data_set.generate_binary(self)
 
-                elif format_ == "structimpl":
-                    new_snippets = data_set.generate_struct_implementation(self)
+            elif format_ == "struct":
+                new_snippets = data_set.generate_struct(self)
 
-                else:
-                    raise Exception("unknown export format %s requested" % format_)
+            elif format_ == "structimpl":
+                new_snippets = data_set.generate_struct_implementation(self)
 
-                snippets.extend(new_snippets)
+            else:
+                raise Exception("unknown export format %s requested" % format_)
 
-            # create snippets for the encountered type definitions
-            for _, type_definition in sorted(self.typedefs.items()):
-                type_snippets = type_definition.get_snippets(type_definition.file_name, format_)
-                snippets.extend(type_snippets)
+            snippets.extend(new_snippets)
 
-            # assign all snippets to generated files
-            for snippet in snippets:
+        # create snippets for the encountered type definitions
+        for _, type_definition in sorted(self.typedefs.items()):
+            type_snippets = type_definition.get_snippets(type_definition.file_name, format_)
+            snippets.extend(type_snippets)
 
-                # if this file was not yet created, do it nao
-                if snippet.file_name not in files:
-                    files[snippet.file_name] = GeneratedFile(snippet.file_name, format_)
+        # assign all snippets to generated files
+        for snippet in snippets:
 
-                files[snippet.file_name].add_snippet(snippet)
+            # if this file was not yet created, do it nao
+            if snippet.file_name not in files:
+                files[snippet.file_name] = GeneratedFile(snippet.file_name, format_)
 
-            generate_files.extend(files.values())
+            files[snippet.file_name].add_snippet(snippet)
 
-        # files is currently a list of GeneratedFile objects.
+        return list(files.values())
 
-        # find xref header includes
-        for gen_file in generate_files:
-            # only create headers for non-data files
-            if gen_file.format_ not in {"csv"}:
-                gen_file.create_xref_headers(generate_files)
-                gen_file.create_forward_declarations(generate_files)
+    @staticmethod
+    def write_file(projectdir, gen_file, atomic, profiler=NULL_PROFILER):
+        """
+        Generates the content of gen_file, and writes it to projectdir.
 
-        # we now invoke the content generation for each generated file
-        for gen_file in generate_files:
-            file_name, content = gen_file.generate()
-            with projectdir[file_name].open('w') as outfile:
-                outfile.write(content)
+        The content is written while it is generated.
+        Returns the file name.
+        """
+        with profiler.measure("export %s" % gen_file.format_) as step:
+            file_name, chunks = gen_file.generate_chunks()
+            step.item = file_name
+
+            if atomic:
+                # interrupted runs don't leave incomplete files behind.
+                outpath = projectdir["%s.tmp" % file_name]
+            else:
+                outpath = projectdir[file_name]
+
+            # for text files, this counts the characters,
+            # which are mostly ascii.
+            size = 0
+            with outpath.open('wb' if gen_file.is_binary() else 'w') as outfile:
+                for chunk in chunks:
+                    outfile.write(chunk)
+                    size += len(chunk)
+
+            step.out_bytes = size
+
+            if atomic:
+                outpath.rename(projectdir[file_name])
+
+        return file_name
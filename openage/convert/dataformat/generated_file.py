@@ -27,6 +27,7 @@ class GeneratedFile:
         "file_suffix":    "",
         "content_prefix": Template(""),
         "content_suffix": Template(""),
+        "binary":         False,
     }
 
     # override the default preferences with the
@@ -36,6 +37,11 @@ class GeneratedFile:
             "folder":      "",
             "file_suffix": ".docx",
         },
+        "bin": {
+            "folder":      "",
+            "file_suffix": ".bin",
+            "binary":      True,
+        },
         "struct": {
             "file_suffix": ".gen.h",
             "content_prefix": Template("""#ifndef OPENAGE_${header_guard}_GEN_H_
@@ -92,6 +98,21 @@ namespace ${namespace} {
             for s in snippet.includes:
                 self.add_snippet(s, inherit_typedefs=False)
 
+    def is_binary(self):
+        """
+        true if the content chunks of this file are bytes.
+        """
+        return self.output_preferences[self.format_].get("binary", False)
+
+    def get_output_name(self):
+        """
+        the name of the file that is written, relative to the export dir.
+        """
+        prefs = self.default_preferences.copy()
+        prefs.update(self.output_preferences[self.format_])
+
+        return prefs["folder"] + '/' + self.file_name + prefs["file_suffix"]
+
     def get_include_snippet(self, file_name=True):
         """
         return a snippet with a header entry for this file to be able to include it.
@@ -139,6 +160,26 @@ namespace ${namespace} {
     def generate(self):
         """
         actually generate the content for this file.
+
+        returns (file_name, content).
+        """
+
+        file_name, chunks = self.generate_chunks()
+
+        if self.is_binary():
+            return file_name, b"".join(chunks)
+
+        return file_name, "".join(chunks)
+
+    def generate_chunks(self):
+        """
+        generate the content for this file, while it is written.
+
+        the snippets are ordered right away, but their content is only
+        created when the returned chunks are iterated.
+
+        returns (file_name, iterable of content strings),
+        or of bytes for binary formats.
         """
 
         # TODO: create new snippets for resolving cyclic dependencies (forward declarations)
@@ -153,6 +194,14 @@ namespace ${namespace} {
         if len(snippets_body) == 0:
             raise Exception("generated file %s has no body snippets!" % (repr(self)))
 
+        if prefs["binary"]:
+            # binary files are the data of their single snippet.
+            if len(snippets_body) != 1 or snippets_header:
+                raise Exception("binary file %s must consist of one snippet" % (repr(self)))
+
+            snippet, = snippets_body
+            return self.get_output_name(), snippet.get_data_chunks()
+
         # type references in this file that could not be resolved
         missing_types = set()
 
@@ -204,7 +253,6 @@ namespace ${namespace} {
 
         # merge file contents
         header_data = "".join(header.get_data() for header in snippets_header_sorted)
-        file_data   = "\n".join(snippet.get_data() for snippet in snippets_body_sorted)
 
         namespace    = self.namespace
         header_guard = "".join((namespace.upper(), "_", self.file_name.replace("/", "_").upper()))
@@ -213,11 +261,19 @@ namespace ${namespace} {
         content_prefix = prefs["content_prefix"].substitute(header_guard=header_guard, namespace=namespace, headers=header_data)
         content_suffix = prefs["content_suffix"].substitute(header_guard=header_guard, namespace=namespace)
 
-        # this is the final file content
-        file_data = "".join((content_prefix, file_data, content_suffix))
+        def chunks():
+            """ the final file content """
+            yield content_prefix
+
+            for idx, snippet in enumerate(snippets_body_sorted):
+                if idx > 0:
+                    yield "\n"
+                yield from snippet.get_data_chunks()
+
+            yield content_suffix
 
         # whee, return (file_name, content)
-        return prefs["folder"] + '/' + self.file_name + prefs["file_suffix"], file_data
+        return self.get_output_name(), chunks()
 
     def __repr__(self):
         return "GeneratedFile<%s>(file_name=%s)" % (self.format_, self.file_name)
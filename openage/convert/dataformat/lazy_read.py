@@ -0,0 +1,230 @@
+# Copyright 2015-2015 the openage authors. See copying.md for legal info.
+
+"""
+Selective reading of Exportables.
+
+Only the requested subdata lists of an object are read; the others are
+skipped (see ReadPlan.skip), and replaced by LazyMembers which read them
+when they are first used.
+"""
+
+from threading import Lock
+from weakref import ref
+
+from .read_plan import get_read_plan, SubdataStep
+
+
+def section_names(cls):
+    """
+    Returns the names of the subdata members of the Exportable class,
+    which can be read lazily.
+    """
+    names = []
+
+    plan = get_read_plan(cls)
+    while plan is not None:
+        names.extend(step.name for step in plan.steps
+                     if isinstance(step, SubdataStep))
+        plan = plan.rest
+
+    return names
+
+
+def detached_source(obj, step):
+    """
+    Returns a new object of the type of obj, that holds only the members
+    of obj which the step requires for reading (the length members etc.),
+    or all members read so far if they can't be determined.
+    """
+    names = step.references
+    if names is None:
+        names = vars(obj)
+
+    source = type(obj).__new__(type(obj))
+    source.__dict__.update((name, value) for name, value in vars(obj).items()
+                           if name in names)
+    return source
+
+
+class LazyMember:
+    """
+    Stands in for the subdata member of obj that was skipped at offset.
+
+    On first use, the member is read, and replaces the LazyMember in obj.
+    The read requires the length members etc. that were read before it;
+    a copy of them is kept, so obj may be modified in the meantime.
+    obj itself is only weakly referenced.
+
+    The first use may happen in multiple threads at once,
+    the member is read only once.
+    """
+
+    def __init__(self, obj, step, raw, offset):
+        self.owner = ref(obj)
+        self.source = detached_source(obj, step)
+        self.step = step
+        self.raw = raw
+        self.offset = offset
+        self.value = None
+        self.lock = Lock()
+
+    def load(self):
+        """
+        Reads the member, if that hasn't happened yet, and returns it.
+        """
+        if self.value is None:
+            with self.lock:
+                if self.value is None:
+                    self.read()
+
+        return self.value
+
+    def read(self):
+        """
+        Reads the member, and replaces the LazyMember in the owner object.
+        """
+        self.step.read(self.source, self.raw, self.offset)
+        value = getattr(self.source, self.step.name)
+
+        # the source data is no longer needed.
+        self.source = None
+        self.raw = None
+
+        obj = self.owner()
+        if obj is not None and getattr(obj, self.step.name, None) is self:
+            setattr(obj, self.step.name, value)
+
+        self.value = value
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+
+        return getattr(self.load(), name)
+
+    def __len__(self):
+        return len(self.load())
+
+    def __getitem__(self, key):
+        return self.load()[key]
+
+    def __iter__(self):
+        return iter(self.load())
+
+    def __contains__(self, item):
+        return item in self.load()
+
+    def __eq__(self, other):
+        return self.load() == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        if self.value is None:
+            return "LazyMember(%s at offset %d)" % (self.step.name, self.offset)
+
+        return repr(self.value)
+
+
+def read_selected(obj, raw, offset, names):
+    """
+    Reads obj from the read_source.ReadSource raw at offset,
+    but only the subdata members in names; the others are LazyMembers.
+
+    raw must allow random access, e.g. a MemorySource.
+
+    Returns the offset after the data.
+    """
+    unknown = set(names) - set(section_names(type(obj)))
+    if unknown:
+        raise ValueError("%s has no sections %s" % (
+            type(obj).__name__, ", ".join(sorted(unknown))))
+
+    def read_step(step, obj, raw, offset):
+        """ reads the step, or skips it if it's an unwanted section """
+        if isinstance(step, SubdataStep) and step.name not in names:
+            setattr(obj, step.name, LazyMember(obj, step, raw, offset))
+            return step.skip(obj, raw, offset)
+
+        return step.read(obj, raw, offset)
+
+    return get_read_plan(type(obj)).read_steps(obj, raw, offset, read_step)
+
+
+def test():
+    """
+    Reads a record with only some of its lists.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    import struct
+    import time
+
+    from ...testing.testing import assert_value, assert_raises, result
+    from .exportable import Exportable
+    from .member_access import READ
+    from .members import SubdataMember
+    from .read_source import MemorySource
+
+    class Entry(Exportable):
+        """ entry with a dynamic-length member """
+        data_format = (
+            (READ, "value_count", "uint8_t"),
+            (READ, "values", "int16_t[value_count]"),
+        )
+
+    class Record(Exportable):
+        """ record with two lists """
+        data_format = (
+            (READ, "first_count", "uint8_t"),
+            (READ, "first", SubdataMember(ref_type=Entry, length="first_count")),
+            (READ, "second_count", "uint8_t"),
+            (READ, "second", SubdataMember(ref_type=Entry, length="second_count")),
+            (READ, "end", "uint8_t"),
+        )
+
+    data = struct.pack("<BBhBhhB", 2, 1, -1, 2, 3, 4, 1)
+    data += struct.pack("<BB", 0, 42)
+    raw = MemorySource(data)
+
+    assert_value(section_names(Record), ["first", "second"])
+
+    record = Record()
+    assert_value(read_selected(record, raw, 0, {"second"}), len(data))
+    assert_value(record.end, 42)
+    assert_value(record.second[0].values, ())
+    assert_value(type(record.first), LazyMember)
+
+    # the skipped list doesn't refer back to the record
+    lazy = record.first
+    assert_value(record in vars(lazy.source).values(), False)
+    assert_value(sorted(vars(lazy.source)), ["first_count"])
+
+    # the skipped list is read on first use, even if the record is modified
+    record.first_count = 0
+    assert_value(len(record.first), 2)
+    assert_value(record.first[1].values, (3, 4))
+    assert_value(type(record.first), list)
+    assert_value(lazy.source, None)
+
+    # concurrent first uses read the list once
+    record = Record()
+    read_selected(record, raw, 0, {"second"})
+    lazy = record.first
+    reads = []
+    read = lazy.read
+
+    def slow_read():
+        """ gives the other threads time to start reading as well """
+        time.sleep(0.05)
+        reads.append(read())
+
+    lazy.read = slow_read
+
+    with ThreadPoolExecutor(4) as pool:
+        lengths = list(pool.map(lambda _: len(lazy), range(8)))
+
+    assert_value(lengths, [2] * 8)
+    assert_value(len(reads), 1)
+
+    with assert_raises(ValueError):
+        result(read_selected(Record(), raw, 0, {"third"}))
@@ -11,6 +11,21 @@ from .struct_snippet import StructSnippet
 from .util import determine_headers, determine_header
 
 
+def binary_string_parser(idx, offset, target):
+    """
+    return the lines that assign the string at offset in the binary
+    table row to target. the string heap offset is checked,
+    invalid ones make the parser return the column number idx.
+    """
+    return [
+        "{",
+        "\tconst char *str = openage::util::read_binary_string(row, %d, strings, strings_size);" % offset,
+        "\tif (str == nullptr) { return %d; }" % idx,
+        "\t%s = str;" % target,
+        "}",
+    ]
+
+
 class DataMember:
     """
     member variable of data files and generated structs.
@@ -28,6 +43,21 @@ class DataMember:
     def get_parsers(self, idx, member):
         raise NotImplementedError("implement the parser generation for the member type %s" % type(self))
 
+    def get_binary_type(self):
+        """
+        return the struct module format of this member's column
+        in binary data tables (see binary_snippet.py).
+        """
+        raise NotImplementedError("implement the binary column type for the member type %s" % type(self))
+
+    def get_binary_parsers(self, idx, offset, member):
+        """
+        return the parsers that fill the member from its binary column,
+        which is at offset in the table row. idx is the column number,
+        which is returned when the column can't be read.
+        """
+        raise NotImplementedError("implement the binary parser generation for the member type %s" % type(self))
+
     def get_headers(self, output_target):
         raise NotImplementedError("return needed headers for %s for a given output target" % type(self))
 
@@ -240,6 +270,20 @@ class NumberMember(DataMember):
         "float":         "f",
     }
 
+    # primitive types -> struct module format for binary columns
+    type_binary_lookup = {
+        "char":          "b",
+        "int8_t":        "b",
+        "uint8_t":       "B",
+        "int16_t":       "h",
+        "uint16_t":      "H",
+        "int":           "i",
+        "int32_t":       "i",
+        "uint":          "I",
+        "uint32_t":      "I",
+        "float":         "f",
+    }
+
     def __init__(self, number_def):
         super().__init__()
         if number_def not in self.type_scan_lookup:
@@ -260,6 +304,20 @@ class NumberMember(DataMember):
             )
         ]
 
+    def get_binary_type(self):
+        return self.type_binary_lookup[self.number_type]
+
+    def get_binary_parsers(self, idx, offset, member):
+        return [
+            EntryParser(
+                ["this->%s = openage::util::read_binary_value<%s>(row, %d);" % (
+                    member, self.number_type, offset)],
+                headers     = determine_header("read_binary_value"),
+                typerefs    = set(),
+                destination = "fill_binary",
+            )
+        ]
+
     def get_headers(self, output_target):
         if "struct" == output_target:
             return determine_header(self.number_type)
@@ -320,6 +378,21 @@ class ContinueReadMember(NumberMember):
     def get_empty_value(self):
         return 0
 
+    def get_binary_type(self):
+        # 0 if the following members are undefined, 1 otherwise
+        return "B"
+
+    def get_binary_parsers(self, idx, offset, member):
+        return [
+            EntryParser(
+                ["this->%s = openage::util::read_binary_value<uint8_t>(row, %d);" % (
+                    member, offset)],
+                headers     = determine_header("read_binary_value"),
+                typerefs    = set(),
+                destination = "fill_binary",
+            )
+        ]
+
     def get_parsers(self, idx, member):
         entry_parser_txt = (
             "//remember if the following members are undefined",
@@ -379,6 +452,36 @@ class EnumMember(RefMember):
             )
         ]
 
+    def get_binary_type(self):
+        # the index of the value in self.values
+        return "i"
+
+    def get_binary_parsers(self, idx, offset, member):
+        enum_parser = [
+            "// parse enum %s" % (self.type_name),
+            "switch (openage::util::read_binary_value<int32_t>(row, %d)) {" % (offset),
+        ]
+        for value_idx, enum_value in enumerate(self.values):
+            enum_parser.append(
+                "case %d: this->%s = %s::%s; break;" % (value_idx, member, self.type_name, enum_value)
+            )
+
+        # unknown enum indices make the parser return the column number.
+        enum_parser.extend([
+            "default:",
+            "\treturn %d;" % (idx),
+            "}",
+        ])
+
+        return [
+            EntryParser(
+                enum_parser,
+                headers     = determine_headers(("read_binary_value",)),
+                typerefs    = set(),
+                destination = "fill_binary",
+            )
+        ]
+
     def get_headers(self, output_target):
         return set()
 
@@ -489,6 +592,36 @@ class CharArrayMember(DynLengthMember):
             )
         ]
 
+    def get_binary_type(self):
+        if self.is_dynamic_length():
+            # offset in the string heap
+            return "I"
+        else:
+            return "%ds" % self.get_length()
+
+    def get_binary_parsers(self, idx, offset, member):
+        headers = determine_header("read_binary_value")
+
+        if self.is_dynamic_length():
+            lines = binary_string_parser(idx, offset, "this->%s" % member)
+        else:
+            data_length = self.get_length()
+            lines = [
+                "strncpy(this->%s, row + %d, %d); this->%s[%d] = '\\0';" % (
+                    member, offset, data_length, member, data_length - 1
+                )
+            ]
+            headers |= determine_header("strncpy")
+
+        return [
+            EntryParser(
+                lines,
+                headers     = headers,
+                typerefs    = set(),
+                destination = "fill_binary",
+            )
+        ]
+
     def get_headers(self, output_target):
         ret = set()
 
@@ -560,6 +693,20 @@ class MultisubtypeMember(RefMember, DynLengthMember):
             for contained_type in self.class_lookup.values()
         }
 
+    def get_binary_type(self):
+        # offset of the filename in the string heap
+        return "I"
+
+    def get_binary_parsers(self, idx, offset, member):
+        return [
+            EntryParser(
+                binary_string_parser(idx, offset, "this->%s.index_file.filename" % member),
+                headers     = determine_header("read_binary_value"),
+                typerefs    = set(),
+                destination = "fill_binary",
+            )
+        ]
+
     def get_parsers(self, idx, member):
         return [
             EntryParser(
@@ -621,6 +768,9 @@ class MultisubtypeMember(RefMember, DynLengthMember):
                 "int %s::fill(char * /*line*/) {\n" % (self.type_name),
                 "\treturn -1;\n",
                 "}\n",
+                "int %s::fill_binary(const char * /*row*/, const char * /*strings*/, size_t /*strings_size*/) {\n" % (self.type_name),
+                "\treturn -1;\n",
+                "}\n",
             ))
 
             # function to recursively read the referenced files
@@ -704,6 +854,16 @@ class SubdataMember(MultisubtypeMember):
     def get_effective_type(self):
         return "openage::util::subdata<%s>" % (self.get_subtype())
 
+    def get_binary_parsers(self, idx, offset, member):
+        return [
+            EntryParser(
+                binary_string_parser(idx, offset, "this->%s.filename" % member),
+                headers     = determine_header("read_binary_value"),
+                typerefs    = set(),
+                destination = "fill_binary",
+            )
+        ]
+
     def get_parsers(self, idx, member):
         return [
             EntryParser(
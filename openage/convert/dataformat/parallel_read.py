@@ -0,0 +1,198 @@
+# Copyright 2015-2015 the openage authors. See copying.md for legal info.
+
+"""
+Reads the subdata lists of an Exportable in worker processes.
+
+The offsets in the data (like the graphic_offsets of empires.dat) don't
+point into the decompressed data, so the entry boundaries are found by
+skimming: the parent process skips through the data (see ReadPlan.skip),
+reading only the members that determine the data sizes.
+The entries of the top-level subdata lists are split into chunks of
+roughly equal size, which are read by the workers; the parent stitches
+the results back together in the original order.
+"""
+
+import os
+from multiprocessing import Pool
+
+from .read_plan import get_read_plan, get_entry_reader, SubdataStep
+from .read_source import MemorySource
+
+
+# the data that is read by the worker processes, see init_worker.
+_data = None
+
+
+def init_worker(data):
+    """
+    Stores the data in the worker process, so it is transferred only once.
+    """
+    global _data  # pylint: disable=global-statement
+    _data = data
+
+
+def read_chunk(cls, offset, count, varargs):
+    """
+    Reads count entries of cls from the worker data, starting at offset.
+
+    Returns the entries, and the offset after them.
+    """
+    raw = MemorySource(_data)
+    reader = get_entry_reader(cls)
+
+    entries = []
+    for _ in range(count):
+        entry = cls(**varargs)
+        offset = reader(entry, raw, offset)
+        entries.append(entry)
+
+    return entries, offset
+
+
+class ParallelReader:
+    """
+    Reads an Exportable from data, with its top-level subdata lists
+    read by the pool, in chunks of about chunk_size bytes.
+    """
+
+    def __init__(self, data, pool, chunk_size):
+        self.raw = MemorySource(data)
+        self.pool = pool
+        self.chunk_size = chunk_size
+
+        # (obj, member name, [(async result, expected end offset)])
+        self.pending = []
+
+    def read(self, obj, offset):
+        """
+        Reads obj at offset. Returns the offset after its data.
+        """
+        offset = get_read_plan(type(obj)).read_steps(obj, self.raw, offset,
+                                                     self.read_step)
+
+        for target, name, chunks in self.pending:
+            entries = []
+            for result, end in chunks:
+                chunk, chunk_end = result.get()
+                if chunk_end != end:
+                    raise Exception("%s: skimmed entries end at %d, "
+                                    "but were read up to %d" % (
+                                        name, end, chunk_end))
+                entries.extend(chunk)
+
+            setattr(target, name, entries)
+
+        self.pending.clear()
+
+        return offset
+
+    def read_step(self, step, obj, raw, offset):
+        """
+        Reads the step, or schedules it if it's a subdata list.
+        """
+        if isinstance(step, SubdataStep) and step.single_type:
+            return self.schedule(step, obj, offset)
+
+        return step.read(obj, raw, offset)
+
+    def schedule(self, step, obj, offset):
+        """
+        Skims the entries of the subdata step, and submits them
+        to the pool in chunks.
+        """
+        cls = step.var_type.class_lookup[None]
+        varargs = {name: getattr(obj, name) for name in step.passed_args}
+
+        chunks = []
+        chunk_start = offset
+        count = 0
+
+        for offset in step.skim(obj, self.raw, offset):
+            count += 1
+
+            if offset - chunk_start >= self.chunk_size:
+                chunks.append((chunk_start, count, offset))
+                chunk_start = offset
+                count = 0
+
+        if count:
+            chunks.append((chunk_start, count, offset))
+
+        setattr(obj, step.name, [])
+        self.pending.append((obj, step.name, [
+            (self.pool.apply_async(read_chunk, (cls, start, count, varargs)), end)
+            for start, count, end in chunks
+        ]))
+
+        return offset
+
+
+def read_parallel(obj, data, offset=0, jobs=None, chunk_size=None):
+    """
+    Reads the Exportable obj from the bytes-like data at offset,
+    using jobs worker processes (default: one per cpu).
+
+    Returns the offset after the read data.
+    """
+    if jobs is None:
+        jobs = os.cpu_count()
+
+    if chunk_size is None:
+        # a few chunks per worker, to balance the load.
+        chunk_size = max(64 * 1024, len(data) // (jobs * 4))
+
+    with Pool(jobs, initializer=init_worker, initargs=(data,)) as pool:
+        return ParallelReader(data, pool, chunk_size).read(obj, offset)
+
+
+def test():
+    """
+    Reads a record with subdata lists in parallel,
+    and compares it to the sequential read.
+    """
+    import random
+    import struct
+
+    from ...testing.testing import assert_value
+    from ..gamedata.sound import Sound
+    from .exportable import Exportable
+    from .member_access import READ
+    from .members import SubdataMember
+
+    class Record(Exportable):
+        """ record with a list of sounds, some of which are omitted """
+        data_format = (
+            (READ, "sound_count", "uint16_t"),
+            (READ, "sound_offsets", "uint32_t[sound_count]"),
+            (READ, "sounds", SubdataMember(
+                ref_type=Sound,
+                length="sound_count",
+                offset_to=("sound_offsets", lambda o: o > 0),
+            )),
+            (READ, "end", "uint8_t"),
+        )
+
+    rng = random.Random(1337)
+    offsets = [rng.randint(0, 3) for _ in range(200)]
+
+    data = struct.pack("<H%dI" % len(offsets), len(offsets), *offsets)
+    for idx, sound_offset in enumerate(offsets):
+        if sound_offset:
+            item_count = rng.randint(0, 5)
+            data += struct.pack("<hhHi", idx, 0, item_count, 300000)
+            for _ in range(item_count):
+                data += struct.pack("<13sihhh", b"sound.wav", idx, 1, 2, 0)
+    data += b"\x2a"
+
+    expected = Record()
+    expected.read(data, 0)
+
+    record = Record()
+    assert_value(read_parallel(record, data, jobs=2, chunk_size=500), len(data))
+    assert_value(record.end, 42)
+    assert_value(len(record.sounds), len(expected.sounds))
+
+    for sound, expected_sound in zip(record.sounds, expected.sounds):
+        assert_value(sound.id, expected_sound.id)
+        assert_value([item.resource_id for item in sound.sound_items],
+                     [item.resource_id for item in expected_sound.sound_items])
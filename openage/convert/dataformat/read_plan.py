@@ -0,0 +1,779 @@
+# Copyright 2015-2015 the openage authors. See copying.md for legal info.
+
+"""
+Compiled read plans for Exportable.read.
+
+The data_format of an Exportable class is translated to a list of read steps
+once, instead of interpreting the member definitions for each record:
+consecutive members of static size are read with one struct.Struct,
+members of dynamic length and subdata lists are separate steps.
+
+Plans can also skip over their data (see ReadPlan.skip): only the members
+that determine the size of the data are read then.
+"""
+
+import math
+import struct
+from operator import itemgetter
+
+from ...util.strings import decode_until_null
+
+from .member_access import READ, READ_EXPORT, READ_UNKNOWN
+from .members import (IncludeMembers, ContinueReadMember, MultisubtypeMember,
+                      GroupMember, SubdataMember, DataMember, DynLengthMember)
+from .struct_definition import vararray_match, integer_match
+from .util import struct_type_lookup
+
+
+# the member access modes that are read from the binary data
+READ_MODES = (True, READ_EXPORT, READ, READ_UNKNOWN)
+
+# exportable class -> ReadPlan
+_plans = {}
+
+
+def get_read_plan(cls):
+    """
+    Returns the (cached) read plan for the Exportable class.
+    """
+    try:
+        return _plans[cls]
+    except KeyError:
+        pass
+
+    plan = ReadPlan(cls.get_data_format(allowed_modes=READ_MODES,
+                                        flatten_includes=False),
+                    cls.__name__)
+    _plans[cls] = plan
+    return plan
+
+
+def tuple_getter(indices):
+    """
+    Like itemgetter, but always returns a tuple.
+    """
+    if len(indices) == 1:
+        idx = indices[0]
+        return lambda values: (values[idx],)
+
+    return itemgetter(*indices)
+
+
+def length_references(length):
+    """
+    Returns the set of member names that the length definition of a
+    DynLengthMember may refer to, or None if that can't be determined.
+    """
+    if isinstance(length, int) or length is DynLengthMember.any_length:
+        return set()
+
+    if isinstance(length, str):
+        return {length}
+
+    # a length lambda like `lambda o: "count" if o.used else 0` refers to
+    # the attributes it accesses and to the names it returns.
+    code = getattr(length, "__code__", None)
+    if code is None:
+        return None
+
+    return set(code.co_names) | {const for const in code.co_consts
+                                 if isinstance(const, str)}
+
+
+def empty_value(var_type):
+    """
+    The value of members that were not read because of a ContinueReadMember.
+    """
+    if isinstance(var_type, DataMember):
+        return var_type.get_empty_value()
+
+    return 0
+
+
+class Field:
+    """
+    A member that is read from the binary data, e.g. an int32_t or a char[30].
+
+    count is the number of values, or for dynamic-length members,
+    a function that determines it from the object that is read.
+    """
+
+    def __init__(self, export, name, var_type, owner):
+        self.name = name
+        self.unknown = export == READ_UNKNOWN
+
+        if isinstance(var_type, str):
+            self.custom = None
+            is_array = vararray_match.match(var_type)
+
+            if is_array:
+                struct_type = is_array.group(1)
+                count = is_array.group(2)
+                if struct_type == "char":
+                    struct_type = "char[]"
+
+                if integer_match.match(count):
+                    self.count = int(count)
+                    self.references = set()
+                else:
+                    # dynamic length specified by member name
+                    self.count = lambda obj, count=count: getattr(obj, count)
+                    self.references = {count}
+            else:
+                struct_type = var_type
+                self.count = 1
+                self.references = set()
+
+        elif isinstance(var_type, DataMember):
+            struct_type = var_type.raw_type
+            self.custom = var_type
+
+            if (isinstance(var_type, DynLengthMember) and
+                    var_type.is_dynamic_length()):
+                self.count = var_type.get_length
+                self.references = length_references(var_type.length)
+            else:
+                self.count = var_type.get_length()
+                self.references = set()
+
+        else:
+            raise Exception("unknown data member definition %s for "
+                            "member '%s'" % (var_type, name))
+
+        self.var_type = var_type
+
+        if struct_type not in struct_type_lookup:
+            raise Exception("%s: member %s requests unknown data type %s" % (
+                owner, name, struct_type))
+
+        self.symbol = struct_type_lookup[struct_type]
+
+        if self.is_static():
+            self.check_count(self.count)
+
+        # the values are processed further by convert().
+        # plain scalars are just stored.
+        self.plain = (
+            self.custom is None and not self.unknown and
+            self.symbol != "s" and self.count == 1
+        )
+
+        if self.custom is not None:
+            self.verify = (type(self.custom).verify_read_data
+                           is not DataMember.verify_read_data)
+            self.hook = (type(self.custom).entry_hook
+                         is not DataMember.entry_hook)
+
+    def is_static(self):
+        """
+        True if the number of values is known in advance.
+        """
+        return isinstance(self.count, int)
+
+    def check_count(self, count):
+        """
+        Raises if the count is invalid.
+        """
+        if count < 0:
+            raise Exception("invalid length %d < 0 in %s for member '%s'" % (
+                count, self.var_type, self.name))
+
+    def value_count(self, count):
+        """
+        Number of values that the struct unpacks for this member.
+        """
+        if self.symbol == "s":
+            return 1
+
+        return count
+
+    def convert(self, obj, result, offset, count):
+        """
+        Stores the result tuple of unpacking this member, which was
+        read at offset, in obj.
+        """
+        if self.unknown:
+            # for unknown variables, generate uid for the unknown memory location
+            name = "unknown-0x%08x" % offset
+        else:
+            name = self.name
+
+        if self.custom is not None and self.verify:
+            if not self.custom.verify_read_data(obj, result):
+                raise Exception("invalid data when reading %s at offset %# 08x" % (
+                    name, offset))
+
+        if self.symbol == "s":
+            # stringify char array
+            result = decode_until_null(result[0])
+        elif count == 1:
+            result = result[0]
+
+            if self.symbol == "f" and not math.isfinite(result):
+                raise Exception("invalid float when reading %s at offset %# 08x" % (
+                    name, offset))
+
+        if self.custom is not None and self.hook:
+            result = self.custom.entry_hook(result)
+
+        setattr(obj, name, result)
+
+
+class FusedStep:
+    """
+    Reads consecutive members of static size with one struct.
+    """
+
+    def __init__(self, fields):
+        self.struct = struct.Struct("<" + "".join(
+            "%d%s" % (field.count, field.symbol) for field in fields))
+
+        self.names = {field.name for field in fields}
+        self.references = set()
+
+        # if some member size depends on these values, they are read
+        # even when skipping.
+        self.needed = False
+
+        plain_names = []
+        plain_indices = []
+        float_indices = []
+
+        # (field, first and end value index, relative offset) of
+        # non-plain members
+        self.converted = []
+
+        # (field, relative offset) of the plain float members
+        self.floats = []
+
+        idx = 0
+        rel_offset = 0
+        for field in fields:
+            if field.plain:
+                plain_names.append(field.name)
+                plain_indices.append(idx)
+
+                if field.symbol == "f":
+                    float_indices.append(idx)
+                    self.floats.append((field, rel_offset))
+            else:
+                end = idx + field.value_count(field.count)
+                self.converted.append((field, idx, end, rel_offset))
+
+            idx += field.value_count(field.count)
+            rel_offset += struct.calcsize("<%d%s" % (field.count, field.symbol))
+
+        self.plain_names = tuple(plain_names)
+        self.plain_values = tuple_getter(plain_indices) if plain_indices else None
+        self.float_values = tuple_getter(float_indices) if float_indices else None
+
+    def read(self, obj, raw, offset):
+        values = raw.unpack_from(self.struct, offset)
+
+        if self.float_values is not None:
+            # the sum of finite floats can't overflow, as they are single-precision.
+            if not math.isfinite(sum(self.float_values(values))):
+                self.raise_invalid_float(values, offset)
+
+        if self.plain_values is not None:
+            obj.__dict__.update(zip(self.plain_names, self.plain_values(values)))
+
+        for field, start, end, rel_offset in self.converted:
+            field.convert(obj, values[start:end], offset + rel_offset,
+                          field.count)
+
+        return offset + self.struct.size
+
+    def skip(self, obj, raw, offset):
+        if self.needed:
+            return self.read(obj, raw, offset)
+
+        return offset + self.struct.size
+
+    def raise_invalid_float(self, values, offset):
+        """
+        Raises the error for the first non-finite plain float.
+        """
+        for (field, rel_offset), value in zip(self.floats, self.float_values(values)):
+            if not math.isfinite(value):
+                raise Exception("invalid float when reading %s at offset %# 08x" % (
+                    field.name, offset + rel_offset))
+
+
+class DynamicStep:
+    """
+    Reads a member whose length is determined by previously read members.
+    """
+
+    def __init__(self, field):
+        self.field = field
+        self.names = {field.name}
+        self.references = field.references
+        self.needed = False
+
+        # count -> struct
+        self.structs = {}
+
+    def get_struct(self, count):
+        """
+        Returns the (cached) struct for the member with count values.
+        """
+        try:
+            return self.structs[count]
+        except KeyError:
+            unpacker = struct.Struct("<%d%s" % (count, self.field.symbol))
+            self.structs[count] = unpacker
+            return unpacker
+
+    def read(self, obj, raw, offset):
+        field = self.field
+        count = field.count(obj)
+        field.check_count(count)
+
+        unpacker = self.get_struct(count)
+        field.convert(obj, raw.unpack_from(unpacker, offset), offset, count)
+
+        return offset + unpacker.size
+
+    def skip(self, obj, raw, offset):
+        if self.needed:
+            return self.read(obj, raw, offset)
+
+        count = self.field.count(obj)
+        self.field.check_count(count)
+
+        return offset + self.get_struct(count).size
+
+
+class IncludeStep:
+    """
+    Reads the members of an included class into the same object.
+
+    Only used if the included class has a ContinueReadMember,
+    otherwise its members are inlined.
+    """
+
+    def __init__(self, cls):
+        self.cls = cls
+        self.references = get_read_plan(cls).references
+
+    def read(self, obj, raw, offset):
+        return self.cls.read(obj, raw, offset, cls=self.cls)
+
+    def skip(self, obj, raw, offset):
+        return get_entry_skipper(self.cls)(obj, raw, offset)
+
+
+class GroupStep:
+    """
+    Reads a new instance of the group class, and stores it in the object.
+    """
+
+    def __init__(self, name, cls):
+        self.name = name
+        self.cls = cls
+
+        # the group is read into its own object.
+        self.references = set()
+
+    def read(self, obj, raw, offset):
+        # TODO: constructor argument passing may be required here.
+        grouped_data = self.cls()
+        offset = grouped_data.read(raw, offset)
+
+        setattr(obj, self.name, grouped_data)
+        return offset
+
+    def skip(self, obj, raw, offset):
+        return get_entry_skipper(self.cls)(self.cls(), raw, offset)
+
+
+class SubdataStep:
+    """
+    Reads the list of entries of a SubdataMember or MultisubtypeMember.
+    """
+
+    def __init__(self, name, var_type, owner):
+        self.name = name
+        self.var_type = var_type
+        self.single_type = isinstance(var_type, SubdataMember)
+
+        # arguments passed to the next-level constructor.
+        passed_args = var_type.passed_args or ()
+        if isinstance(passed_args, str):
+            passed_args = set(passed_args)
+        self.passed_args = tuple(passed_args)
+
+        if self.single_type:
+            self.subtype_plan = None
+        else:
+            # to determine the subtype class of each entry, read the binary
+            # definition with a plan that contains just that member.
+            self.subtype_plan = ReadPlan(
+                ((False,) + var_type.subtype_definition,), owner)
+            self.subtype_name = var_type.subtype_definition[1]
+
+        self.references = length_references(var_type.length)
+        if self.references is not None:
+            self.references.update(self.passed_args)
+            if var_type.offset_to:
+                self.references.add(var_type.offset_to[0])
+
+    def read(self, obj, raw, offset):
+        var_type = self.var_type
+
+        varargs = {name: getattr(obj, name) for name in self.passed_args}
+
+        # subdata list length has to be defined beforehand as a object member OR number.
+        list_len = var_type.get_length(obj)
+
+        if self.single_type:
+            entries = list()
+            new_data_class = var_type.class_lookup[None]
+            reader = get_entry_reader(new_data_class)
+        else:
+            entries = {key: [] for key in var_type.class_lookup}
+
+        setattr(obj, self.name, entries)
+
+        # check if entries need offset checking
+        if var_type.offset_to:
+            offset_lookup = getattr(obj, var_type.offset_to[0])
+            offset_check = var_type.offset_to[1]
+        else:
+            offset_lookup = None
+
+        for i in range(list_len):
+
+            # if datfile offset == 0, entry has to be skipped.
+            if offset_lookup:
+                if not offset_check(offset_lookup[i]):
+                    continue
+                # TODO: don't read sequentially, use the lookup as new offset?
+
+            if self.single_type:
+                new_data = new_data_class(**varargs)
+                offset = reader(new_data, raw, offset)
+                entries.append(new_data)
+
+            else:
+                offset = self.subtype_plan.read(obj, raw, offset)
+
+                # look up the type name to get the subtype class
+                subtype_name = getattr(obj, self.subtype_name)
+                new_data_class = var_type.class_lookup[subtype_name]
+
+                new_data = new_data_class(**varargs)
+                offset = get_entry_reader(new_data_class)(new_data, raw, offset)
+                entries[subtype_name].append(new_data)
+
+        return offset
+
+    def skip(self, obj, raw, offset):
+        for offset in self.skim(obj, raw, offset):
+            pass
+
+        return offset
+
+    def skim(self, obj, raw, offset):
+        """
+        Skips the entries, and yields the offset after each entry.
+        Entries that are omitted because of offset_to yield nothing.
+        """
+        var_type = self.var_type
+
+        varargs = {name: getattr(obj, name) for name in self.passed_args}
+        list_len = var_type.get_length(obj)
+
+        if var_type.offset_to:
+            offset_lookup = getattr(obj, var_type.offset_to[0])
+            offset_check = var_type.offset_to[1]
+        else:
+            offset_lookup = None
+
+        if self.single_type:
+            new_data_class = var_type.class_lookup[None]
+            skipper = get_entry_skipper(new_data_class)
+
+        for i in range(list_len):
+            if offset_lookup:
+                if not offset_check(offset_lookup[i]):
+                    continue
+
+            if not self.single_type:
+                # the subtype member is read into obj, as when reading.
+                offset = self.subtype_plan.read(obj, raw, offset)
+                new_data_class = var_type.class_lookup[getattr(obj, self.subtype_name)]
+                skipper = get_entry_skipper(new_data_class)
+
+            offset = skipper(new_data_class(**varargs), raw, offset)
+            yield offset
+
+
+def get_entry_reader(cls):
+    """
+    Returns the function (obj, raw, offset) -> offset that reads an
+    object of the Exportable class.
+    """
+    from .exportable import Exportable
+
+    if not issubclass(cls, Exportable):
+        raise Exception("dumped data is not exportable: %s" % cls.__name__)
+
+    if cls.read is Exportable.read:
+        return get_read_plan(cls).read
+
+    return lambda obj, raw, offset: obj.read(raw, offset, cls)
+
+
+def get_entry_skipper(cls):
+    """
+    Like get_entry_reader, but the function skips the object's data.
+    Objects with a custom read method are read completely.
+    """
+    from .exportable import Exportable
+
+    if cls.read is Exportable.read:
+        return get_read_plan(cls).skip
+
+    return get_entry_reader(cls)
+
+
+class ReadPlan:
+    """
+    The compiled form of a data_format.
+
+    members are (is_parent, export, name, type) tuples, as returned by
+    Exportable.get_data_format. owner is used in error messages.
+    """
+
+    def __init__(self, members, owner):
+        from .exportable import Exportable
+
+        self.steps = []
+
+        # the members after a ContinueReadMember are read by the plan rest,
+        # unless it aborts reading.
+        self.continue_name = None
+        self.skipped = None
+        self.rest = None
+
+        # the members of this plan, with all inlined includes
+        self.members = []
+
+        members = list(members)
+        pending = []
+
+        def flush():
+            """ adds the pending static fields as one step """
+            if pending:
+                self.steps.append(FusedStep(pending))
+                pending.clear()
+
+        for idx, (_, export, var_name, var_type) in enumerate(members):
+
+            if isinstance(var_type, GroupMember):
+                if not issubclass(var_type.cls, Exportable):
+                    raise Exception("class where members should be included "
+                                    "is not exportable: %s" % var_type.cls.__name__)
+
+            if isinstance(var_type, IncludeMembers):
+                included = get_read_plan(var_type.cls)
+
+                if included.continue_name is None and var_type.cls.read is Exportable.read:
+                    # fuse the included members with the surrounding ones
+                    for member in included.members:
+                        self.members.append(member)
+                        if isinstance(member[3], Field):
+                            pending.append(member[3])
+                        else:
+                            flush()
+                            self.steps.append(member[3])
+                    continue
+
+                flush()
+                self.steps.append(IncludeStep(var_type.cls))
+                self.members.append((export, var_name, var_type, self.steps[-1]))
+                continue
+
+            if isinstance(var_type, GroupMember):
+                step = GroupStep(var_name, var_type.cls)
+            elif isinstance(var_type, MultisubtypeMember):
+                step = SubdataStep(var_name, var_type, owner)
+            else:
+                step = Field(export, var_name, var_type, owner)
+                if not step.is_static():
+                    step = DynamicStep(step)
+
+            self.members.append((export, var_name, var_type, step))
+
+            if isinstance(step, Field):
+                pending.append(step)
+            else:
+                flush()
+                self.steps.append(step)
+
+            if isinstance(var_type, ContinueReadMember):
+                if export == READ_UNKNOWN:
+                    raise Exception("%s: ContinueReadMember can't be unknown" % owner)
+
+                flush()
+                self.continue_name = var_name
+                self.rest = ReadPlan(members[idx + 1:], owner)
+                self.skipped = [(member[1], member[2]) for member in self.rest.members]
+                self.members.extend(self.rest.members)
+                break
+
+        flush()
+
+        # the names of the members that determine the size of the data
+        # (None if unknown), which are needed to skip it.
+        self.references = set()
+        for step in self.steps:
+            if step.references is None:
+                self.references = None
+                break
+            self.references.update(step.references)
+
+        if self.references is not None:
+            if self.continue_name is not None:
+                self.references.add(self.continue_name)
+
+            if self.rest is not None:
+                if self.rest.references is None:
+                    self.references = None
+                else:
+                    self.references.update(self.rest.references)
+
+        self.mark_needed(self.references)
+
+    def mark_needed(self, needed):
+        """
+        Marks the steps that read one of the needed member names
+        (or all steps, if needed is None), so they are read when skipping.
+        """
+        for step in self.steps:
+            if isinstance(step, (FusedStep, DynamicStep)):
+                if needed is None or not step.names.isdisjoint(needed):
+                    step.needed = True
+
+            elif isinstance(step, IncludeStep):
+                get_read_plan(step.cls).mark_needed(needed)
+
+        if self.rest is not None:
+            self.rest.mark_needed(needed)
+
+    def read(self, obj, raw, offset):
+        """
+        Reads the members from raw (a read_source.ReadSource)
+        at the offset into obj.
+
+        Returns the offset after the read data.
+        """
+        for step in self.steps:
+            offset = step.read(obj, raw, offset)
+
+        if self.continue_name is not None:
+            if getattr(obj, self.continue_name) == ContinueReadMember.Result.ABORT:
+                # don't go through all other members of this class!
+                for var_name, var_type in self.skipped:
+                    setattr(obj, var_name, empty_value(var_type))
+
+                return offset
+
+            return self.rest.read(obj, raw, offset)
+
+        return offset
+
+    def read_steps(self, obj, raw, offset, read_step):
+        """
+        Like read, but each step is read by
+        read_step(step, obj, raw, offset) -> offset.
+        """
+        for step in self.steps:
+            offset = read_step(step, obj, raw, offset)
+
+        if self.continue_name is not None:
+            if getattr(obj, self.continue_name) == ContinueReadMember.Result.ABORT:
+                for var_name, var_type in self.skipped:
+                    setattr(obj, var_name, empty_value(var_type))
+
+                return offset
+
+            return self.rest.read_steps(obj, raw, offset, read_step)
+
+        return offset
+
+    def skip(self, obj, raw, offset):
+        """
+        Like read, but only the members that are needed to determine
+        the size of the data are stored in obj.
+
+        Returns the offset after the data.
+        """
+        for step in self.steps:
+            offset = step.skip(obj, raw, offset)
+
+        if self.continue_name is not None:
+            if getattr(obj, self.continue_name) == ContinueReadMember.Result.ABORT:
+                return offset
+
+            return self.rest.skip(obj, raw, offset)
+
+        return offset
+
+
+def test():
+    """
+    Reads some records with fused, dynamic, aborted and subdata members.
+    """
+    from ...testing.testing import assert_value, assert_raises, result
+    from .exportable import Exportable
+    from .members import ZeroMember
+
+    class Entry(Exportable):
+        """ record with a ContinueReadMember """
+        data_format = (
+            (READ, "exists", ContinueReadMember("uint8_t")),
+            (READ, "value_count", "uint8_t"),
+            (READ, "values", "int16_t[value_count]"),
+        )
+
+    class Record(Exportable):
+        """ record with all kinds of members """
+        data_format = (
+            (READ, "name", "char[4]"),
+            (READ, "speed", "float"),
+            (READ_UNKNOWN, None, "int8_t[2]"),
+            (READ, "padding", ZeroMember("uint8_t", length=2)),
+            (READ, "entry_count", "uint16_t"),
+            (READ, "entries", SubdataMember(
+                ref_type=Entry,
+                length="entry_count",
+            )),
+        )
+
+    raw = struct.pack("<4sf2b2BH", b"ab\0c", 1.5, 7, 8, 0, 0, 3)
+    raw += struct.pack("<BB2h", 1, 2, -1, 300)
+    raw += struct.pack("<B", 0)
+    raw += struct.pack("<BB", 1, 0)
+
+    record = Record()
+    assert_value(record.read(raw, 0), len(raw))
+    assert_value(record.name, "ab")
+    assert_value(record.speed, 1.5)
+    assert_value(getattr(record, "unknown-0x%08x" % 8), (7, 8))
+    assert_value(record.padding, (0, 0))
+    assert_value(len(record.entries), 3)
+    assert_value(record.entries[0].values, (-1, 300))
+    assert_value(record.entries[1].exists, ContinueReadMember.Result.ABORT)
+    assert_value(record.entries[1].values, 0)
+    assert_value(record.entries[2].values, ())
+
+    # fused members are verified as well
+    with assert_raises(Exception):
+        result(Record().read(struct.pack("<4sf2b2BH", b"", float("nan"),
+                                         0, 0, 0, 0, 0), 0))
+
+    with assert_raises(Exception):
+        result(Record().read(struct.pack("<4sf2b2BH", b"", 0, 0, 0, 1, 0, 0), 0))
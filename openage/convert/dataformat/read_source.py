@@ -0,0 +1,173 @@
+# Copyright 2015-2015 the openage authors. See copying.md for legal info.
+
+"""
+Sources of the binary data that is read by read plans (see read_plan.py).
+
+Read plans only access their data through source.unpack_from(), with
+(mostly) increasing offsets, so the data doesn't need to be in memory
+all at once: ZlibStreamSource decompresses it while it is read.
+"""
+
+import time
+import zlib
+
+from ...util.bytequeue import ByteBuffer
+
+
+class ReadSource:
+    """
+    Base class for all read sources.
+    """
+
+    def unpack_from(self, unpacker, offset):
+        """
+        Unpacks the data at offset with the struct.Struct unpacker.
+        """
+        raise NotImplementedError()
+
+
+class MemorySource(ReadSource):
+    """
+    Binary data that is entirely in memory, e.g. a bytes object.
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+    def unpack_from(self, unpacker, offset):
+        return unpacker.unpack_from(self.data, offset)
+
+    def __repr__(self):
+        return "MemorySource(%d bytes)" % len(self.data)
+
+
+class ZlibStreamSource(ReadSource):
+    """
+    Decompresses the zlib stream from the binary file-like fileobj,
+    while the data is read.
+
+    The data is unpacked from a window of at least window_size bytes.
+    When a read exceeds the window, the window is moved to the read offset,
+    and all data before it is discarded. Thus, data before the current
+    window can't be read anymore.
+
+    wbits is passed to zlib.decompressobj.
+    """
+
+    def __init__(self, fileobj, wbits=zlib.MAX_WBITS, window_size=1024 * 1024,
+                 read_size=64 * 1024):
+        self.fileobj = fileobj
+        self.decompressor = zlib.decompressobj(wbits)
+        self.window_size = window_size
+        self.read_size = read_size
+
+        # all data that has been decompressed, and not discarded yet.
+        self.buf = ByteBuffer()
+        self.eof = False
+
+        # the data that is currently unpacked from, and its offset
+        self.window = b""
+        self.window_start = 0
+
+        # wall and cpu time spent in decompressing, for profiling
+        self.decompress_time = 0.0
+        self.decompress_cpu = 0.0
+
+    def unpack_from(self, unpacker, offset):
+        rel_offset = offset - self.window_start
+
+        if rel_offset < 0 or rel_offset + unpacker.size > len(self.window):
+            self.move_window(offset, unpacker.size)
+            rel_offset = 0
+
+        return unpacker.unpack_from(self.window, rel_offset)
+
+    def move_window(self, offset, size):
+        """
+        Moves the window to offset; it will contain at least size bytes,
+        unless the stream ends before.
+        """
+        if self.buf.hasbeendiscarded(offset):
+            raise ValueError("can't read at offset %d, the stream has "
+                             "already been read up to %d" % (
+                                 offset, self.buf.discardedbytes))
+
+        end = offset + max(size, self.window_size)
+
+        start_time, start_cpu = time.perf_counter(), time.thread_time()
+        while len(self.buf) < end and not self.eof:
+            self.decompress_chunk()
+        self.decompress_time += time.perf_counter() - start_time
+        self.decompress_cpu += time.thread_time() - start_cpu
+
+        self.window = self.buf[offset:end]
+        self.window_start = offset
+
+        # reads are forward-only, so the data before the window is not needed.
+        self.buf.discardleft(len(self.buf) - offset)
+
+    def decompress_chunk(self):
+        """
+        Decompresses up to window_size more bytes.
+        """
+        # data that was not decompressed because of the output size limit
+        data = self.decompressor.unconsumed_tail
+
+        if not data:
+            data = self.fileobj.read(self.read_size)
+
+            if not data:
+                self.eof = True
+                remaining = self.decompressor.flush()
+                if remaining:
+                    self.buf.append(remaining)
+                return
+
+        decompressed = self.decompressor.decompress(data, self.window_size)
+        if decompressed:
+            self.buf.append(decompressed)
+
+        if self.decompressor.eof:
+            self.eof = True
+
+    def __repr__(self):
+        return "ZlibStreamSource(%s)" % repr(self.fileobj)
+
+
+def test():
+    """
+    Reads structs from a compressed stream with a small window.
+    """
+    import random
+    import struct
+    from io import BytesIO
+
+    from ...testing.testing import assert_value, assert_raises, result
+
+    rng = random.Random(1337)
+    data = bytes(rng.randint(0, 15) for _ in range(100000))
+
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+
+    memory = MemorySource(data)
+    stream = ZlibStreamSource(BytesIO(compressed), -15,
+                              window_size=1000, read_size=100)
+
+    offset = 0
+    while offset < len(data) - 5000:
+        unpacker = struct.Struct("<%dH" % rng.randint(1, 2000))
+        assert_value(stream.unpack_from(unpacker, offset),
+                     memory.unpack_from(unpacker, offset))
+
+        offset += rng.randint(0, unpacker.size + 100)
+
+    # only a few windows are kept
+    assert_value(len(stream.buf) - stream.buf.discardedbytes < 10000, True)
+
+    with assert_raises(ValueError):
+        result(stream.unpack_from(struct.Struct("<I"), 0))
+
+    # reading beyond the end
+    with assert_raises(struct.error):
+        result(stream.unpack_from(struct.Struct("<I"), len(data) - 2))
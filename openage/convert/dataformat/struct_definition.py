@@ -4,6 +4,7 @@
 
 from collections import OrderedDict
 import re
+import struct
 
 from .members import IncludeMembers, StringMember, CharArrayMember, NumberMember, DataMember, RefMember
 from .member_access import READ_EXPORT, NOREAD_EXPORT
@@ -112,6 +113,21 @@ class StructDefinition:
             # replace the xref with the real definition
             self.members[type_name] = lookup_ref_data[type_name]
 
+    def get_binary_layout(self):
+        """
+        return the struct module format of one row in binary data tables,
+        and the offsets of the member columns in the row.
+        """
+
+        row_format = "<"
+        offsets = list()
+
+        for member_type in self.members.values():
+            offsets.append(struct.calcsize(row_format))
+            row_format += member_type.get_binary_type()
+
+        return row_format, offsets
+
     def generate_struct(self, genfile):
         """
         generate C struct snippet (that should be placed in a header).
@@ -134,8 +150,10 @@ class StructDefinition:
 
             snippet.add_members(member_type.get_struct_entries(member_name))
 
-        # append member count variable
+        # append member count and binary row size variables
         snippet.add_member("static constexpr size_t member_count = %d;" % len(self.members))
+        snippet.add_member("static constexpr size_t binary_row_size = %d;" % (
+            struct.calcsize(self.get_binary_layout()[0])))
         snippet.includes |= determine_header("size_t")
 
         # add filling function prototypes
@@ -154,9 +172,10 @@ class StructDefinition:
         # returned snippets
         ret = list()
 
-        # constexpr member count definition
+        # constexpr member count and row size definitions
         ret.append(ContentSnippet(
-            data="constexpr size_t %s::member_count;" % self.name_struct,
+            data="constexpr size_t %s::member_count;\nconstexpr size_t %s::binary_row_size;" % (
+                self.name_struct, self.name_struct),
             file_name=self.name_struct_file,
             section=SectionType.section_body,
             orderby=self.name_struct,
@@ -178,6 +197,12 @@ class StructDefinition:
             for parser in member_type.get_parsers(idx, member_name):
                 parsers[parser.destination].append(parser)
 
+        # parsers for the columns of binary data tables
+        _, offsets = self.get_binary_layout()
+        for idx, (offset, (member_name, member_type)) in enumerate(zip(offsets, self.members.items())):
+            for parser in member_type.get_binary_parsers(idx, offset, member_name):
+                parsers[parser.destination].append(parser)
+
         # create parser snippets and return them
         for parser_type, parser_list in parsers.items():
             ret.append(
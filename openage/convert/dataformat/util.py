@@ -105,6 +105,7 @@ def determine_header(for_type):
         "float":           set(),
         "int":             set(),
         "read_csv_file":   {util_file_h},
+        "read_binary_value": {util_file_h},
         "subdata":         {util_file_h},
         "engine_dir":      {util_dir_h},
         "engine_error":    {error_error_h},
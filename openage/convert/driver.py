@@ -5,12 +5,15 @@ Receives cleaned-up srcdir and targetdir objects from .main, and drives the
 actual conversion process.
 """
 
+from concurrent.futures import ThreadPoolExecutor
 import os
-from subprocess import Popen, PIPE
-from tempfile import gettempdir
 
-from ..log import info, dbg
+from ..log import info, dbg, spam
+from ..util.fslike.directory import Directory
+from ..util.profiler import Profiler, NULL_PROFILER, DEFAULT_TOP
+from ..util.threading import ByteBudget, Pipeline
 
+from .binpack import get_packer, DEFAULT_PACKER
 from .blendomatic import Blendomatic
 from .changelog import ASSET_VERSION, ASSET_VERSION_FILENAME
 from .colortable import ColorTable, PlayerColorTable
@@ -18,7 +21,18 @@ from .dataformat.data_formatter import DataFormatter
 from .gamedata.empiresdat import load_gamespec
 from .hardcoded.termcolors import URXVTCOLS
 from .hardcoded.terrain_tile_size import TILE_HALFSIZE
-from .slp_converter_pool import SLPConverterPool
+from .mediacache import (MediaCache, OutputBuffer, DEFAULT_MAX_SIZE,
+                         conversion_key)
+from .mediamanifest import MediaManifest
+from .opus import encode_opus, effective_encoder, DEFAULT_ENCODER
+from .png import DEFAULT_COMPRESSION_LEVEL, DEFAULT_FILTER
+from .slp import SLP
+from .texture import Texture
+
+
+# default limit for the media file data that is held in memory
+# while it is converted, in bytes
+DEFAULT_MEDIA_MEMORY = 512 * 1024 ** 2
 
 
 def get_string_resources(srcdir):
@@ -70,22 +84,131 @@ def get_blendomatic_data(srcdir):
         return Blendomatic(blendomatic_dat)
 
 
-def get_gamespec(srcdir, dont_pickle):
-    """ reads empires.dat """
+def get_gamespec(srcdir, dont_use_cache, jobs=1, profiler=NULL_PROFILER):
+    """
+    reads empires.dat, with jobs worker processes.
 
-    cache_file = os.path.join(gettempdir(), "empires2_x1_p1.dat.pickle")
+    with one job, the file is decompressed while it is parsed;
+    more jobs need the whole decompressed file in memory.
+    """
+    from ..assets import get_user_data_dir
+
+    cache_dir = os.path.join(get_user_data_dir(), "cache", "gamespec")
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_file = os.path.join(cache_dir, "empires2_x1_p1.dat.columns")
 
     with srcdir["data/empires2_x1_p1.dat"].open('rb') as empiresdat_file:
-        gamespec = load_gamespec(empiresdat_file, cache_file, not dont_pickle)
+        gamespec = load_gamespec(empiresdat_file, cache_file, not dont_use_cache,
+                                 jobs=jobs, profiler=profiler)
 
     # modify the read contents of datfile
     from .fix_data import fix_data
-    # pylint: disable=no-member
-    gamespec.empiresdat[0] = fix_data(gamespec.empiresdat[0])
+    with profiler.measure("gamespec fix_data"):
+        # pylint: disable=no-member
+        gamespec.empiresdat[0] = fix_data(gamespec.empiresdat[0])
 
     return gamespec
 
 
+def get_texture_packer(args):
+    """ creates the texture atlas packer, as configured in args """
+    return get_packer(
+        getattr(args, "texture_packer", DEFAULT_PACKER),
+        power_of_two=args.flag("texture_power_of_two"),
+        max_size=getattr(args, "texture_max_size", None),
+    )
+
+
+def get_png_settings(args):
+    """ returns the PNG (compression level, filter), as configured in args """
+    compression_level = getattr(args, "png_compression_level", None)
+    if compression_level is None:
+        compression_level = DEFAULT_COMPRESSION_LEVEL
+
+    return compression_level, getattr(args, "png_filter", DEFAULT_FILTER)
+
+
+def get_opus_settings(args):
+    """
+    returns the opus (bitrate, sample rate, encoder), as configured in args
+    """
+    bitrate = getattr(args, "opus_bitrate", None)
+    if bitrate is not None:
+        bitrate *= 1000
+
+    return (bitrate, getattr(args, "opus_sample_rate", None),
+            getattr(args, "opus_encoder", DEFAULT_ENCODER))
+
+
+def get_media_cache(args):
+    """
+    opens the persistent media conversion cache, as configured in args.
+
+    returns None if the cache is disabled.
+    """
+    if args.flag("no_media_cache"):
+        return None
+
+    cachedir = getattr(args, "media_cache_dir", None)
+    if cachedir is None:
+        from ..assets import get_user_data_dir
+        cachedir = os.path.join(get_user_data_dir(), "cache", "media")
+
+    max_size = getattr(args, "media_cache_size", None)
+    if max_size is None:
+        max_size = DEFAULT_MAX_SIZE
+    else:
+        max_size *= 1024 ** 2
+
+    return MediaCache(Directory(cachedir, create_if_missing=True).root,
+                      max_size)
+
+
+def get_thread_pool(args):
+    """
+    creates the thread pool for the conversion, as configured in args.
+
+    returns None if the conversion shall run in the calling thread.
+    """
+    jobs = getattr(args, "jobs", None)
+    if jobs is None:
+        jobs = os.cpu_count()
+
+    if jobs == 1:
+        return None
+
+    return ThreadPoolExecutor(jobs)
+
+
+def get_profiler(args):
+    """
+    creates the profiler of the conversion steps, if a profile report
+    was requested in args.
+
+    returns NULL_PROFILER otherwise.
+    """
+    if getattr(args, "profile_report", None) is None:
+        return NULL_PROFILER
+
+    return Profiler()
+
+
+def save_profile_report(profiler, args):
+    """
+    writes the report of profiler to the file requested in args,
+    and logs the slowest conversion steps.
+    """
+    top = getattr(args, "profile_top", None)
+    if top is None:
+        top = DEFAULT_TOP
+
+    with open(args.profile_report, "w") as reportfile:
+        profiler.save(reportfile, top)
+
+    info("profile report written to %s; slowest steps:\n%s" % (
+        args.profile_report, "\n".join(profiler.summary(top))))
+
+
 def convert(args):
     """
     args must hold srcdir and targetdir (FS-like objects),
@@ -95,13 +218,33 @@ def convert(args):
         strings (filenames) that indicate the currently-converted object
         ints that predict the amount of objects remaining
     """
-    yield from convert_metadata(args)
+    # places the frames on all generated texture atlases
+    args.packer = get_texture_packer(args)
 
-    if not args.flag('no_media'):
-        yield from convert_media(args)
+    # the threads for all conversion steps, None if they run serially.
+    args.pool = get_thread_pool(args)
+
+    # measures the conversion steps, if requested.
+    args.profiler = get_profiler(args)
+
+    try:
+        yield from convert_metadata(args)
+
+        if not args.flag('no_media'):
+            yield from convert_media(args)
+
+    finally:
+        if args.pool is not None:
+            args.pool.shutdown()
+
+    if args.profiler is not NULL_PROFILER:
+        save_profile_report(args.profiler, args)
 
     # clean args (set by convert_metadata for convert_media)
     del args.palette
+    del args.packer
+    del args.pool
+    del args.profiler
 
     args.targetdir[ASSET_VERSION_FILENAME].open('w').write(str(ASSET_VERSION))
     info("asset conversion complete; asset version: " + str(ASSET_VERSION))
@@ -109,13 +252,16 @@ def convert(args):
 
 def convert_metadata(args):
     """ Converts the metadata part """
+    profiler = getattr(args, "profiler", NULL_PROFILER)
+
     if not args.flag("no_metadata"):
         info("converting metadata")
         data_formatter = DataFormatter()
 
     # required for player palette and color lookup during SLP conversion.
     yield "palette"
-    palette = ColorTable(args.srcdir["interface/50500.bin"].open("rb").read())
+    with profiler.measure("palette"):
+        palette = ColorTable(args.srcdir["interface/50500.bin"].open("rb").read())
     # store for use by convert_media
     args.palette = palette
 
@@ -123,13 +269,29 @@ def convert_metadata(args):
         return
 
     yield "empires.dat"
-    gamespec = get_gamespec(args.srcdir, args.flag("no_pickle_cache"))
-    data_dump = gamespec.dump("gamedata")
+    # empires.dat is streamed, unless parallel reading was requested.
+    gamespec_jobs = getattr(args, "gamespec_jobs", None)
+    if gamespec_jobs is None:
+        gamespec_jobs = 1
+    elif gamespec_jobs == 0:
+        # one per cpu
+        gamespec_jobs = None
+
+    gamespec = get_gamespec(args.srcdir, args.flag("no_gamespec_cache"),
+                            gamespec_jobs, profiler)
+    with profiler.measure("gamespec dump"):
+        data_dump = gamespec.dump("gamedata")
     data_formatter.add_data(data_dump[0], prefix="gamedata/")
 
     yield "blendomatic.dat"
-    blend_data = get_blendomatic_data(args.srcdir)
-    blend_data.save(args.targetdir, "blendomatic", ("csv",))
+    with profiler.measure("blendomatic read"):
+        blend_data = get_blendomatic_data(args.srcdir)
+    # the textures are drawn and encoded in the pool,
+    # their cpu time isn't measured.
+    with profiler.measure("blendomatic save"):
+        blend_data.save(args.targetdir, "blendomatic", ("csv",), args.packer,
+                        *get_png_settings(args),
+                        pool=getattr(args, "pool", None))
     data_formatter.add_data(blend_data.dump("blending_modes"))
 
     yield "player color palette"
@@ -141,11 +303,20 @@ def convert_metadata(args):
     data_formatter.add_data(termcolortable.dump("termcolors"))
 
     yield "string resources"
-    stringres = get_string_resources(args.srcdir)
+    with profiler.measure("string resources"):
+        stringres = get_string_resources(args.srcdir)
     data_formatter.add_data(stringres.dump("string_resources"))
 
-    yield "writing gamespec csv files"
-    data_formatter.export(args.targetdir, ("csv",))
+    # the engine prefers the binary tables, so those of an earlier
+    # conversion must not outlive the csv files of this one.
+    formats, obsolete_formats = ("csv",), ("bin",)
+    if args.flag("binary_gamedata"):
+        formats, obsolete_formats = ("csv", "bin"), ()
+
+    yield "writing gamespec %s files" % "/".join(formats)
+    data_formatter.export(args.targetdir, formats, atomic=True,
+                          profiler=profiler,
+                          obsolete_formats=obsolete_formats)
 
     if args.flag('gen_extra_files'):
         dbg("generating extra files for visualization")
@@ -165,9 +336,12 @@ def convert_media(args):
     if args.flag("no_graphics"):
         ignored_suffixes.add('.slp')
 
+    source_files = []
     files_to_convert = []
     for dirname in ['sounds', 'graphics', 'terrain']:
         for filepath in args.srcdir[dirname].iterdir():
+            source_files.append(b'/'.join(filepath.parts).decode())
+
             if filepath.suffix in ignored_suffixes:
                 continue
 
@@ -175,43 +349,284 @@ def convert_media(args):
 
     yield len(files_to_convert)
 
-    if not files_to_convert:
-        return
+    # the outputs of converted files that no longer exist are deleted.
+    args.media_manifest = MediaManifest(args.targetdir)
+    args.media_manifest.load()
+    args.media_manifest.remove_missing(source_files)
+
+    if files_to_convert:
+        info("converting media")
+
+        # all settings that change the conversion result for the same input.
+        # sounds of the other encoder must not be reused when libopus
+        # is installed or removed.
+        opus_bitrate, opus_sample_rate, opus_encoder = get_opus_settings(args)
+        args.conversion_params = repr((
+            args.palette.palette, args.packer, get_png_settings(args),
+            getattr(args, "texture_format", "rgba"),
+            getattr(args, "texture_players", None),
+            (opus_bitrate, opus_sample_rate,
+             effective_encoder(opus_encoder)))).encode()
+        args.media_cache = get_media_cache(args)
+
+        # the SLP drawing commands are interpreted without holding the GIL,
+        # so plain threads are sufficient for parallel conversion.
+        # the largest files are converted first, so they don't end up
+        # as the last ones that keep a single thread busy.
+        files_to_convert.sort(key=lambda fpath: fpath.filesize or 0,
+                              reverse=True)
+
+        jobs = getattr(args, "jobs", None)
+        if jobs is None:
+            jobs = os.cpu_count()
+
+        memory_limit = getattr(args, "media_memory", None)
+        if memory_limit is None:
+            memory_limit = DEFAULT_MEDIA_MEMORY
+        else:
+            memory_limit *= 1024 ** 2
+        args.media_budget = ByteBudget(memory_limit)
+
+        # the conversions run in the pool of convert(), if there is one.
+        pipeline = Pipeline([
+            (lambda fpath: read_mediafile(fpath, args), 1),
+            (lambda job: convert_mediajob(job, args), jobs),
+            (lambda job: write_mediajob(job, args), 1),
+        ], pool=getattr(args, "pool", None))
+
+        try:
+            yield from pipeline.run(files_to_convert)
+        finally:
+            # wakes the reader, if it waits for memory.
+            args.media_budget.close("media conversion was stopped")
+
+        if args.media_cache is not None:
+            info("media cache: %d hits, %d misses" % (
+                args.media_cache.hits, args.media_cache.misses))
+
+        del args.conversion_params
+        del args.media_cache
+        del args.media_budget
+
+    orphan_count = args.media_manifest.delete_orphans()
+    if orphan_count:
+        info("deleted %d orphaned media files" % orphan_count)
+
+    args.media_manifest.save()
+    del args.media_manifest
+
+
+class MediaJob:
+    """
+    A media file on its way through the conversion pipeline
+    (read_mediafile -> convert_mediajob -> write_mediajob).
 
-    info("converting media")
+    held is the number of bytes that the job holds of args.media_budget:
+    the input data until it is converted, and the outputs until they
+    are written.
+    """
+    def __init__(self, filename, size, key):
+        self.filename = filename
+        self.size = size
+        self.key = key
 
-    jobs = getattr(args, "jobs", None)
-    with SLPConverterPool(args.palette, jobs) as slp_converter:
-        args.slp_converter = slp_converter
+        # the modification time of the source file, and the key of the
+        # conversion settings, as recorded in the media manifest.
+        self.mtime = None
+        self.params = None
 
-        from ..util.threading import concurrent_chain
-        yield from concurrent_chain(
-            (convert_mediafile(fpath, args) for fpath in files_to_convert),
-            jobs)
+        # None if the file needs no conversion.
+        self.indata = None
 
-    # clean args
-    del args.slp_converter
+        # {output filename: data}, None if nothing is to be written.
+        self.outputs = None
 
+        # whether the outputs shall be stored in the media cache.
+        self.store = False
 
-def convert_mediafile(filepath, args):
+        self.held = 0
+
+
+def read_mediafile(filepath, args):
     """
-    Converts a single media file, according to the supplied arguments.
-    Designed to be run in a thread via concurrent_chain.
+    First stage of the media conversion: reads a single media file.
 
-    May write multiple output files (e.g. in the case of textures: csv, png).
+    Files that are unchanged since the last conversion are skipped:
+    if their size and modification time are unchanged, without reading them,
+    otherwise if their content is. Converted outputs are fetched from the
+    media cache if possible.
 
-    Args shall contain srcdir, targetdir, and slp_converter.
+    Args shall contain srcdir, media_budget, conversion_params, media_cache
+    and media_manifest.
     """
-    # progress message
+    profiler = getattr(args, "profiler", NULL_PROFILER)
     filename = b'/'.join(filepath.parts).decode()
-    yield filename
+    incremental = not args.flag("no_incremental")
+
+    # terrain textures get different hotspots
+    variant = "%s %s" % (filepath.suffix, filename.startswith('terrain/'))
+
+    # the key of the conversion settings, without the file content.
+    params = conversion_key(b"", variant, args.conversion_params)
+    size = filepath.filesize
+    mtime = filepath.mtime
+
+    if incremental and args.media_manifest.unchanged(filename, size,
+                                                     mtime, params):
+        spam("%s is unchanged" % filename)
+        return MediaJob(filename, size, None)
+
+    # wait until there's room for the data.
+    held = size or 0
+    args.media_budget.acquire(held)
+
+    with profiler.measure("media read", filename) as step:
+        with filepath.open_r() as infile:
+            indata = infile.read()
+        step.in_bytes = len(indata)
+
+    args.media_budget.add(len(indata) - held)
+
+    job = MediaJob(filename, len(indata),
+                   conversion_key(indata, variant, args.conversion_params))
+    job.held = len(indata)
+    job.mtime = mtime
+    job.params = params
+
+    if incremental and args.media_manifest.up_to_date(filename, job.size,
+                                                      job.key, mtime, params):
+        spam("%s is up to date" % filename)
+        return job
+
+    # only actual conversions are worth caching, not plain copies.
+    cache = args.media_cache
+    if filepath.suffix not in {'.slp', '.wav'}:
+        cache = None
+
+    # the outputs are cached by their names relative to the stem
+    stem = os.path.splitext(filename)[0]
+
+    cached = None
+    if cache is not None:
+        with profiler.measure("media cache load", filename):
+            cached = cache.load(job.key)
+
+    if cached is not None:
+        job.outputs = {stem + suffix: data for suffix, data in cached.items()}
+        args.media_budget.add(sum(len(data) for data in cached.values()))
+        job.held += sum(len(data) for data in cached.values())
+
+    else:
+        job.indata = indata
+        job.store = cache is not None
+
+    return job
+
+
+def convert_mediajob(job, args):
+    """
+    Second stage of the media conversion: decodes, packs and encodes the
+    input data, and keeps the outputs in memory.
+    Runs in multiple threads.
+
+    Args shall contain targetdir, media_budget, palette and packer.
+    """
+    if job.indata is None:
+        return job
+
+    outbuf = OutputBuffer(args.targetdir)
+    convert_mediadata(job.indata, job.filename, outbuf.root, args)
 
-    with filepath.open_r() as infile:
-        indata = infile.read()
+    job.outputs = {
+        b'/'.join(parts).decode(): data
+        for parts, data in outbuf.outputs.items()
+    }
+
+    # the outputs are held instead of the input data now.
+    outsize = sum(len(data) for data in job.outputs.values())
+    args.media_budget.add(outsize)
+    args.media_budget.release(len(job.indata))
+    job.held += outsize - len(job.indata)
+    job.indata = None
+
+    return job
+
+
+def write_mediajob(job, args):
+    """
+    Last stage of the media conversion: writes the outputs,
+    and records them in the media cache and manifest.
+
+    Args shall contain targetdir, media_budget, media_cache and
+    media_manifest.
+
+    Returns the filename, for the progress display.
+    """
+    profiler = getattr(args, "profiler", NULL_PROFILER)
+
+    if job.outputs is not None:
+        with profiler.measure("media write", job.filename) as step:
+            for outname, outdata in job.outputs.items():
+                with args.targetdir[outname].open_w() as outfile:
+                    outfile.write(outdata)
+
+            step.out_bytes = sum(len(data) for data in job.outputs.values())
+
+        if job.store:
+            stem = os.path.splitext(job.filename)[0]
+            with profiler.measure("media cache store", job.filename):
+                store_cached_outputs(args.media_cache, job.key, stem,
+                                     job.outputs)
+
+        args.media_manifest.update(job.filename, job.size, job.key,
+                                   list(job.outputs), job.mtime, job.params)
+
+    args.media_budget.release(job.held)
+
+    return job.filename
+
+
+def store_cached_outputs(cache, key, stem, outputs):
+    """
+    Stores the {output filename: data} outputs in the media cache,
+    by their suffix relative to stem.
+    """
+    cached = {}
+    for outname, outdata in outputs.items():
+        suffix = outname[len(stem):]
+        if not outname.startswith(stem) or '/' in suffix:
+            dbg("not caching %s: unexpected output %s" % (stem, outname))
+            return
+
+        cached[suffix] = outdata
+
+    cache.store(key, cached)
+
+
+def convert_mediadata(indata, filename, targetdir, args):
+    """
+    Converts the contents of a single media file, and writes the results
+    to targetdir.
+
+    Args shall contain palette and packer.
+    """
+    profiler = getattr(args, "profiler", NULL_PROFILER)
 
     if filename.endswith('.slp'):
-        # do the CPU-intense part in a subprocess
-        texture = args.slp_converter.convert(indata)
+        # terrain has no player colors, so no variants are needed.
+        player_count = getattr(args, "texture_players", None)
+        if player_count and not filename.startswith('terrain/'):
+            player_numbers = range(1, player_count + 1)
+        else:
+            player_numbers = None
+
+        # the frames are decoded straight into the texture atlas,
+        # so this includes the atlas packing.
+        with profiler.measure("slp decode", filename, len(indata)) as step:
+            texture = Texture(SLP(indata), args.palette, args.packer,
+                              getattr(args, "texture_format", "rgba") == "indexed",
+                              player_numbers)
+            step.efficiency = texture.packing_efficiency()
 
         # the hotspots of terrain textures must be fixed
         if filename.startswith('terrain/'):
@@ -220,21 +635,16 @@ def convert_mediafile(filepath, args):
                 entry["cy"] = TILE_HALFSIZE["y"]
 
         # save atlas to targetdir
-        texture.save(args.targetdir, filename, ("csv",))
+        with profiler.measure("png encode", filename):
+            texture.save(targetdir, filename, ("csv",), *get_png_settings(args))
 
     elif filename.endswith('.wav'):
         # convert the WAV file to an opus file
-        # TODO use libav or something to avoid this utility dependency
-        invocation = ('opusenc', '--quiet', '-', '-')
-        opusenc = Popen(invocation, stdin=PIPE, stdout=PIPE)
-        outdata = opusenc.communicate(input=indata)[0]
-        if opusenc.returncode != 0:
-            raise Exception("opusenc failed")
-
-        with args.targetdir[filename].with_suffix('.opus').open_w() as outfile:
-            outfile.write(outdata)
+        with profiler.measure("opus encode", filename, len(indata)):
+            with targetdir[filename].with_suffix('.opus').open_w() as outfile:
+                encode_opus(indata, outfile, *get_opus_settings(args))
 
     else:
         # simply copy the file over.
-        with args.targetdir[filename].open_w() as outfile:
+        with targetdir[filename].open_w() as outfile:
             outfile.write(indata)
@@ -2,7 +2,8 @@
 
 # TODO pylint: disable=C,R
 
-import pickle
+import hashlib
+import os
 
 from . import civ
 from . import graphic
@@ -19,6 +20,7 @@ from ..dataformat.members import SubdataMember
 from ..dataformat.member_access import READ, READ_EXPORT, READ_UNKNOWN
 
 from ...log import spam, dbg, info, warn
+from ...util.profiler import NULL_PROFILER
 
 
 # this file can parse and represent the empires2_x1_p1.dat file.
@@ -223,49 +225,176 @@ class EmpiresDatWrapper(Exportable):
     )
 
 
-def load_gamespec(fileobj, cachefile_name=None, load_cache=False):
+def load_gamespec(fileobj, cachefile_name=None, load_cache=False, columnar=False,
+                  jobs=1, sections=None, profiler=NULL_PROFILER):
     """
     Helper method that loads the contents of a 'empires.dat' gzipped gamespec
     file.
 
     If cachefile_name is given, this file is consulted before performing the
-    load.
+    load, and written afterwards. It is only used if it was created from the
+    same dat file, with the same data format definitions.
+
+    If columnar is True, the record lists are returned as column tables,
+    see dataformat/columnar.py.
+
+    If jobs is not 1, the record lists are read by that many worker
+    processes (None: one per cpu), see dataformat/parallel_read.py.
+    The file is then decompressed completely before it is parsed.
+
+    If sections is given, only those record lists of EmpiresDat
+    (e.g. {"civs", "researches"}) are read, the others are skipped
+    and read on first use (see dataformat/lazy_read.py).
+    The result isn't cached then, and columnar is not supported.
+
+    The loading steps are measured by profiler (see util/profiler.py).
     """
+    if sections is not None and columnar:
+        raise ValueError("selective loading can't return columnar gamespecs")
+
+    from ..dataformat import columnar_cache
+
+    if cachefile_name:
+        dbg("hashing dat file")
+        with profiler.measure("gamespec hash"):
+            schema = columnar_cache.schema_fingerprint(EmpiresDatWrapper)
+            key = file_hash(fileobj)
+            fileobj.seek(0)
+
     # try to use the cached result from a previous run
     if cachefile_name and load_cache:
-        try:
-            with open(cachefile_name, "rb") as cachefile:
-                # pickle.load() can fail in many ways, we need to catch all.
-                # pylint: disable=broad-except
-                try:
-                    gamespec = pickle.load(cachefile)
-                    info("using cached gamespec: " + cachefile_name)
-                    return gamespec
-                except Exception as exc:
-                    warn("could not use cached gamespec:\n" + str(exc))
-        except FileNotFoundError:
-            pass
-
-    # read the file ourselves
-    from zlib import decompress
+        with profiler.measure("gamespec cache load"):
+            cache = columnar_cache.open_cache(cachefile_name, schema, key)
+            if cache is not None:
+                info("using cached gamespec: " + cachefile_name)
+                gamespec = cache.root(EmpiresDatWrapper)[0]
+                if not columnar:
+                    gamespec = gamespec.materialize()
+
+        if cache is not None:
+            return gamespec
 
     dbg("reading dat file")
-    compressed_data = fileobj.read()
-    fileobj.close()
+    gamespec = EmpiresDatWrapper()
 
-    dbg("decompressing dat file")
-    # -15: there's no header, window size is 15.
-    file_data = decompress(compressed_data, -15)
-    del compressed_data
+    if jobs is None:
+        jobs = os.cpu_count()
 
-    spam("length of decompressed data: %d" % len(file_data))
+    if sections is not None:
+        import zlib
+        from ..dataformat.lazy_read import read_selected
+        from ..dataformat.read_source import MemorySource
 
-    gamespec = EmpiresDatWrapper()
-    gamespec.read(file_data, 0)
+        # the skipped sections are read later, so all data is kept.
+        with profiler.measure("gamespec decompress") as step:
+            data = zlib.decompress(fileobj.read(), -15)
+            step.out_bytes = len(data)
+        fileobj.close()
+
+        empiresdat = EmpiresDat()
+        with profiler.measure("gamespec read", in_bytes=len(data)):
+            length = read_selected(empiresdat, MemorySource(data), 0, sections)
+        gamespec.empiresdat = [empiresdat]
+
+        spam("length of decompressed data: %d" % length)
+        return gamespec
+
+    if jobs == 1:
+        # read the file ourselves, it is decompressed while it is parsed.
+        from ..dataformat.read_source import ZlibStreamSource
+
+        # -15: there's no header, window size is 15.
+        source = ZlibStreamSource(fileobj, -15)
+
+        # the read time includes the decompression then,
+        # which is recorded separately as well.
+        with profiler.measure("gamespec read") as step:
+            length = gamespec.read(source, 0)
+            step.in_bytes = length
+
+        profiler.record("gamespec decompress", wall=source.decompress_time,
+                        cpu=source.decompress_cpu, out_bytes=length)
+
+    else:
+        import zlib
+        from ..dataformat.parallel_read import read_parallel
+
+        with profiler.measure("gamespec decompress") as step:
+            data = zlib.decompress(fileobj.read(), -15)
+            step.out_bytes = len(data)
+
+        # the wrapper only holds the one EmpiresDat,
+        # its record lists are what is read in parallel.
+        # the cpu time of the workers isn't measured.
+        empiresdat = EmpiresDat()
+        with profiler.measure("gamespec read", in_bytes=len(data)):
+            length = read_parallel(empiresdat, data, 0, jobs)
+        gamespec.empiresdat = [empiresdat]
+
+    fileobj.close()
+
+    spam("length of decompressed data: %d" % length)
+
+    if cachefile_name or columnar:
+        with profiler.measure("gamespec to columnar"):
+            columns = to_columnar(gamespec)
 
     if cachefile_name:
-        dbg("dumping dat file contents to cache file: " + cachefile_name)
-        with open(cachefile_name, "wb") as cachefile:
-            pickle.dump(gamespec, cachefile)
+        dbg("storing dat file contents in cache file: " + cachefile_name)
+        try:
+            with profiler.measure("gamespec cache write"):
+                columnar_cache.write_cache(cachefile_name, schema, key,
+                                           columns.table)
+        except (OSError, ValueError) as exc:
+            warn("could not write gamespec cache:\n" + str(exc))
+
+    if columnar:
+        return columns
 
     return gamespec
+
+
+def file_hash(fileobj, chunk_size=1024 * 1024):
+    """
+    Returns the sha256 hex digest of the contents of the binary file-like.
+    """
+    filehash = hashlib.sha256()
+
+    while True:
+        data = fileobj.read(chunk_size)
+        if not data:
+            break
+        filehash.update(data)
+
+    return filehash.hexdigest()
+
+
+def open_gamespec_cache(cachefile_name):
+    """
+    Opens the gamespec cache file that was written by load_gamespec,
+    without checking the dat file it was created from.
+
+    Returns the columnar gamespec, or None if there is no usable cache.
+    Only the accessed tables are loaded, e.g.
+
+        open_gamespec_cache(filename).empiresdat[0].civs
+    """
+    from ..dataformat import columnar_cache
+
+    cache = columnar_cache.open_cache(
+        cachefile_name, columnar_cache.schema_fingerprint(EmpiresDatWrapper))
+
+    if cache is None:
+        return None
+
+    return cache.root(EmpiresDatWrapper)[0]
+
+
+def to_columnar(gamespec):
+    """
+    Converts the read gamespec to the columnar representation.
+    """
+    from ..dataformat.columnar import to_columnar as convert
+
+    dbg("converting gamespec to columns")
+    return convert(gamespec)
@@ -5,6 +5,9 @@
 import os
 
 from . import changelog
+from .binpack import PACKERS, DEFAULT_PACKER
+from .opus import ENCODERS, DEFAULT_ENCODER, SAMPLE_RATES
+from .png import FILTERS as PNG_FILTERS, DEFAULT_FILTER as DEFAULT_PNG_FILTER
 
 from ..log import info, dbg
 from ..util.fslike.wrapper import (
@@ -201,7 +204,7 @@ def conversion_required(asset_dir, args):
                 setattr(args, "no_{}".format(component), True)
 
         if "metadata" in changes:
-            args.no_pickle_cache = True
+            args.no_gamespec_cache = True
 
         return True
 
@@ -240,16 +243,119 @@ def init_subparser(cli):
         help="do not convert any graphics")
 
     cli.add_argument(
-        "--no-pickle-cache", action='store_true',
-        help="don't use a pickle file to skip the dat file reading.")
+        "--no-gamespec-cache", "--no-pickle-cache", action='store_true',
+        help="don't use the cached contents of the dat file.")
+
+    cli.add_argument(
+        "--texture-packer", choices=sorted(PACKERS), default=DEFAULT_PACKER,
+        help="strategy for placing the frames on texture atlases")
+
+    cli.add_argument(
+        "--texture-power-of-two", action='store_true',
+        help="round texture atlas sizes up to powers of two")
+
+    cli.add_argument(
+        "--texture-max-size", type=int, default=None,
+        help="maximum width and height of texture atlases")
+
+    cli.add_argument(
+        "--texture-format", choices=("rgba", "indexed"), default="rgba",
+        help=("'rgba' stores the final colors of graphics textures, "
+              "'indexed' stores palette indices and pixel kinds, "
+              "for palette lookup and player recoloring at load time"))
+
+    cli.add_argument(
+        "--texture-players", type=int, default=None, metavar="N",
+        help=("store the graphics in the colors of players 1 to N; "
+              "the texture atlases contain all variants"))
+
+    cli.add_argument(
+        "--png-compression-level", type=int, choices=range(10), default=None,
+        metavar="{0-9}",
+        help=("zlib compression level of the generated PNG files; "
+              "0 is fastest, 9 produces the smallest files"))
+
+    cli.add_argument(
+        "--png-filter", choices=sorted(PNG_FILTERS),
+        default=DEFAULT_PNG_FILTER,
+        help=("scanline filter of the generated PNG files; "
+              "'adaptive' chooses the best filter for each row"))
+
+    cli.add_argument(
+        "--binary-gamedata", action='store_true',
+        help=("also store the gamespec data as binary tables, "
+              "which the engine loads faster than the csv files"))
+
+    cli.add_argument(
+        "--opus-encoder", choices=ENCODERS, default=DEFAULT_ENCODER,
+        help=("encoder for the sounds: libopus within the converter, "
+              "or the opusenc tool. 'auto' uses libopus if it's available"))
+
+    cli.add_argument(
+        "--opus-bitrate", type=int, default=None, metavar="KBPS",
+        help="bitrate of the converted sounds, in kbit/s")
+
+    cli.add_argument(
+        "--opus-sample-rate", type=int, choices=SAMPLE_RATES, default=None,
+        help=("sample rate that the sounds are resampled to for encoding; "
+              "by default, the lowest one that keeps all frequencies "
+              "(only used by libopus)"))
+
+    cli.add_argument(
+        "--no-incremental", action='store_true',
+        help="convert all media files, even if they are unchanged.")
+
+    cli.add_argument(
+        "--no-media-cache", action='store_true',
+        help="don't reuse media files from earlier conversions.")
+
+    cli.add_argument(
+        "--media-cache-dir", default=None,
+        help="directory for caching converted media files")
+
+    cli.add_argument(
+        "--media-cache-size", type=int, default=None,
+        help="maximum size of the media cache, in MiB")
+
+    cli.add_argument(
+        "--media-memory", type=int, default=None, metavar="MiB",
+        help=("limit for the media file data that is held in memory "
+              "during the conversion"))
 
     cli.add_argument(
         "--jobs", "-j", type=int, default=None)
 
+    cli.add_argument(
+        "--gamespec-jobs", type=int, default=None, metavar="N",
+        help=("read empires.dat with N worker processes. this needs the "
+              "whole decompressed file in memory; by default, it's read "
+              "by one process, and decompressed while it is parsed. "
+              "0 uses one process per cpu"))
+
+    cli.add_argument(
+        "--profile-report", default=None, metavar="FILE",
+        help=("measure the time, data sizes and memory usage of the "
+              "conversion steps, and write them to this json file"))
+
+    cli.add_argument(
+        "--profile-top", type=int, default=None, metavar="N",
+        help="number of slowest steps that are listed in the profile report")
+
 
 def main(args, error):
     """ CLI entry point """
-    del error  # unused
+    if args.texture_players is not None:
+        if args.texture_format == "indexed":
+            error("indexed textures are recolored at load time; "
+                  "--texture-players can't be used with them")
+        if args.texture_players < 1:
+            error("--texture-players must be at least 1")
+
+    if args.gamespec_jobs is not None and args.gamespec_jobs < 0:
+        error("--gamespec-jobs must not be negative")
+
+    if args.profile_top is not None and args.profile_top < 1:
+        error("--profile-top must be at least 1")
 
     # initialize libopenage
     from ..cppinterface.setup import setup
@@ -0,0 +1,253 @@
+# Copyright 2015-2015 the openage authors. See copying.md for legal info.
+
+"""
+Persistent, content-addressed cache for converted media files.
+
+The output files of each media file conversion are stored under a hash of
+the input file contents and all parameters that influence the conversion.
+When the same file is converted again (e.g. because the asset version was
+bumped for a metadata change), the outputs are simply copied from the cache.
+"""
+
+import hashlib
+from io import BytesIO
+import time
+from threading import Lock, get_ident
+
+from ..log import dbg
+from ..util.fslike.wrapper import Wrapper
+
+
+# increment whenever the media conversion produces different output files
+# for the same input (e.g. changes in the SLP decoding or texture packing).
+CONVERTER_VERSION = 2
+
+# default maximum total size of all cache entries, in bytes
+DEFAULT_MAX_SIZE = 2 * 1024 ** 3
+
+
+class OutputBuffer(Wrapper):
+    """
+    Wraps a path, but keeps the files that are written through it
+    in memory. Once they are closed, their contents are in outputs,
+    by their parts.
+    """
+    def __init__(self, obj):
+        super().__init__(obj)
+        self.outputs = {}
+
+    def open_w(self, parts):
+        return BufferedOutput(self.outputs, tuple(parts))
+
+    def __repr__(self):
+        return "OutputBuffer({})".format(repr(self.obj))
+
+
+class BufferedOutput(BytesIO):
+    """
+    A file written through an OutputBuffer.
+    """
+    def __init__(self, outputs, parts):
+        super().__init__()
+        self.outputs = outputs
+        self.parts = parts
+
+    def close(self):
+        if not self.closed:
+            self.outputs[self.parts] = self.getvalue()
+
+        super().close()
+
+
+def conversion_key(indata, variant, params):
+    """
+    Returns the key (a hex digest) for the conversion of indata.
+
+    variant describes how the file is converted, e.g. its file type.
+    params (bytes) shall identify all global settings that influence the
+    conversion (palette, texture packer, ...).
+    """
+    keyhash = hashlib.sha256()
+    keyhash.update(("%d %s\0" % (CONVERTER_VERSION, variant)).encode())
+    keyhash.update(params)
+    keyhash.update(b"\0")
+    keyhash.update(indata)
+
+    return keyhash.hexdigest()
+
+
+class MediaCache:
+    """
+    Stores the output files of media conversions in cachedir (a Path),
+    by their conversion_key.
+
+    Each entry is a directory, named by its key, that holds the output files.
+    The files are named by their suffix relative to the stem of the
+    converted file, e.g. '.slp.png' for 'graphics/123.slp'.
+
+    When the total size of all entries exceeds max_size, the least-recently
+    used entries are evicted. The mtimes of the entry directories track the
+    usage across multiple runs.
+    """
+
+    def __init__(self, cachedir, max_size=DEFAULT_MAX_SIZE):
+        self.cachedir = cachedir
+        self.max_size = max_size
+
+        # protects entries and total_size
+        self.lock = Lock()
+
+        # key -> [size, time of last use]
+        self.entries = {}
+        self.total_size = 0
+
+        self.hits = 0
+        self.misses = 0
+
+        cachedir.mkdirs()
+        for entry in cachedir.iterdir():
+            if not entry.is_dir():
+                continue
+
+            if '.' in entry.name:
+                # leftover of an interrupted store()
+                entry.removerecursive()
+                continue
+
+            size = sum(outfile.filesize for outfile in entry.iterdir())
+            self.entries[entry.name] = [size, entry.mtime]
+            self.total_size += size
+
+        with self.lock:
+            self.evict()
+
+    def __repr__(self):
+        return "MediaCache({})".format(self.cachedir)
+
+    def load(self, key):
+        """
+        Returns {suffix: data} for all outputs of the entry,
+        or None if the key is not in the cache.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            entry[1] = time.time()
+
+        entrydir = self.cachedir[key]
+
+        try:
+            entrydir.touch()
+
+            outputs = {}
+            for outpath in entrydir.iterdir():
+                with outpath.open_r() as outfile:
+                    outputs[outpath.name] = outfile.read()
+
+        except FileNotFoundError:
+            # the entry was evicted in the meantime.
+            with self.lock:
+                self.misses += 1
+            return None
+
+        with self.lock:
+            self.hits += 1
+
+        return outputs
+
+    def store(self, key, outputs):
+        """
+        Stores the {suffix: data} outputs for the key.
+        """
+        # write to a temporary directory, so that interrupted runs
+        # don't leave incomplete entries.
+        tmpdir = self.cachedir["%s.tmp%d" % (key, get_ident())]
+        tmpdir.mkdirs()
+
+        for suffix, data in outputs.items():
+            with tmpdir[suffix].open_w() as outfile:
+                outfile.write(data)
+
+        size = sum(len(data) for data in outputs.values())
+
+        with self.lock:
+            if key in self.entries:
+                # the same data was converted by some other thread.
+                tmpdir.removerecursive()
+                return
+
+            tmpdir.rename(self.cachedir[key])
+            self.entries[key] = [size, time.time()]
+            self.total_size += size
+
+            self.evict()
+
+    def evict(self):
+        """
+        Removes the least-recently used entries until the total size is
+        within max_size. Must be called with the lock held.
+        """
+        if self.total_size <= self.max_size:
+            return
+
+        count = 0
+        for key in sorted(self.entries, key=lambda key: self.entries[key][1]):
+            if self.total_size <= self.max_size:
+                break
+
+            self.cachedir[key].removerecursive()
+            self.total_size -= self.entries.pop(key)[0]
+            count += 1
+
+        dbg("evicted %d media cache entries" % count)
+
+
+def test():
+    """
+    Stores, loads and evicts some cache entries in a temporary directory.
+    """
+    import tempfile
+    from ..testing.testing import assert_value
+    from ..util.fslike.directory import Directory
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        cachedir = Directory(tmpdirname).root["media"]
+        cache = MediaCache(cachedir, max_size=100)
+
+        key = conversion_key(b"slp data", ".slp", b"palette")
+        assert_value(key == conversion_key(b"slp data", ".wav", b"palette"),
+                     False)
+        assert_value(cache.load(key), None)
+
+        cache.store(key, {".slp.png": b"png" * 10, ".slp.docx": b"csv"})
+        assert_value(cache.load(key), {".slp.png": b"png" * 10,
+                                       ".slp.docx": b"csv"})
+
+        # entries survive reopening the cache
+        cache = MediaCache(cachedir, max_size=100)
+        assert_value(cache.total_size, 33)
+        assert_value(cache.load(key)[".slp.docx"], b"csv")
+
+        # the least-recently used entry is evicted first
+        cache.store("a" * 64, {".opus": b"x" * 50})
+        cache.load(key)
+        cache.store("b" * 64, {".opus": b"y" * 50})
+
+        assert_value(cache.load("a" * 64), None)
+        assert_value(cache.load(key)[".slp.png"], b"png" * 10)
+        assert_value(cache.load("b" * 64), {".opus": b"y" * 50})
+        assert_value(cache.hits, 4)
+
+        # converted files are kept in memory until they are written
+        buf = OutputBuffer(cachedir)
+        with buf.root["graphics/1.slp.png"].open("wb") as outfile:
+            outfile.write(b"png")
+        with buf.root["graphics/1.slp.docx"].open("w") as outfile:
+            outfile.write("csv")
+
+        assert_value(buf.outputs, {(b"graphics", b"1.slp.png"): b"png",
+                                   (b"graphics", b"1.slp.docx"): b"csv"})
+        assert_value(cachedir["graphics"].exists(), False)
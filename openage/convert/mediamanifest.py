@@ -0,0 +1,255 @@
+# Copyright 2015-2015 the openage authors. See copying.md for legal info.
+
+"""
+Manifest of the converted media files, which allows incremental conversion.
+
+For each source media file, the manifest records its size, modification
+time, conversion key and the names of the produced output files.
+Files whose size and modification time are unchanged can then be skipped
+without reading them, and the outputs of removed source files can be deleted.
+"""
+
+import json
+from threading import Lock
+
+from ..log import dbg, info
+from .changelog import ASSET_VERSION, changes
+
+
+# file in the converted asset directory where the manifest is stored
+MANIFEST_FILENAME = "media_manifest.json"
+
+# increment when the manifest format changes
+MANIFEST_VERSION = 1
+
+
+def media_component(filename):
+    """
+    Returns the changelog component that the conversion of the media file
+    belongs to, or None if the file is only copied.
+    """
+    if filename.endswith('.slp'):
+        return "graphics"
+    elif filename.endswith('.wav'):
+        return "sounds"
+
+    return None
+
+
+class MediaManifest:
+    """
+    Tracks the converted media files in targetdir (a Path).
+
+    Designed to be used from multiple conversion threads.
+    """
+
+    def __init__(self, targetdir):
+        self.targetdir = targetdir
+
+        # source filename -> {"size": int, "mtime": float, "params": str,
+        #                     "key": str, "outputs": [str]}
+        self.entries = {}
+
+        # output names that may no longer be produced by any source file
+        self.obsolete = set()
+
+        self.lock = Lock()
+
+    def load(self):
+        """
+        Loads the manifest of an earlier conversion, if there is one.
+
+        Entries of components that changed since then are dropped,
+        so those files are converted again.
+        """
+        try:
+            with self.targetdir[MANIFEST_FILENAME].open("r") as manifest_file:
+                manifest = json.load(manifest_file)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            info("media manifest is corrupt, converting all media files")
+            return
+
+        if manifest.get("version") != MANIFEST_VERSION:
+            dbg("ignoring media manifest of version %s" % (
+                manifest.get("version")))
+            return
+
+        changed = changes(manifest["asset_version"])
+
+        for filename, entry in manifest["files"].items():
+            if media_component(filename) in changed:
+                self.obsolete.update(entry["outputs"])
+            else:
+                self.entries[filename] = entry
+
+    def save(self):
+        """
+        Writes the manifest to the target directory.
+        """
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "asset_version": ASSET_VERSION,
+            "files": self.entries,
+        }
+
+        with self.targetdir[MANIFEST_FILENAME].open("w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+
+    def outputs_exist(self, entry):
+        """
+        True if all outputs of the manifest entry still exist.
+        """
+        return all(self.targetdir[output].is_file()
+                   for output in entry["outputs"])
+
+    def unchanged(self, filename, size, mtime, params):
+        """
+        True if the file was converted with the same size, modification time
+        and conversion parameters (a key of the global settings) before,
+        and all its outputs still exist.
+
+        This doesn't need the file content, but can't detect modifications
+        that keep size and modification time. If the modification time is
+        unknown (None), the file has to be checked with up_to_date.
+        """
+        if mtime is None:
+            return False
+
+        with self.lock:
+            entry = self.entries.get(filename)
+
+        if (entry is None or entry["size"] != size or
+                entry.get("mtime") != mtime or
+                entry.get("params") != params):
+            return False
+
+        return self.outputs_exist(entry)
+
+    def up_to_date(self, filename, size, key, mtime=None, params=None):
+        """
+        True if the file was converted with the same size and key before,
+        and all its outputs still exist.
+
+        If given, the modification time and conversion parameters of the
+        entry are then updated, so the next check can be done with unchanged.
+        """
+        with self.lock:
+            entry = self.entries.get(filename)
+
+        if entry is None or entry["size"] != size or entry["key"] != key:
+            return False
+
+        if not self.outputs_exist(entry):
+            return False
+
+        if mtime is not None:
+            with self.lock:
+                entry["mtime"] = mtime
+                entry["params"] = params
+
+        return True
+
+    def update(self, filename, size, key, outputs, mtime=None, params=None):
+        """
+        Records the conversion of a source file.
+        """
+        with self.lock:
+            old_entry = self.entries.get(filename)
+            if old_entry is not None:
+                self.obsolete.update(set(old_entry["outputs"]) - set(outputs))
+
+            self.entries[filename] = {
+                "size": size,
+                "mtime": mtime,
+                "params": params,
+                "key": key,
+                "outputs": sorted(outputs),
+            }
+
+    def remove_missing(self, filenames):
+        """
+        Forgets all source files that are not in filenames;
+        their outputs become obsolete.
+        """
+        filenames = set(filenames)
+
+        with self.lock:
+            for filename in set(self.entries) - filenames:
+                self.obsolete.update(self.entries.pop(filename)["outputs"])
+
+    def delete_orphans(self):
+        """
+        Deletes all obsolete outputs that no source file produces anymore.
+
+        Returns the number of deleted files.
+        """
+        with self.lock:
+            produced = set()
+            for entry in self.entries.values():
+                produced.update(entry["outputs"])
+
+            orphans = self.obsolete - produced
+            self.obsolete = set()
+
+        count = 0
+        for output in sorted(orphans):
+            outpath = self.targetdir[output]
+            if outpath.is_file():
+                dbg("deleting orphaned output %s" % output)
+                outpath.unlink()
+                count += 1
+
+        return count
+
+
+def test():
+    """
+    Simulates two incremental conversions in a temporary directory.
+    """
+    import tempfile
+    from ..testing.testing import assert_value
+    from ..util.fslike.directory import Directory
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        targetdir = Directory(tmpdirname).root
+
+        for name in ("a.slp.png", "a.slp.docx", "b.opus", "c.bin"):
+            targetdir[name].touch()
+
+        manifest = MediaManifest(targetdir)
+        manifest.load()
+        manifest.update("a.slp", 10, "key_a", ["a.slp.png", "a.slp.docx"],
+                        mtime=1.5, params="params")
+        manifest.update("b.wav", 20, "key_b", ["b.opus"])
+        manifest.update("c.bin", 3, "key_c", ["c.bin"])
+        manifest.save()
+
+        manifest = MediaManifest(targetdir)
+        manifest.load()
+        assert_value(manifest.up_to_date("a.slp", 10, "key_a"), True)
+        assert_value(manifest.up_to_date("a.slp", 10, "key_x"), False)
+        assert_value(manifest.up_to_date("b.wav", 21, "key_b"), False)
+
+        # unchanged metadata suffices, without the key
+        assert_value(manifest.unchanged("a.slp", 10, 1.5, "params"), True)
+        assert_value(manifest.unchanged("a.slp", 10, 2.5, "params"), False)
+        assert_value(manifest.unchanged("a.slp", 10, 1.5, "other"), False)
+        assert_value(manifest.unchanged("a.slp", 10, None, "params"), False)
+
+        # b.wav has no recorded mtime, it's checked by its key instead
+        assert_value(manifest.unchanged("b.wav", 20, 1.5, "params"), False)
+        assert_value(manifest.up_to_date("b.wav", 20, "key_b",
+                                         1.5, "params"), True)
+        assert_value(manifest.unchanged("b.wav", 20, 1.5, "params"), True)
+
+        # missing outputs require reconversion
+        targetdir["c.bin"].unlink()
+        assert_value(manifest.up_to_date("c.bin", 3, "key_c"), False)
+
+        manifest.update("c.bin", 3, "key_c", ["c.bin"])
+        manifest.remove_missing(["a.slp", "c.bin"])
+        assert_value(manifest.delete_orphans(), 1)
+        assert_value(targetdir["b.opus"].is_file(), False)
+        assert_value(targetdir["a.slp.png"].is_file(), True)
@@ -0,0 +1,781 @@
+# Copyright 2015-2015 the openage authors. See copying.md for legal info.
+
+"""
+Opus encoder for WAV sounds.
+
+The sounds are encoded by libopus within the converter process (through
+ctypes), and stored in Ogg containers. The PCM data is read, resampled
+and encoded in chunks, and the Ogg pages are streamed to the output file.
+Each thread keeps its encoders, so they are reused for all sounds.
+
+If libopus is not available, or the WAV file is not plain PCM,
+the opusenc tool is used instead.
+
+For the formats, see RFC 3533 (Ogg), RFC 6716 (Opus)
+and RFC 7845 (Ogg Opus).
+"""
+
+import ctypes
+import ctypes.util
+from io import BytesIO
+import struct
+from subprocess import Popen, PIPE
+from threading import Lock, local
+import wave
+import zlib
+
+import numpy
+
+from ..log import dbg
+
+
+# the encoder choices: libopus if it's available, else opusenc; or either.
+ENCODERS = ("auto", "libopus", "opusenc")
+DEFAULT_ENCODER = "auto"
+
+# the input sample rates that are supported by the Opus encoder
+SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+
+# the Ogg Opus granule positions count samples at 48 kHz
+GRANULE_RATE = 48000
+
+# Opus frames of 20 ms are encoded
+FRAMES_PER_SECOND = 50
+
+# the number of PCM samples that is read from the WAV file at once
+CHUNK_SAMPLES = 64 * 1024
+
+# the audio pages are written when they hold (at least) this many bytes
+PAGE_SIZE = 4096
+
+# libopus constants, from opus_defines.h
+OPUS_OK = 0
+OPUS_APPLICATION_AUDIO = 2049
+OPUS_SET_BITRATE_REQUEST = 4002
+OPUS_GET_LOOKAHEAD_REQUEST = 4027
+OPUS_RESET_STATE = 4028
+
+# recommended size of the packet buffer, see opus_encode
+MAX_PACKET_SIZE = 4000
+
+
+class UnsupportedSound(Exception):
+    """
+    Raised for WAV files that can't be encoded by libopus.
+    """
+    pass
+
+
+_libopus = None
+_libopus_lock = Lock()
+
+
+def get_libopus():
+    """
+    Loads libopus, and returns the library; None if it's not available.
+    """
+    global _libopus  # pylint: disable=global-statement
+
+    with _libopus_lock:
+        if _libopus is None:
+            _libopus = False
+
+            libname = ctypes.util.find_library("opus")
+            if libname is not None:
+                try:
+                    _libopus = load_libopus(libname)
+                except OSError as exc:
+                    dbg("failed to load %s: %s" % (libname, exc))
+
+        return _libopus or None
+
+
+def load_libopus(libname):
+    """
+    Loads the libopus shared library, and declares its functions.
+    """
+    lib = ctypes.CDLL(libname)
+
+    lib.opus_encoder_create.argtypes = (ctypes.c_int32, ctypes.c_int,
+                                        ctypes.c_int,
+                                        ctypes.POINTER(ctypes.c_int))
+    lib.opus_encoder_create.restype = ctypes.c_void_p
+
+    lib.opus_encode.argtypes = (ctypes.c_void_p,
+                                ctypes.POINTER(ctypes.c_int16), ctypes.c_int,
+                                ctypes.c_char_p, ctypes.c_int32)
+    lib.opus_encode.restype = ctypes.c_int32
+
+    # opus_encoder_ctl is variadic, its arguments are given explicitly.
+    lib.opus_encoder_ctl.restype = ctypes.c_int
+
+    lib.opus_encoder_destroy.argtypes = (ctypes.c_void_p,)
+    lib.opus_encoder_destroy.restype = None
+
+    lib.opus_strerror.argtypes = (ctypes.c_int,)
+    lib.opus_strerror.restype = ctypes.c_char_p
+
+    lib.opus_get_version_string.argtypes = ()
+    lib.opus_get_version_string.restype = ctypes.c_char_p
+
+    return lib
+
+
+class OpusEncoder:
+    """
+    A libopus encoder for 16-bit PCM frames.
+    """
+
+    def __init__(self, lib, sample_rate, channels, bitrate=None):
+        self.lib = lib
+        self.sample_rate = sample_rate
+        self.channels = channels
+
+        error = ctypes.c_int()
+        self.handle = lib.opus_encoder_create(sample_rate, channels,
+                                              OPUS_APPLICATION_AUDIO,
+                                              ctypes.byref(error))
+        if error.value != OPUS_OK:
+            self.handle = None
+            raise Exception("failed to create the opus encoder: %s" %
+                            lib.opus_strerror(error.value).decode())
+
+        if bitrate is not None:
+            self.ctl(OPUS_SET_BITRATE_REQUEST, ctypes.c_int32(bitrate))
+
+        # the encoder delay, in samples
+        lookahead = ctypes.c_int32()
+        self.ctl(OPUS_GET_LOOKAHEAD_REQUEST, ctypes.byref(lookahead))
+        self.lookahead = lookahead.value
+
+        self.packet = ctypes.create_string_buffer(MAX_PACKET_SIZE)
+
+    def __del__(self):
+        if self.handle is not None:
+            self.lib.opus_encoder_destroy(self.handle)
+
+    def ctl(self, request, *args):
+        """
+        Calls opus_encoder_ctl.
+        """
+        ret = self.lib.opus_encoder_ctl(ctypes.c_void_p(self.handle),
+                                        ctypes.c_int(request), *args)
+        if ret != OPUS_OK:
+            raise Exception("opus encoder request %d failed: %s" % (
+                request, self.lib.opus_strerror(ret).decode()))
+
+    def reset(self):
+        """
+        Resets the encoder state, for encoding the next stream.
+        """
+        self.ctl(OPUS_RESET_STATE)
+
+    def encode(self, pcm):
+        """
+        Encodes one frame, a C-contiguous int16 array
+        of shape (frame size, channels). Returns the packet.
+        """
+        size = self.lib.opus_encode(
+            self.handle, pcm.ctypes.data_as(ctypes.POINTER(ctypes.c_int16)),
+            len(pcm), self.packet, MAX_PACKET_SIZE)
+
+        if size < 0:
+            raise Exception("opus encoding failed: %s" %
+                            self.lib.opus_strerror(size).decode())
+
+        return self.packet.raw[:size]
+
+
+# the encoders of each thread, by (library, sample rate, channels, bitrate)
+_encoders = local()
+
+
+def get_encoder(lib, sample_rate, channels, bitrate):
+    """
+    Returns an OpusEncoder of the current thread, reset for a new stream.
+    """
+    try:
+        encoders = _encoders.encoders
+    except AttributeError:
+        encoders = _encoders.encoders = {}
+
+    key = (lib, sample_rate, channels, bitrate)
+    encoder = encoders.get(key)
+    if encoder is None:
+        encoder = encoders[key] = OpusEncoder(*key)
+    else:
+        encoder.reset()
+
+    return encoder
+
+
+# for the ogg checksum, which is a crc32 with the bits the other way round
+# than zlib.crc32
+BIT_REVERSED = bytes(int("{:08b}".format(byte)[::-1], 2) for byte in range(256))
+
+
+def ogg_crc(data):
+    """
+    Returns the checksum of an Ogg page
+    (crc32, polynomial 0x04c11db7, no reflection, initial value 0).
+    """
+    # zlib.crc32 computes the reflected crc, and inverts its
+    # initial value and result.
+    crc = ~zlib.crc32(data.translate(BIT_REVERSED), 0xffffffff) & 0xffffffff
+    return int("{:032b}".format(crc)[::-1], 2)
+
+
+class OggWriter:
+    """
+    Writes the packets of one logical Ogg stream, in pages.
+
+    The most recent packet is held back until the next one arrives,
+    so the last page always contains a packet, and can carry the end of
+    stream flag and the final granule position.
+    """
+
+    # capture pattern, version, header type, granule position,
+    # serial number, page sequence number, checksum, segment count
+    page_header = struct.Struct("<4sBBqIIIB")
+
+    def __init__(self, outfile, serial):
+        self.outfile = outfile
+        self.serial = serial
+        self.sequence = 0
+
+        # lacing values and packets of the current page
+        self.segments = bytearray()
+        self.packets = []
+        self.size = 0
+
+        # granule position at the end of the current page
+        self.granule = 0
+
+        # the held back (packet, granule position)
+        self.held = None
+
+    def write_packet(self, packet, granule, flush=False):
+        """
+        Adds the packet to the stream. granule is the granule position
+        at the end of the packet. If flush is set, the page ends after it.
+        """
+        if self.held is not None:
+            self.add_packet(*self.held)
+            self.held = None
+
+            if self.size >= PAGE_SIZE:
+                self.flush()
+
+        if flush:
+            self.add_packet(packet, granule)
+            self.flush()
+        else:
+            self.held = packet, granule
+
+    def add_packet(self, packet, granule):
+        """
+        Adds the packet to the current page, or to a new one
+        if it doesn't fit.
+        """
+        # packets are split in segments of 255 bytes,
+        # the last segment is shorter.
+        lacing = bytes((255,)) * (len(packet) // 255) + bytes((len(packet) % 255,))
+        if len(self.segments) + len(lacing) > 255:
+            self.flush()
+
+        self.segments += lacing
+        self.packets.append(packet)
+        self.size += len(packet)
+        self.granule = granule
+
+    def flush(self, last=False):
+        """
+        Writes the current page, if it contains packets.
+        If last is set, it's marked as the end of the stream.
+        """
+        if not self.packets:
+            return
+
+        header_type = 0
+        if self.sequence == 0:
+            header_type |= 0x02  # beginning of stream
+        if last:
+            header_type |= 0x04  # end of stream
+
+        page = bytearray(self.page_header.pack(
+            b"OggS", 0, header_type, self.granule, self.serial,
+            self.sequence, 0, len(self.segments)))
+        page += self.segments
+        for packet in self.packets:
+            page += packet
+
+        struct.pack_into("<I", page, 22, ogg_crc(page))
+        self.outfile.write(page)
+
+        self.sequence += 1
+        self.segments = bytearray()
+        self.packets = []
+        self.size = 0
+
+    def close(self, granule):
+        """
+        Writes the last page, which ends with the held back packet.
+
+        granule is the final granule position; it may be lower than that
+        of the last packet, to trim the padding at the end of the stream
+        (RFC 7845, section 4.4). It must not be lower than the granule
+        position of the previous packet.
+        """
+        if self.held is None:
+            raise ValueError("the stream has no packet to end with")
+
+        packet, last_granule = self.held
+        self.held = None
+
+        if not self.granule <= granule <= last_granule:
+            raise ValueError("the final granule position %d is not within "
+                             "the last packet (%d to %d)" % (
+                                 granule, self.granule, last_granule))
+
+        self.add_packet(packet, granule)
+        self.flush(last=True)
+
+
+class Resampler:
+    """
+    Streaming resampler, by windowed sinc interpolation.
+
+    process() takes PCM chunks (arrays of shape (samples, channels)),
+    and returns the resampled samples that can be computed so far
+    (as float arrays); finish() returns the rest.
+    """
+
+    def __init__(self, in_rate, out_rate, channels, half_taps=16):
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        self.half_taps = half_taps
+
+        # the filter removes frequencies above the lower nyquist frequency
+        self.cutoff = min(1.0, out_rate / in_rate)
+
+        # the tap offsets relative to the input sample before an output
+        self.offsets = numpy.arange(1 - half_taps, half_taps + 1)
+
+        # the input samples that are still needed; buffer[0] is the input
+        # sample with index in_offset. the first output is at input 0.
+        self.buffer = numpy.zeros((half_taps, channels), dtype=numpy.float64)
+        self.in_offset = -half_taps
+        self.in_count = 0
+        self.out_count = 0
+
+    def process(self, pcm):
+        """
+        Adds the input samples, and returns the available output samples.
+        """
+        self.buffer = numpy.concatenate((self.buffer, pcm))
+        self.in_count += len(pcm)
+
+        # outputs can be computed while their last tap is in the buffer,
+        # i.e. their position is before last_input.
+        last_input = self.in_offset + len(self.buffer) - self.half_taps
+        count = -(-last_input * self.out_rate // self.in_rate) - self.out_count
+        if count <= 0:
+            return numpy.zeros((0, self.buffer.shape[1]))
+
+        # the positions of the outputs are bases + fractions
+        positions = (self.out_count + numpy.arange(count)) * self.in_rate
+        bases = positions // self.out_rate
+        fractions = (positions % self.out_rate) / self.out_rate
+
+        # distance of each tap from the output position
+        distances = self.offsets[None, :] - fractions[:, None]
+        weights = (numpy.sinc(distances * self.cutoff) *
+                   (0.5 + 0.5 * numpy.cos(numpy.pi * distances /
+                                          (self.half_taps + 1))))
+        weights /= weights.sum(axis=1, keepdims=True)
+
+        taps = self.buffer[(bases - self.in_offset)[:, None] + self.offsets[None, :]]
+        out = numpy.einsum("ot,otc->oc", weights, taps)
+
+        self.out_count += count
+
+        # drop the inputs that aren't needed for the next outputs
+        next_base = self.out_count * self.in_rate // self.out_rate
+        drop = next_base + 1 - self.half_taps - self.in_offset
+        if drop > 0:
+            self.buffer = self.buffer[drop:]
+            self.in_offset += drop
+
+        return out
+
+    def finish(self):
+        """
+        Returns the remaining output samples.
+        """
+        total = -(-self.in_count * self.out_rate // self.in_rate)
+        done = self.out_count
+
+        # the last outputs need the silence after the input.
+        in_count = self.in_count
+        out = self.process(numpy.zeros((
+            self.half_taps + self.in_rate // self.out_rate + 1,
+            self.buffer.shape[1])))
+        self.in_count = in_count
+
+        return out[:max(0, total - done)]
+
+
+def get_sample_rate(wav_rate):
+    """
+    Returns the encoder sample rate for a sound: the lowest that keeps
+    all of its frequencies.
+    """
+    for rate in SAMPLE_RATES:
+        if rate >= wav_rate:
+            return rate
+
+    return SAMPLE_RATES[-1]
+
+
+def read_pcm(wav):
+    """
+    Yields the samples of the wave.Wave_read object in chunks,
+    as int16 arrays of shape (samples, channels).
+    """
+    sample_width = wav.getsampwidth()
+    channels = wav.getnchannels()
+
+    while True:
+        data = wav.readframes(CHUNK_SAMPLES)
+        if not data:
+            return
+
+        if sample_width == 1:
+            # 8-bit samples are unsigned
+            pcm = (numpy.frombuffer(data, dtype=numpy.uint8)
+                   .astype(numpy.int16) - 128) << 8
+        else:
+            pcm = numpy.frombuffer(data, dtype="<i2").astype(numpy.int16)
+
+        yield pcm.reshape(-1, channels)
+
+
+def encode_wav(lib, wav, outfile, bitrate=None, sample_rate=None, serial=0):
+    """
+    Encodes the wave.Wave_read object with libopus,
+    and writes the Ogg Opus stream to outfile.
+
+    serial is the serial number of the Ogg stream.
+    """
+    wav_rate = wav.getframerate()
+    channels = wav.getnchannels()
+
+    if wav.getsampwidth() not in (1, 2) or channels not in (1, 2):
+        raise UnsupportedSound("%d-bit sound with %d channels" % (
+            wav.getsampwidth() * 8, channels))
+
+    if sample_rate is None:
+        sample_rate = get_sample_rate(wav_rate)
+
+    encoder = get_encoder(lib, sample_rate, channels, bitrate)
+    frame_size = sample_rate // FRAMES_PER_SECOND
+    granule_scale = GRANULE_RATE // sample_rate
+
+    resampler = None
+    if wav_rate != sample_rate:
+        resampler = Resampler(wav_rate, sample_rate, channels)
+
+    ogg = OggWriter(outfile, serial)
+
+    pre_skip = encoder.lookahead * granule_scale
+    ogg.write_packet(struct.pack("<8sBBHIhB", b"OpusHead", 1, channels,
+                                 pre_skip, wav_rate, 0, 0), 0, flush=True)
+
+    vendor = lib.opus_get_version_string()
+    ogg.write_packet(struct.pack("<8sI", b"OpusTags", len(vendor)) + vendor +
+                     struct.pack("<I", 0), 0, flush=True)
+
+    # the samples that don't fill a frame yet
+    pending = numpy.zeros((0, channels), dtype=numpy.int16)
+    sample_count = 0
+    granule = 0
+
+    def encode_frames(pcm):
+        """ encodes all complete frames, returns the remaining samples """
+        nonlocal granule
+
+        end = len(pcm) - len(pcm) % frame_size
+        for start in range(0, end, frame_size):
+            packet = encoder.encode(pcm[start:start + frame_size])
+            granule += frame_size * granule_scale
+            ogg.write_packet(packet, granule)
+
+        return pcm[end:]
+
+    def convert(samples):
+        """ resampled float samples to int16 """
+        return numpy.clip(numpy.rint(samples), -32768, 32767).astype(numpy.int16)
+
+    for pcm in read_pcm(wav):
+        if resampler is not None:
+            pcm = convert(resampler.process(pcm))
+
+        sample_count += len(pcm)
+        pending = encode_frames(numpy.concatenate((pending, pcm)))
+
+    if resampler is not None:
+        pcm = convert(resampler.finish())
+        sample_count += len(pcm)
+        pending = numpy.concatenate((pending, pcm))
+
+    # the encoder delays the samples by its lookahead, so that many
+    # samples of silence are encoded after them (and up to a full frame).
+    padding = (-(-(sample_count + encoder.lookahead) // frame_size) *
+               frame_size - sample_count)
+    encode_frames(numpy.concatenate((
+        pending, numpy.zeros((padding, channels), dtype=numpy.int16))))
+
+    ogg.close(pre_skip + sample_count * granule_scale)
+
+
+def effective_encoder(encoder):
+    """
+    Returns the encoder that encode_opus uses for the encoder choice
+    (one of ENCODERS): "auto" is resolved to "libopus" or "opusenc",
+    depending on whether libopus is available.
+
+    With "auto", sounds that libopus can't read still fall back to opusenc.
+    """
+    if encoder == "auto":
+        return "libopus" if get_libopus() is not None else "opusenc"
+
+    return encoder
+
+
+def encode_opusenc(indata, outfile, bitrate=None):
+    """
+    Encodes the sound file data with the opusenc tool,
+    and writes the Ogg Opus stream to outfile.
+    """
+    invocation = ['opusenc', '--quiet']
+    if bitrate is not None:
+        invocation.extend(('--bitrate', "%g" % (bitrate / 1000)))
+    invocation.extend(('-', '-'))
+
+    opusenc = Popen(invocation, stdin=PIPE, stdout=PIPE)
+    outdata = opusenc.communicate(input=indata)[0]
+    if opusenc.returncode != 0:
+        raise Exception("opusenc failed")
+
+    outfile.write(outdata)
+
+
+def encode_opus(indata, outfile, bitrate=None, sample_rate=None,
+                encoder=DEFAULT_ENCODER):
+    """
+    Encodes the WAV file data indata, and writes the Ogg Opus stream
+    to outfile.
+
+    bitrate is in bits per second, None lets the encoder choose.
+    sample_rate is the rate of the encoded samples (see SAMPLE_RATES),
+    None picks the lowest that doesn't lose frequencies of the sound.
+    It's only used by libopus.
+
+    encoder is one of ENCODERS.
+    """
+    if encoder not in ENCODERS:
+        raise ValueError("unknown opus encoder: %s" % encoder)
+
+    if sample_rate is not None and sample_rate not in SAMPLE_RATES:
+        raise ValueError("unsupported opus sample rate: %d" % sample_rate)
+
+    if encoder != "opusenc":
+        lib = get_libopus()
+
+        if lib is None:
+            if encoder == "libopus":
+                raise Exception("libopus is not available")
+
+        else:
+            try:
+                with wave.open(BytesIO(indata)) as wav:
+                    # the serial number only needs to be unique within
+                    # the file, but the same input shall give the same output.
+                    encode_wav(lib, wav, outfile, bitrate, sample_rate,
+                               zlib.crc32(indata))
+                return
+
+            except (wave.Error, EOFError, UnsupportedSound) as exc:
+                # this happens before anything is written.
+                if encoder == "libopus":
+                    raise
+
+                dbg("encoding with opusenc: %s" % exc)
+
+    encode_opusenc(indata, outfile, bitrate)
+
+
+def test():
+    """
+    Tests the Ogg pages and the resampler, and encodes a sound if libopus
+    is available.
+    """
+    from ..testing.testing import assert_value
+
+    # the crc check value of the Ogg crc parameters,
+    # and a plain bitwise computation.
+    assert_value(ogg_crc(b"123456789"), 0x89a1897f)
+
+    # "auto" is resolved to the encoder that is actually used
+    assert_value(effective_encoder("auto"),
+                 "libopus" if get_libopus() is not None else "opusenc")
+    assert_value(effective_encoder("opusenc"), "opusenc")
+
+    def slow_crc(data):
+        """ bitwise crc """
+        crc = 0
+        for byte in data:
+            crc ^= byte << 24
+            for _ in range(8):
+                crc = ((crc << 1) ^ 0x104c11db7) if crc & 0x80000000 else crc << 1
+        return crc
+
+    data = bytes(range(256)) * 3
+    assert_value(ogg_crc(data), slow_crc(data))
+
+    def read_pages(stream, serial):
+        """
+        Checks the pages of the Ogg stream, returns their
+        (header type, granule position, packets).
+        """
+        pages = []
+        pos = 0
+        while pos < len(stream):
+            (magic, _, header_type, granule, page_serial, sequence,
+             crc, segment_count) = OggWriter.page_header.unpack_from(stream, pos)
+            lacing = stream[pos + 27:pos + 27 + segment_count]
+            end = pos + 27 + segment_count + sum(lacing)
+
+            page = bytearray(stream[pos:end])
+            page[22:26] = bytes(4)
+            assert_value((magic, page_serial, ogg_crc(page), sequence),
+                         (b"OggS", serial, crc, len(pages)))
+
+            # no packet continues on the next page
+            assert_value(lacing[-1] < 255, True)
+
+            packets = [b""]
+            data_pos = pos + 27 + segment_count
+            for value in lacing:
+                packets[-1] += stream[data_pos:data_pos + value]
+                data_pos += value
+                if value < 255:
+                    packets.append(b"")
+
+            pages.append((header_type, granule, packets[:-1]))
+            pos = end
+
+        # the granule positions never decrease, and only the last page
+        # ends the stream; it contains packets.
+        granules = [granule for _, granule, _ in pages]
+        assert_value(granules, sorted(granules))
+        assert_value([header_type & 0x04 for header_type, _, _ in pages],
+                     [0] * (len(pages) - 1) + [0x04])
+        assert_value(len(pages[-1][2]) > 0, True)
+
+        return pages
+
+    # pages with packets of all kinds of sizes
+    outfile = BytesIO()
+    ogg = OggWriter(outfile, serial=42)
+    packets = [bytes([idx]) * (idx * 37 % 700) for idx in range(50)]
+    for idx, packet in enumerate(packets):
+        ogg.write_packet(packet, idx + 1, flush=(idx == 0))
+    ogg.close(49)
+
+    pages = read_pages(outfile.getvalue(), 42)
+    assert_value([packet for _, _, page_packets in pages
+                  for packet in page_packets], packets)
+    assert_value(pages[0][:2], (0x02, 1))
+    assert_value(pages[-1][1], 49)
+
+    # a resampled sine wave keeps its frequency and length
+    in_rate, out_rate = 22050, 24000
+    pcm = numpy.sin(numpy.arange(5000) * 2 * numpy.pi * 440 / in_rate)
+    resampler = Resampler(in_rate, out_rate, 1)
+    chunks = [resampler.process(pcm[start:start + 999, None])
+              for start in range(0, len(pcm), 999)]
+    chunks.append(resampler.finish())
+    out = numpy.concatenate(chunks)[:, 0]
+
+    assert_value(len(out), int(numpy.ceil(5000 * out_rate / in_rate)))
+    expected = numpy.sin(numpy.arange(len(out)) * 2 * numpy.pi * 440 / out_rate)
+    assert_value(numpy.abs(out - expected)[50:-50].max() < 0.01, True)
+
+    class StandInLib:
+        """
+        Has the libopus functions used by OpusEncoder; the packets are
+        of constant size, so 16 of them fill a page.
+        Used if libopus isn't available.
+        """
+        # pylint: disable=no-self-use,unused-argument,invalid-name
+
+        def __init__(self):
+            self.rate = None
+
+        def opus_encoder_create(self, rate, channels, application, error):
+            """ returns a handle """
+            self.rate = rate
+            return 1
+
+        def opus_encoder_ctl(self, handle, request, *args):
+            """ reports the lookahead of libopus """
+            if request.value == OPUS_GET_LOOKAHEAD_REQUEST:
+                args[0]._obj.value = self.rate // 400 + self.rate // 250
+            return OPUS_OK
+
+        def opus_encode(self, handle, pcm, frame_size, packet, max_size):
+            """ writes a packet of PAGE_SIZE // 16 bytes """
+            size = PAGE_SIZE // 16
+            ctypes.memmove(packet, bytes([frame_size % 256]) * size, size)
+            return size
+
+        def opus_encoder_destroy(self, handle):
+            """ does nothing """
+            pass
+
+        def opus_get_version_string(self):
+            """ returns the vendor string """
+            return b"stand-in"
+
+    lib = get_libopus() or StandInLib()
+
+    # a short sound, and one whose packets fill whole pages
+    # (with the stand-in library).
+    rate = 48000
+    frame_size = rate // FRAMES_PER_SECOND
+    lookahead = rate // 400 + rate // 250
+    for sample_count in (100, 32 * frame_size - lookahead):
+        wavfile = BytesIO()
+        with wave.open(wavfile, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(rate)
+            wav.writeframes((numpy.sin(numpy.arange(sample_count) / 10) * 10000)
+                            .astype("<i2").tobytes())
+
+        outfile = BytesIO()
+        with wave.open(BytesIO(wavfile.getvalue())) as wav:
+            encode_wav(lib, wav, outfile, serial=7)
+
+        pages = read_pages(outfile.getvalue(), 7)
+        head, = pages[0][2]
+        assert_value(head[:8], b"OpusHead")
+        assert_value(pages[1][2][0][:8], b"OpusTags")
+
+        pre_skip = struct.unpack_from("<H", head, 10)[0]
+        assert_value(pages[-1][1], pre_skip + sample_count)
+
+        if isinstance(lib, StandInLib):
+            audio_packets = sum(len(packets) for _, _, packets in pages[2:])
+            assert_value(audio_packets, -(-(sample_count + lookahead) // frame_size))
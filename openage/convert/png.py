@@ -0,0 +1,259 @@
+# Copyright 2015-2015 the openage authors. See copying.md for legal info.
+
+"""
+PNG writer for NumPy image arrays.
+
+The scanlines are filtered and compressed in blocks of rows, and streamed
+to the output file as IDAT chunks, so no full copy of the image is created.
+
+For the format documentation, see https://www.w3.org/TR/PNG/.
+"""
+
+import struct
+import zlib
+
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# PNG color types, by number of channels: gray, gray+alpha, rgb, rgba
+COLOR_TYPES = {1: 0, 2: 4, 3: 2, 4: 6}
+
+# PNG color type of palette images
+COLOR_TYPE_INDEXED = 3
+
+# the PNG filter types, by name.
+# 'adaptive' picks the best filter for each row.
+FILTERS = {
+    "none": 0,
+    "sub": 1,
+    "up": 2,
+    "average": 3,
+    "paeth": 4,
+    "adaptive": None,
+}
+
+DEFAULT_FILTER = "adaptive"
+DEFAULT_COMPRESSION_LEVEL = 6
+
+# the compressed data is written in IDAT chunks of (at least) this size
+IDAT_CHUNK_SIZE = 256 * 1024
+
+# the uncompressed size of the row blocks that are filtered at once
+BLOCK_SIZE = 1024 * 1024
+
+
+def write_chunk(outfile, chunk_type, data=b""):
+    """
+    Writes one PNG chunk (length, type, data, crc).
+    """
+    outfile.write(struct.pack(">I", len(data)))
+    outfile.write(chunk_type)
+    outfile.write(data)
+    outfile.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(chunk_type))))
+
+
+def filter_rows(rows, prev_rows, bpp, filter_type):
+    """
+    Applies a PNG filter to a block of rows.
+
+    rows:      (n, stride) uint8 array of raw scanlines.
+    prev_rows: the scanlines above each of the rows.
+    bpp:       bytes per pixel.
+
+    Returns the filtered rows, as an uint8 array of the same shape.
+    """
+    import numpy
+
+    if filter_type == 0:
+        return rows
+
+    # the bytes left of each byte; zero for the first pixel.
+    left = numpy.zeros_like(rows)
+    left[:, bpp:] = rows[:, :-bpp]
+
+    if filter_type == 1:
+        return rows - left
+
+    if filter_type == 2:
+        return rows - prev_rows
+
+    if filter_type == 3:
+        average = (left.astype(numpy.uint16) + prev_rows) >> 1
+        return rows - average.astype(numpy.uint8)
+
+    if filter_type == 4:
+        upper_left = numpy.zeros_like(prev_rows)
+        upper_left[:, bpp:] = prev_rows[:, :-bpp]
+
+        left_i = left.astype(numpy.int16)
+        up_i = prev_rows.astype(numpy.int16)
+        upper_left_i = upper_left.astype(numpy.int16)
+
+        dist_left = numpy.abs(up_i - upper_left_i)
+        dist_up = numpy.abs(left_i - upper_left_i)
+        dist_upper_left = numpy.abs(left_i + up_i - 2 * upper_left_i)
+
+        predictor = numpy.where(
+            (dist_left <= dist_up) & (dist_left <= dist_upper_left),
+            left,
+            numpy.where(dist_up <= dist_upper_left, prev_rows, upper_left))
+
+        return rows - predictor
+
+    raise ValueError("unknown PNG filter type: %d" % filter_type)
+
+
+def filter_block(rows, prev_rows, bpp, filter_type):
+    """
+    Filters a block of rows, and prepends the filter type byte to each row.
+
+    If filter_type is None, the filter with the smallest sum of absolute
+    (signed) differences is chosen for each row.
+    """
+    import numpy
+
+    out = numpy.empty((rows.shape[0], rows.shape[1] + 1), dtype=numpy.uint8)
+
+    if filter_type is not None:
+        out[:, 0] = filter_type
+        out[:, 1:] = filter_rows(rows, prev_rows, bpp, filter_type)
+        return out
+
+    candidates = numpy.stack([
+        filter_rows(rows, prev_rows, bpp, candidate)
+        for candidate in range(5)
+    ])
+
+    # the absolute value of each byte, interpreted as signed.
+    byte_scores = numpy.arange(256, dtype=numpy.uint8)
+    byte_scores = numpy.minimum(byte_scores, 0 - byte_scores)
+
+    scores = byte_scores[candidates].sum(axis=2, dtype=numpy.uint32)
+    best = numpy.argmin(scores, axis=0)
+
+    out[:, 0] = best
+    out[:, 1:] = candidates[best, numpy.arange(rows.shape[0])]
+    return out
+
+
+def write_png(outfile, data, compression_level=DEFAULT_COMPRESSION_LEVEL,
+              png_filter=DEFAULT_FILTER, palette=None):
+    """
+    Writes the image to the binary file-like object outfile.
+
+    data is an uint8 array of shape (height, width, channels)
+    with 1 to 4 channels, or (height, width) for grayscale images.
+
+    If palette (a list of up to 256 (r, g, b) tuples) is given, data must be
+    a (height, width) array of palette indices, and a palette image is
+    written.
+    """
+    import numpy
+
+    if data.dtype != numpy.uint8:
+        raise ValueError("PNG data must be uint8, not %s" % data.dtype)
+
+    if data.ndim == 2:
+        data = data[:, :, numpy.newaxis]
+
+    height, width, channels = data.shape
+
+    if palette is not None:
+        if channels != 1:
+            raise ValueError("palette images must have exactly one channel")
+
+        if not 0 < len(palette) <= 256:
+            raise ValueError("invalid palette size: %d" % len(palette))
+
+        color_type = COLOR_TYPE_INDEXED
+    else:
+        try:
+            color_type = COLOR_TYPES[channels]
+        except KeyError:
+            raise ValueError("can't write PNG with %d channels" % channels) from None
+
+    try:
+        filter_type = FILTERS[png_filter]
+    except KeyError:
+        raise ValueError("unknown PNG filter: " + repr(png_filter)) from None
+
+    if width == 0 or height == 0:
+        raise ValueError("can't write empty PNG image")
+
+    outfile.write(PNG_SIGNATURE)
+    write_chunk(outfile, b"IHDR", struct.pack(
+        ">IIBBBBB", width, height, 8, color_type, 0, 0, 0))
+
+    if palette is not None:
+        write_chunk(outfile, b"PLTE", bytes(
+            channel for color in palette for channel in color[:3]))
+
+    compressor = zlib.compressobj(compression_level)
+    pending = []
+    pending_size = 0
+
+    stride = width * channels
+    block_rows = max(1, BLOCK_SIZE // stride)
+    prev_row = numpy.zeros((1, stride), dtype=numpy.uint8)
+
+    for start in range(0, height, block_rows):
+        # the scanlines; only copied if data is not contiguous.
+        block = data[start:start + block_rows].reshape(-1, stride)
+        prev_rows = numpy.concatenate((prev_row, block[:-1]))
+        prev_row = block[-1:]
+
+        compressed = compressor.compress(
+            filter_block(block, prev_rows, channels, filter_type).tobytes())
+
+        if compressed:
+            pending.append(compressed)
+            pending_size += len(compressed)
+
+        if pending_size >= IDAT_CHUNK_SIZE:
+            write_chunk(outfile, b"IDAT", b"".join(pending))
+            pending = []
+            pending_size = 0
+
+    pending.append(compressor.flush())
+    write_chunk(outfile, b"IDAT", b"".join(pending))
+    write_chunk(outfile, b"IEND")
+
+
+def test():
+    """
+    Writes random images with all filters, and decodes them with PIL.
+    """
+    from io import BytesIO
+
+    import numpy
+    from PIL import Image
+
+    from ..testing.testing import assert_value
+
+    rng = numpy.random.RandomState(1337)
+
+    for shape in ((1, 1, 4), (17, 31, 4), (40, 3, 3), (9, 50)):
+        # random noise, but with repeating parts like in real textures
+        image = rng.randint(0, 256, size=shape).astype(numpy.uint8)
+        image[shape[0] // 2:] = image[:shape[0] - shape[0] // 2]
+
+        for png_filter in sorted(FILTERS):
+            outfile = BytesIO()
+            write_png(outfile, image, png_filter=png_filter)
+
+            outfile.seek(0)
+            decoded = numpy.array(Image.open(outfile))
+            assert_value(numpy.array_equal(decoded, image), True)
+
+    # palette image
+    palette = [(idx, 255 - idx, idx // 2) for idx in range(256)]
+    image = rng.randint(0, 256, size=(20, 30)).astype(numpy.uint8)
+
+    outfile = BytesIO()
+    write_png(outfile, image, palette=palette)
+
+    outfile.seek(0)
+    decoded = Image.open(outfile)
+    assert_value(decoded.mode, "P")
+    assert_value(numpy.array_equal(numpy.array(decoded), image), True)
+    assert_value(decoded.getpalette()[3:6], [1, 254, 0])
@@ -1,95 +1,32 @@
 # Copyright 2013-2015 the openage authors. See copying.md for legal info.
 
 # TODO pylint: disable=C,R
-# TODO some major performance optimizations (including profiling).
 
-from struct import Struct, unpack_from
+from collections import OrderedDict
+from collections.abc import Sequence
+from struct import Struct
 
-from enum import Enum
+import numpy
 
 from ..log import spam, dbg
 
+from .slp_decoder import decode_frame
+
 # SLP files have little endian byte order
 endianness = "< "
 
 
-class SpecialColorValue(Enum):
-    shadow = "%"
-    transparent = " "
-    player_color = "P"
-    black_color = "#"
-
-
-class SpecialColor:
-    """
-    special color class to preserve the player number variable.
-
-    also used for storing unit outline colors.
-    """
-
-    def __init__(self, special_id, base_color=2):
-        """
-        base_color: value for the base player color used for outlines.
-        2 is lighter and suits better for outline display.
-        try to experiment with [0, 7]..
-        """
-
-        self.special_id = special_id
-        self.base_color = base_color
-
-    def get_pcolor_for_player(self, player):
-        """
-        determine the player color palette index for a given player.
-
-        the base color of this pixel is stored,
-        the remaining degree of freedom is passed as function argument.
-        """
-
-        if self.special_id in (2, SpecialColorValue.black_color):
-            # this ensures palette[16 -16] will be taken
-            return -16
-
-        elif self.special_id in (1, SpecialColorValue.player_color):
-            # return final color for outline or player
-            return 16 * player + self.base_color
+# the kind of each pixel, stored in SLPFrame.pkind.
+# the palette index stored in SLPFrame.pcolor is interpreted accordingly.
+# keep in sync with slp_decoder.pyx.
+PIXEL_TRANSPARENT = 0  # nothing is drawn, the palette index is unused
+PIXEL_OPAQUE = 1       # regular palette color
+PIXEL_SHADOW = 2       # transparent shadow pixel, the palette index is unused
+PIXEL_PLAYER = 3       # player color, index is the base player palette color
+PIXEL_OUTLINE_1 = 4    # special color 1: player-colored outline
+PIXEL_OUTLINE_2 = 5    # special color 2: black outline
 
-        else:
-            raise Exception("unknown special color")
-
-    def get_pcolor(self):
-        """
-        look up the special color purpose.
-
-        returns (base_color, is_outline_pixel)
-        """
-
-        if self.special_id in (2, SpecialColorValue.black_color):
-            # black outline pixel, we will probably never encounter this.
-            #  -16 ensures palette[16+(-16)=0] will be used.
-            return (-16, True)
-
-        elif self.special_id == 1:
-            # this is an player-colored outline pixel
-            return (self.base_color, True)
-
-        elif self.special_id == SpecialColorValue.player_color:
-            # this is a playercolor pixel base color
-            return (self.base_color, False)
-
-        else:
-            raise Exception("unknown special color")
-
-    def __hash__(self):
-        return hash((self.special_id, self.base_color))
-
-    def __eq__(self, other):
-        return (
-            self.special_id == other.special_id and
-            self.base_color == other.base_color
-        )
-
-    def __repr__(self):
-        return "S%s%d" % (self.special_id, self.base_color)
+PIXEL_KIND_COUNT = 6
 
 
 class SLP:
@@ -117,8 +54,17 @@ class SLP:
     # };
     slp_frame_info = Struct(endianness + "I I I I i i i i")
 
-    def __init__(self, data):
-        header = SLP.slp_header.unpack_from(data)
+    def __init__(self, data, frame_cache_size=16):
+        """
+        data may be any object supporting the buffer protocol (bytes,
+        mmap, ...); it is not copied. Only the header and frame table are
+        parsed here, the frames are decoded when they are accessed.
+
+        frame_cache_size is the number of decoded frames that are kept.
+        """
+        self.data = memoryview(data)
+
+        header = SLP.slp_header.unpack_from(self.data)
         version, frame_count, comment = header
 
         dbg("SLP")
@@ -126,7 +72,7 @@ class SLP:
         dbg(" frame count: " + str(frame_count))
         dbg(" comment:     " + comment.decode('ascii'))
 
-        self.frames = list()
+        self.frame_infos = list()
 
         spam(FrameInfo.repr_header())
 
@@ -136,22 +82,73 @@ class SLP:
                                    i * SLP.slp_frame_info.size)
 
             frame_info = FrameInfo(*SLP.slp_frame_info.unpack_from(
-                data, frame_header_offset
+                self.data, frame_header_offset
             ))
             spam(frame_info)
-            self.frames.append(SLPFrame(frame_info, data))
+            self.frame_infos.append(frame_info)
+
+        # the most recently used decoded frames, by index
+        self.frame_cache = OrderedDict()
+        self.frame_cache_size = frame_cache_size
+
+        # all frames, decoded on access
+        self.frames = SLPFrameSequence(self)
+
+    def get_frame(self, idx):
+        """
+        returns the decoded SLPFrame with the given index.
+        """
+        try:
+            frame = self.frame_cache[idx]
+            self.frame_cache.move_to_end(idx)
+            return frame
+        except KeyError:
+            pass
+
+        frame = SLPFrame(self.frame_infos[idx], self.data)
+
+        if self.frame_cache_size > 0:
+            self.frame_cache[idx] = frame
+            if len(self.frame_cache) > self.frame_cache_size:
+                self.frame_cache.popitem(last=False)
+
+        return frame
 
     def __str__(self):
         ret = list()
 
         ret.extend([repr(self), "\n", FrameInfo.repr_header(), "\n"])
-        for frame in self.frames:
-            ret.extend([repr(frame), "\n"])
+        for frame_info in self.frame_infos:
+            ret.extend([repr(frame_info), "\n"])
         return "".join(ret)
 
     def __repr__(self):
         # TODO: lookup the image content description
-        return "SLP image<%d frames>" % len(self.frames)
+        return "SLP image<%d frames>" % len(self.frame_infos)
+
+
+class SLPFrameSequence(Sequence):
+    """
+    the frames of a SLP, which are decoded when they are accessed.
+    """
+
+    def __init__(self, slp):
+        self.slp = slp
+
+    def __len__(self):
+        return len(self.slp.frame_infos)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self.slp.get_frame(i) for i in range(*idx.indices(len(self)))]
+
+        if idx < 0:
+            idx += len(self)
+
+        if not 0 <= idx < len(self):
+            raise IndexError("SLP frame index out of range: %d" % idx)
+
+        return self.slp.get_frame(idx)
 
 
 class FrameInfo:
@@ -187,376 +184,271 @@ class SLPFrame:
     one image inside the SLP. you can imagine it as a frame of a video.
     """
 
-    # struct slp_frame_row_edge {
-    #   unsigned short left_space;
-    #   unsigned short right_space;
-    # };
-    slp_frame_row_edge = Struct(endianness + "H H")
-
-    # struct slp_command_offset {
-    #   unsigned int offset;
-    # }
-    slp_command_offset = Struct(endianness + "I")
-
     def __init__(self, frame_info, data):
         self.info = frame_info
-
-        # for each row:
-        # contains (left, right) number of boundary pixels
-        self.boundaries = []
-        # stores the file offset for the first drawing command
-        self.cmd_offsets = []
+        width, height = self.info.size
 
         # palette index matrix representing the final image
-        self.pcolor = list()
-
-        # process bondary table
-        for i in range(self.info.size[1]):
-            outline_entry_position = (self.info.outline_table_offset + i *
-                                      SLPFrame.slp_frame_row_edge.size)
-
-            left, right = SLPFrame.slp_frame_row_edge.unpack_from(
-                data, outline_entry_position
-            )
-
-            # is this row completely transparent?
-            if left == 0x8000 or right == 0x8000:
-                # TODO: -1 or like should be enough
-                self.boundaries.append(SpecialColorValue.transparent)
-            else:
-                self.boundaries.append((left, right))
+        self.pcolor = numpy.zeros((height, width), dtype=numpy.uint8)
 
-        spam("boundary values: %s" % self.boundaries)
+        # pixel kind matrix, PIXEL_TRANSPARENT == 0 for all untouched pixels
+        self.pkind = numpy.zeros((height, width), dtype=numpy.uint8)
 
-        # process cmd table
-        for i in range(self.info.size[1]):
-            cmd_table_position = (self.info.qdl_table_offset + i *
-                                  SLPFrame.slp_command_offset.size)
-            cmd_offset, = SLPFrame.slp_command_offset.unpack_from(
-                data, cmd_table_position
-            )
-            self.cmd_offsets.append(cmd_offset)
+        # process the boundary and command tables and run the
+        # drawing commands of all rows, without holding the GIL.
+        decode_frame(data, self.info, self.pcolor, self.pkind)
 
-        spam("cmd_offsets:     %s" % self.cmd_offsets)
-
-        for i in range(self.info.size[1]):
-            self.pcolor.append(self.create_palette_color_row(data, i))
+    def get_picture_data(self, palette, player_number=0):
+        return determine_rgba_matrix(self.pcolor, self.pkind,
+                                     palette, player_number)
 
-    def create_palette_color_row(self, data, rowid):
+    def get_player_picture_data(self, palette, player_numbers):
         """
-        create palette indices (colors) for the given rowid.
+        returns the rgba images for all given player numbers,
+        as an uint8 array of shape (players, height, width, 4).
         """
+        return determine_player_rgba_matrices(self.pcolor, self.pkind,
+                                              palette, player_numbers)
 
-        first_cmd_offset = self.cmd_offsets[rowid]
-        bounds = self.boundaries[rowid]
-        pixel_count = self.info.size[0]
-
-        # row is completely transparent
-        if bounds == SpecialColorValue.transparent:
-            return [bounds] * pixel_count
-
-        left_boundary, right_boundary = bounds
-        missing_pixels = pixel_count - left_boundary - right_boundary
-
-        # start drawing the left transparent space
-        pcolor_row_beginning = [SpecialColorValue.transparent] * left_boundary
-
-        # process the drawing commands for this row.
-        pcolor_row_content = self.process_drawing_cmds(data, rowid,
-                                                       first_cmd_offset,
-                                                       missing_pixels)
-
-        # finish by filling up the right transparent space
-        pcolor_row_trailing = [SpecialColorValue.transparent] * right_boundary
-
-        # this is the resulting row data
-        row_data = sum((pcolor_row_beginning,
-                        pcolor_row_content,
-                        pcolor_row_trailing), [])
-
-        # verify size of generated row
-        if len(row_data) != pixel_count:
-            got = len(row_data)
-            summary = "%d/%d -> row %d, offset %d / %#x" % (
-                got, pixel_count, rowid, first_cmd_offset, first_cmd_offset)
-            txt = "got %%s pixels than expected: %s, missing: %d" % (
-                summary, abs(pixel_count - got))
-
-            raise Exception(txt % ("LESS" if got < pixel_count else "MORE"))
-
-        return row_data
-
-    def process_drawing_cmds(self, data, rowid,
-                             first_cmd_offset, missing_pixels):
+    def get_indexed_data(self):
         """
-        create palette indices (colors) for the drawing commands
-        found for this row in the SLP frame.
+        returns the palette index and pixel kind planes,
+        stacked to an uint8 array of shape (height, width, 2).
         """
+        return numpy.dstack((self.pcolor, self.pkind))
 
-        # position in the data blob, we start at the first command of this row
-        dpos = first_cmd_offset
-
-        # this array gets filled with palette indices by the cmds
-        pcolor_list = []
-
-        # is the end of the current row reached?
-        eor = False
-
-        # work through commands till end of row.
-        while not eor:
-            if len(pcolor_list) > missing_pixels:
-                raise Exception("Only %d pixels should be drawn in row %d!" % (
-                    missing_pixels, rowid))
-
-            # fetch drawing instruction
-            cmd = self.get_byte_at(data, dpos)
-
-            lower_nibble = 0x0f & cmd
-            higher_nibble = 0xf0 & cmd
-            lower_bits = 0b00000011 & cmd
-
-            # opcode: cmd, rowid: rowid
-
-            if lower_nibble == 0x0f:
-                # eol (end of line) command, this row is finished now.
-                eor = True
-                continue
-
-            elif lower_bits == 0b00000000:
-                # color_list command
-                # draw the following bytes as palette colors
-
-                pixel_count = cmd >> 2
-                for _ in range(pixel_count):
-                    dpos += 1
-                    color = self.get_byte_at(data, dpos)
-                    pcolor_list.append(color)
-
-            elif lower_bits == 0b00000001:
-                # skip command
-                # draw 'count' transparent pixels
-                # count = cmd >> 2; if count == 0: count = nextbyte
-
-                pixel_count, dpos = self.cmd_or_next(cmd, 2, data, dpos)
-                pcolor_list += [SpecialColorValue.transparent] * pixel_count
-
-            elif lower_nibble == 0x02:
-                # big_color_list command
-                # draw (higher_nibble << 4 + nextbyte) following palette colors
-
-                dpos += 1
-                nextbyte = self.get_byte_at(data, dpos)
-                pixel_count = (higher_nibble << 4) + nextbyte
-
-                for _ in range(pixel_count):
-                    dpos += 1
-                    color = self.get_byte_at(data, dpos)
-                    pcolor_list.append(color)
-
-            elif lower_nibble == 0x03:
-                # big_skip command
-                # draw (higher_nibble << 4 + nextbyte)
-                # transparent pixels
-
-                dpos += 1
-                nextbyte = self.get_byte_at(data, dpos)
-                pixel_count = (higher_nibble << 4) + nextbyte
-
-                pcolor_list += [SpecialColorValue.transparent] * pixel_count
-
-            elif lower_nibble == 0x06:
-                # player_color_list command
-                # we have to draw the player color for cmd>>4 times,
-                # or if that is 0, as often as the next byte says.
-
-                pixel_count, dpos = self.cmd_or_next(cmd, 4, data, dpos)
-                for _ in range(pixel_count):
-                    dpos += 1
-                    color = self.get_byte_at(data, dpos)
-
-                    # the SpecialColor class preserves the calculation with
-                    # player * 16 + color, this is the palette offset
-                    # for tinted player colors.
-                    entry = SpecialColor(
-                        special_id=SpecialColorValue.player_color,
-                        base_color=color)
+    def draw_picture_data(self, lookups, outs):
+        """
+        draws the rgba images onto the given uint8 arrays of shape
+        (height, width, 4), e.g. areas of a texture atlas.
 
-                    pcolor_list.append(entry)
+        lookups are the tables of rgba_lookup_table for each out.
+        """
+        # the index into the flattened (pixel kind, palette index) table
+        # is the same for all lookups.
+        flat_index = self.pkind.astype(numpy.intp) * 256 + self.pcolor
 
-            elif lower_nibble == 0x07:
-                # fill command
-                # draw 'count' pixels with color of next byte
+        for lookup, out in zip(lookups, outs):
+            numpy.take(lookup.reshape(PIXEL_KIND_COUNT * 256, 4), flat_index,
+                       axis=0, out=out, mode='clip')
 
-                pixel_count, dpos = self.cmd_or_next(cmd, 4, data, dpos)
+    def draw_indexed_data(self, out):
+        """
+        draws the palette index and pixel kind planes onto the given
+        uint8 array of shape (height, width, 2).
+        """
+        out[:, :, 0] = self.pcolor
+        out[:, :, 1] = self.pkind
 
-                dpos += 1
-                color = self.get_byte_at(data, dpos)
+    def __repr__(self):
+        return repr(self.info)
 
-                pcolor_list += [color] * pixel_count
 
-            elif lower_nibble == 0x0A:
-                # fill player color command
-                # draw the player color for 'count' times
+def rgba_lookup_table(palette, player_number=0):
+    """
+    creates the lookup table for converting palette indices to rgba values.
 
-                pixel_count, dpos = self.cmd_or_next(cmd, 4, data, dpos)
+    the table is indexed by [pixel kind, palette index].
+    """
 
-                dpos += 1
-                color = self.get_byte_at(data, dpos)
+    colors = numpy.array([palette[idx] for idx in range(len(palette))],
+                         dtype=numpy.uint8)
+    indices = numpy.arange(256)
 
-                # TODO: verify this. might be incorrect.
-                # color = ((color & 0b11001100) | 0b00110011)
+    lookup = numpy.zeros((PIXEL_KIND_COUNT, 256, 4), dtype=numpy.uint8)
 
-                # SpecialColor class preserves the calculation of
-                # player*16 + color
-                entry = SpecialColor(special_id=SpecialColorValue.player_color,
-                                     base_color=color)
-                pcolor_list += [entry] * pixel_count
+    # simply look up the color index in the table
+    lookup[PIXEL_OPAQUE, :, :3] = colors.take(indices, axis=0, mode='wrap')
+    lookup[PIXEL_OPAQUE, :, 3] = 255
 
-            elif lower_nibble == 0x0B:
-                # shadow command
-                # draw a transparent shadow pixel for 'count' times
+    # transparent pixels stay (0, 0, 0, 0)
+    lookup[PIXEL_SHADOW, :, 3] = 100
 
-                pixel_count, dpos = self.cmd_or_next(cmd, 4, data, dpos)
+    # get rgb base color from the color table
+    # store it the preview player color
+    # in the table: [16*player, 16*player+7]
+    player_colors = colors.take(indices + 16 * player_number,
+                                axis=0, mode='wrap')
+    lookup[PIXEL_PLAYER, :, :3] = player_colors
+    lookup[PIXEL_PLAYER, :, 3] = 254  # mark this pixel as player color
+    lookup[PIXEL_OUTLINE_1, :, :3] = player_colors
+    lookup[PIXEL_OUTLINE_1, :, 3] = 253  # mark this pixel as outline
 
-                pcolor_list += [SpecialColorValue.shadow] * pixel_count
+    # black outline pixel, we will probably never encounter this.
+    # -16 ensures palette[16+(-16)=0] will be used.
+    lookup[PIXEL_OUTLINE_2, :, :3] = colors.take(
+        indices + 16 * player_number - 16, axis=0, mode='wrap')
+    lookup[PIXEL_OUTLINE_2, :, 3] = 253
 
-            elif lower_nibble == 0x0E:
-                # "extended" commands. higher nibble specifies the instruction.
+    return lookup
 
-                if higher_nibble == 0x00:
-                    # render hint xflip command
-                    # render hint: only draw the following command,
-                    # if this sprite is not flipped left to right
-                    spam("render hint: xfliptest")
 
-                elif higher_nibble == 0x10:
-                    # render h notxflip command
-                    # render hint: only draw the following command,
-                    # if this sprite IS flipped left to right.
-                    spam("render hint: !xfliptest")
+def determine_rgba_matrix(pcolor, pkind, palette, player_number=0):
+    """
+    converts a palette index image matrix to an rgb matrix.
 
-                elif higher_nibble == 0x20:
-                    # table use normal command
-                    # set the transform color table to normal,
-                    # for the standard drawing commands
-                    spam("image wants normal color table now")
+    pcolor and pkind are the palette index and pixel kind matrices.
+    """
 
-                elif higher_nibble == 0x30:
-                    # table use alternat command
-                    # set the transform color table to alternate,
-                    # this affects all following standard commands
-                    spam("image wants alternate color table now")
+    return rgba_lookup_table(palette, player_number)[pkind, pcolor]
 
-                elif higher_nibble == 0x40:
-                    # outline_1 command
-                    # the next pixel shall be drawn as special color 1,
-                    # if it is obstructed later in rendering
-                    pcolor_list.append(SpecialColor(1))
 
-                elif higher_nibble == 0x60:
-                    # outline_2 command
-                    # same as above, but special color 2
-                    pcolor_list.append(SpecialColor(2))
+def player_lookup_table(palette, player_numbers):
+    """
+    creates the lookup tables for all given player numbers.
 
-                elif higher_nibble == 0x50:
-                    # outline_span_1 command
-                    # same as above, but span special color 1 nextbyte times.
+    the table is indexed by [player, pixel kind, palette index].
+    """
 
-                    dpos += 1
-                    pixel_count = self.get_byte_at(data, dpos)
+    return numpy.stack([rgba_lookup_table(palette, player_number)
+                        for player_number in player_numbers])
 
-                    pcolor_list += [SpecialColor(1)] * pixel_count
 
-                elif higher_nibble == 0x70:
-                    # outline_span_2 command
-                    # same as above, using special color 2
+def determine_player_rgba_matrices(pcolor, pkind, palette, player_numbers):
+    """
+    converts a palette index image matrix to the rgb matrices
+    of all given player numbers at once.
 
-                    dpos += 1
-                    pixel_count = self.get_byte_at(data, dpos)
+    returns an array of shape (players, height, width, 4).
+    """
 
-                    pcolor_list += [SpecialColor(2)] * pixel_count
+    lookup = player_lookup_table(palette, player_numbers)
+    lookup = lookup.reshape(len(player_numbers), PIXEL_KIND_COUNT * 256, 4)
 
-            else:
-                raise Exception(
-                    "unknown slp drawing command: " +
-                    "%#x in row %d" % (cmd, rowid) + " " +
-                    "stored in this row so far: %s" % pcolor_list)
+    # the index into the flattened (pixel kind, palette index) table
+    # is the same for all players.
+    flat_index = pkind.astype(numpy.intp) * 256 + pcolor
 
-            dpos += 1
+    return lookup[:, flat_index]
 
-        # end of row reached, return the created pixel array.
-        return pcolor_list
 
-    def get_byte_at(self, data, offset):
-        return unpack_from("B", data, offset)[0]
+def test():
+    """
+    Decodes a synthetic SLP frame that uses all drawing commands,
+    and rejects malformed frames.
+    """
+    from ..testing.testing import assert_value, TestError
 
-    def cmd_or_next(self, cmd, n, data, pos):
+    def build_slp(width, rows):
         """
-        to save memory, the draw amount may be encoded into
-        the drawing command itself in the upper n bits.
+        Returns the data of a SLP with a single frame.
+        rows are (left space, right space, commands), or None if the row
+        is transparent.
         """
-
-        packed_in_cmd = cmd >> n
-
-        if packed_in_cmd != 0:
-            return packed_in_cmd, pos
-
+        frame_info_offset = SLP.slp_header.size
+        outline_table_offset = frame_info_offset + SLP.slp_frame_info.size
+        qdl_table_offset = outline_table_offset + 4 * len(rows)
+
+        outline_table = b""
+        qdl_table = b""
+        commands = b""
+        cmd_offset = qdl_table_offset + 4 * len(rows)
+        for row in rows:
+            left, right, row_commands = row or (0x8000, 0x8000, b"\x0f")
+            outline_table += Struct("< H H").pack(left, right)
+            qdl_table += Struct("< I").pack(cmd_offset + len(commands))
+            commands += row_commands
+
+        return b"".join((
+            SLP.slp_header.pack(b"2.0N", 1, b"test"),
+            SLP.slp_frame_info.pack(qdl_table_offset, outline_table_offset,
+                                    0, 0, width, len(rows), 1, 2),
+            outline_table, qdl_table, commands))
+
+    rows = [
+        # color list, skip, fill
+        (1, 1, bytes((2 << 2, 10, 11, 1 << 2 | 0x01, 3 << 4 | 0x07, 20,
+                      0x0f))),
+        None,
+        # big color list, big skip, player color list, player color fill,
+        # shadow, render hint, outline
+        (0, 0, bytes((0x02, 2, 30, 31, 0x03, 1, 2 << 4 | 0x06, 3, 4,
+                      1 << 4 | 0x0a, 5, 1 << 4 | 0x0b, 0x0e, 0x4e, 0x0f))),
+        # outline 2, outline spans, skip and fill with the count in the
+        # next byte
+        (2, 0, bytes((0x6e, 0x5e, 2, 0x7e, 1, 0x01, 1, 0x07, 1, 7, 0x0f))),
+    ]
+
+    T, O, S, P = PIXEL_TRANSPARENT, PIXEL_OPAQUE, PIXEL_SHADOW, PIXEL_PLAYER
+    L1, L2 = PIXEL_OUTLINE_1, PIXEL_OUTLINE_2
+
+    expected_pcolor = numpy.array((
+        (0, 10, 11, 0, 20, 20, 20, 0),
+        (0, 0, 0, 0, 0, 0, 0, 0),
+        (30, 31, 0, 3, 4, 5, 0, 2),
+        (0, 0, 0, 2, 2, 0, 0, 7),
+    ), dtype=numpy.uint8)
+    expected_pkind = numpy.array((
+        (T, O, O, T, O, O, O, T),
+        (T, T, T, T, T, T, T, T),
+        (O, O, T, P, P, P, S, L1),
+        (T, T, L2, L1, L1, L2, T, O),
+    ), dtype=numpy.uint8)
+
+    frame = SLP(build_slp(8, rows)).frames[0]
+    assert_value(frame.info.hotspot, (1, 2))
+    assert_value(frame.pcolor.tolist(), expected_pcolor.tolist())
+    assert_value(frame.pkind.tolist(), expected_pkind.tolist())
+
+    indexed = numpy.zeros((4, 8, 2), dtype=numpy.uint8)
+    frame.draw_indexed_data(indexed)
+    assert_value(indexed.tolist(), frame.get_indexed_data().tolist())
+    assert_value(indexed[:, :, 1].tolist(), expected_pkind.tolist())
+
+    # the rgba images of two players
+    palette = [(idx, 255 - idx, 7) for idx in range(256)]
+    outs = numpy.zeros((2, 4, 8, 4), dtype=numpy.uint8)
+    frame.draw_picture_data([rgba_lookup_table(palette, player)
+                             for player in (1, 2)], outs)
+
+    assert_value(outs.tolist(),
+                 frame.get_player_picture_data(palette, (1, 2)).tolist())
+
+    for player, out in zip((1, 2), outs):
+        assert_value(out[0].tolist(), [
+            [0, 0, 0, 0], [10, 245, 7, 255], [11, 244, 7, 255], [0, 0, 0, 0],
+            [20, 235, 7, 255], [20, 235, 7, 255], [20, 235, 7, 255],
+            [0, 0, 0, 0]])
+        assert_value(out[1].tolist(), [[0, 0, 0, 0]] * 8)
+
+        # player colors are offset by 16 per player
+        base = 16 * player
+        assert_value(out[2, 3:].tolist(), [
+            [3 + base, 252 - base, 7, 254], [4 + base, 251 - base, 7, 254],
+            [5 + base, 250 - base, 7, 254], [0, 0, 0, 100],
+            [2 + base, 253 - base, 7, 253]])
+        assert_value(out[3, 2:4].tolist(), [
+            [base - 16, 271 - base, 7, 253], [2 + base, 253 - base, 7, 253]])
+
+    def assert_rejected(rows, message, data=None):
+        """ decoding the frame must fail with the message """
+        try:
+            SLP(data or build_slp(8, rows)).frames[0]
+        except Exception as exc:
+            assert_value(str(exc), validator=lambda msg: msg.startswith(message))
         else:
-            pos += 1
-            return self.get_byte_at(data, pos), pos
-
-    def draw_pcolor_to_row(self, rowid, color_list, count=1):
-        if not isinstance(color_list, list):
-            color_list = [color_list] * count
-
-        self.pcolor[rowid] += color_list
-
-    def get_picture_data(self, palette, player_number=0):
-        return determine_rgba_matrix(self.pcolor, palette, player_number)
-
-    def __repr__(self):
-        return repr(self.info)
-
-
-def determine_rgba_matrix(image_matrix, palette, player_number=0):
-    """
-    converts a palette index image matrix to an rgb matrix.
-    """
-    import numpy
-
-    rgba_data = list()
-
-    for row in image_matrix:
-        for pixel in row:
-            if isinstance(pixel, int):
-                # simply look up the color index in the table
-                r, g, b = palette[pixel]
-                color = (r, g, b, 255)
-
-            elif isinstance(pixel, SpecialColor):
-                base_pcolor, is_outline = pixel.get_pcolor()
-                if is_outline:
-                    alpha = 253  # mark this pixel as outline
-                else:
-                    alpha = 254  # mark this pixel as player color
+            raise TestError("the malformed frame was decoded")
 
-                # get rgb base color from the color table
-                # store it the preview player color
-                # in the table: [16*player, 16*player+7]
-                r, g, b = palette[base_pcolor + (16 * player_number)]
-                color = (r, g, b, alpha)
+    # data ends within a color list
+    data = build_slp(8, [(0, 0, bytes((8 << 2, 1, 2, 3, 4)))])
+    assert_rejected(None, "SLP data ended unexpectedly in row 0", data)
 
-            elif pixel is SpecialColorValue.transparent:
-                color = (0, 0, 0, 0)
+    # data ends without an end-of-row command
+    data = build_slp(8, [(0, 0, bytes((8 << 4 | 0x07, 1)))])
+    assert_rejected(None, "SLP data ended unexpectedly in row 0", data)
 
-            elif pixel is SpecialColorValue.shadow:
-                color = (0, 0, 0, 100)
+    # the tables exceed the data
+    data = build_slp(8, [(0, 0, b"\x0f")] * 3)[:-10]
+    assert_rejected(None, "SLP frame tables exceed the data size", data)
 
-            else:
-                raise Exception("Unknown color: %s (%s)" % (
-                    pixel, type(pixel)))
+    # more pixels than the row has
+    assert_rejected([None, (1, 0, bytes((8 << 4 | 0x07, 1, 0x0f)))],
+                    "Only 7 pixels should be drawn in row 1")
 
-            rgba_data.append(color)
+    # less pixels than the row has
+    assert_rejected([(0, 2, bytes((5 << 4 | 0x07, 1, 0x0f)))],
+                    "got LESS pixels than expected")
 
-    array_data = numpy.array(rgba_data, dtype=numpy.uint8)
-    return array_data.reshape(len(image_matrix), len(image_matrix[0]), 4)
+    # undocumented extended command
+    assert_rejected([(0, 0, bytes((0x8e, 8 << 4 | 0x07, 1, 0x0f)))],
+                    "unknown slp drawing command: 0x8e in row 0")
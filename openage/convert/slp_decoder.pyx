@@ -0,0 +1,349 @@
+# Copyright 2015-2015 the openage authors. See copying.md for legal info.
+
+"""
+Compiled SLP drawing command interpreter.
+
+Decodes the drawing commands of one SLP frame into the palette index and
+pixel kind planes, without holding the GIL. This allows decoding SLP files
+in plain threads.
+
+For the format documentation, see doc/media/slp-files.md.
+"""
+
+cimport cython
+from cpython.buffer cimport PyObject_GetBuffer, PyBuffer_Release, PyBUF_SIMPLE
+
+# keep in sync with the PIXEL_* kinds in slp.py
+cdef enum:
+    PIXEL_TRANSPARENT = 0
+    PIXEL_OPAQUE = 1
+    PIXEL_SHADOW = 2
+    PIXEL_PLAYER = 3
+    PIXEL_OUTLINE_1 = 4
+    PIXEL_OUTLINE_2 = 5
+
+# return values of decode_row
+cdef enum:
+    DECODE_OK = 0
+    DECODE_EOF = 1
+    DECODE_UNKNOWN_CMD = 2
+    DECODE_TOO_MANY_PIXELS = 3
+    DECODE_ROW_SIZE = 4
+
+
+cdef struct decode_state:
+    # the raw SLP data
+    const unsigned char *data
+    size_t size
+
+    # position in data, the next command is read from here
+    size_t dpos
+
+    # the current row of the palette index and pixel kind planes
+    unsigned char *pcolor_row
+    unsigned char *pkind_row
+
+    # position in the row, the next pixel will be drawn here
+    int pos
+
+    # the last drawing command, for error reporting
+    unsigned char cmd
+
+
+cdef inline unsigned int read_le(const unsigned char *data,
+                                 unsigned int bytecount) nogil:
+    """
+    Decodes the next bytecount bytes as a little-endian value.
+    """
+    cdef unsigned int result = 0
+    cdef unsigned int i
+
+    for i in range(bytecount):
+        result |= (<unsigned int> data[i]) << (8 * i)
+
+    return result
+
+
+cdef inline int next_byte(decode_state *state, unsigned int *value) nogil:
+    """
+    Advances to the next byte of the data, and stores it in value.
+    """
+    state.dpos += 1
+    if state.dpos >= state.size:
+        return DECODE_EOF
+
+    value[0] = state.data[state.dpos]
+    return DECODE_OK
+
+
+cdef inline int cmd_or_next(decode_state *state, unsigned int n,
+                            unsigned int *count) nogil:
+    """
+    To save memory, the draw amount may be encoded into
+    the drawing command itself in the upper n bits.
+    """
+    count[0] = state.cmd >> n
+    if count[0] != 0:
+        return DECODE_OK
+
+    return next_byte(state, count)
+
+
+cdef int decode_row(decode_state *state, int row_end) nogil:
+    """
+    Interprets the drawing commands of one row, starting at state.dpos,
+    until the end-of-row command is reached.
+    """
+    cdef unsigned char cmd
+    cdef unsigned char lower_nibble, higher_nibble, lower_bits
+    cdef unsigned int pixel_count, color, i
+    cdef int ret
+    cdef int kind
+
+    # palette indices are copied from the data at this position;
+    # -1 means a single color is used (or the palette index is unused).
+    cdef size_t color_pos
+
+    while True:
+        if state.dpos >= state.size:
+            return DECODE_EOF
+
+        # fetch drawing instruction
+        cmd = state.data[state.dpos]
+        state.cmd = cmd
+
+        lower_nibble = 0x0f & cmd
+        higher_nibble = 0xf0 & cmd
+        lower_bits = 0b00000011 & cmd
+
+        pixel_count = 0
+        kind = PIXEL_TRANSPARENT
+        color = 0
+        color_pos = <size_t> -1
+        ret = DECODE_OK
+
+        if lower_nibble == 0x0f:
+            # eol (end of line) command, this row is finished now.
+            return DECODE_OK
+
+        elif lower_bits == 0b00000000:
+            # color_list command
+            # draw the following bytes as palette colors
+            pixel_count = cmd >> 2
+            kind = PIXEL_OPAQUE
+            color_pos = state.dpos + 1
+            state.dpos += pixel_count
+
+        elif lower_bits == 0b00000001:
+            # skip command
+            # draw 'count' transparent pixels
+            ret = cmd_or_next(state, 2, &pixel_count)
+
+        elif lower_nibble == 0x02:
+            # big_color_list command
+            # draw (higher_nibble << 4 + nextbyte) following palette colors
+            ret = next_byte(state, &pixel_count)
+            pixel_count += higher_nibble << 4
+            kind = PIXEL_OPAQUE
+            color_pos = state.dpos + 1
+            state.dpos += pixel_count
+
+        elif lower_nibble == 0x03:
+            # big_skip command
+            # draw (higher_nibble << 4 + nextbyte) transparent pixels
+            ret = next_byte(state, &pixel_count)
+            pixel_count += higher_nibble << 4
+
+        elif lower_nibble == 0x06:
+            # player_color_list command
+            # the player color base indices follow, one per pixel.
+            ret = cmd_or_next(state, 4, &pixel_count)
+            kind = PIXEL_PLAYER
+            color_pos = state.dpos + 1
+            state.dpos += pixel_count
+
+        elif lower_nibble == 0x07:
+            # fill command
+            # draw 'count' pixels with color of next byte
+            ret = cmd_or_next(state, 4, &pixel_count)
+            if ret == DECODE_OK:
+                ret = next_byte(state, &color)
+            kind = PIXEL_OPAQUE
+
+        elif lower_nibble == 0x0A:
+            # fill player color command
+            # draw the player color for 'count' times
+            ret = cmd_or_next(state, 4, &pixel_count)
+            if ret == DECODE_OK:
+                ret = next_byte(state, &color)
+            kind = PIXEL_PLAYER
+
+        elif lower_nibble == 0x0B:
+            # shadow command
+            # draw a transparent shadow pixel for 'count' times
+            ret = cmd_or_next(state, 4, &pixel_count)
+            kind = PIXEL_SHADOW
+
+        elif lower_nibble == 0x0E:
+            # "extended" commands. higher nibble specifies the instruction.
+            # 0x00 to 0x30 are render hints and color table selections,
+            # which don't draw anything.
+
+            if higher_nibble == 0x40:
+                # outline_1 command
+                # the next pixel shall be drawn as special color 1,
+                # based on player color 2.
+                pixel_count = 1
+                kind = PIXEL_OUTLINE_1
+                color = 2
+
+            elif higher_nibble == 0x60:
+                # outline_2 command
+                # same as above, but special color 2
+                pixel_count = 1
+                kind = PIXEL_OUTLINE_2
+
+            elif higher_nibble == 0x50:
+                # outline_span_1 command
+                # same as above, but span special color 1 nextbyte times.
+                ret = next_byte(state, &pixel_count)
+                kind = PIXEL_OUTLINE_1
+                color = 2
+
+            elif higher_nibble == 0x70:
+                # outline_span_2 command
+                # same as above, using special color 2
+                ret = next_byte(state, &pixel_count)
+                kind = PIXEL_OUTLINE_2
+
+            elif higher_nibble > 0x70:
+                # undocumented, its length is unknown.
+                return DECODE_UNKNOWN_CMD
+
+        else:
+            return DECODE_UNKNOWN_CMD
+
+        if ret != DECODE_OK:
+            return ret
+
+        if state.pos + <int> pixel_count > row_end:
+            return DECODE_TOO_MANY_PIXELS
+
+        if color_pos != <size_t> -1:
+            if color_pos + pixel_count > state.size:
+                return DECODE_EOF
+
+            for i in range(pixel_count):
+                state.pcolor_row[state.pos + i] = state.data[color_pos + i]
+        else:
+            for i in range(pixel_count):
+                state.pcolor_row[state.pos + i] = color
+
+        for i in range(pixel_count):
+            state.pkind_row[state.pos + i] = kind
+
+        state.pos += pixel_count
+        state.dpos += 1
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def decode_frame(data, frame_info,
+                 unsigned char[:, ::1] pcolor,
+                 unsigned char[:, ::1] pkind):
+    """
+    Decodes the SLP frame described by frame_info (a slp.FrameInfo)
+    from data (any object supporting the buffer protocol).
+
+    The palette indices and pixel kinds are drawn into the given
+    (height, width) planes, which must be filled with zeroes.
+    """
+    cdef int width = frame_info.size[0]
+    cdef int height = frame_info.size[1]
+    cdef size_t outline_table_offset = frame_info.outline_table_offset
+    cdef size_t qdl_table_offset = frame_info.qdl_table_offset
+
+    if pcolor.shape[0] != height or pcolor.shape[1] != width:
+        raise ValueError("palette index plane does not match frame size")
+
+    if pkind.shape[0] != height or pkind.shape[1] != width:
+        raise ValueError("pixel kind plane does not match frame size")
+
+    cdef Py_buffer buf
+    PyObject_GetBuffer(data, &buf, PyBUF_SIMPLE)
+
+    cdef decode_state state
+    state.data = <const unsigned char *> buf.buf
+    state.size = buf.len
+
+    cdef int ret = DECODE_OK
+    cdef int rowid = 0
+    cdef int left_boundary = 0, right_boundary = 0, row_end = 0
+    cdef size_t first_cmd_offset = 0
+
+    try:
+        if (outline_table_offset + 4 * height > state.size or
+                qdl_table_offset + 4 * height > state.size):
+            raise Exception("SLP frame tables exceed the data size")
+
+        with nogil:
+            for rowid in range(height):
+                # struct slp_frame_row_edge {
+                #   unsigned short left_space;
+                #   unsigned short right_space;
+                # };
+                left_boundary = read_le(
+                    &state.data[outline_table_offset + 4 * rowid], 2)
+                right_boundary = read_le(
+                    &state.data[outline_table_offset + 4 * rowid + 2], 2)
+
+                # row is completely transparent
+                if left_boundary == 0x8000 or right_boundary == 0x8000:
+                    continue
+
+                # struct slp_command_offset {
+                #   unsigned int offset;
+                # }
+                first_cmd_offset = read_le(
+                    &state.data[qdl_table_offset + 4 * rowid], 4)
+
+                # the left and right transparent space is already in place.
+                row_end = width - right_boundary
+                state.pcolor_row = &pcolor[rowid, 0] if width > 0 else NULL
+                state.pkind_row = &pkind[rowid, 0] if width > 0 else NULL
+                state.pos = left_boundary
+                state.dpos = first_cmd_offset
+
+                if row_end < left_boundary:
+                    ret = DECODE_ROW_SIZE
+                else:
+                    ret = decode_row(&state, row_end)
+
+                if ret == DECODE_OK and state.pos != row_end:
+                    ret = DECODE_ROW_SIZE
+
+                if ret != DECODE_OK:
+                    break
+
+        if ret == DECODE_EOF:
+            raise Exception("SLP data ended unexpectedly in row %d" % rowid)
+
+        elif ret == DECODE_UNKNOWN_CMD:
+            raise Exception("unknown slp drawing command: %#x in row %d" % (
+                state.cmd, rowid))
+
+        elif ret == DECODE_TOO_MANY_PIXELS:
+            raise Exception("Only %d pixels should be drawn in row %d!" % (
+                row_end - left_boundary, rowid))
+
+        elif ret == DECODE_ROW_SIZE:
+            got = state.pos + right_boundary
+            summary = "%d/%d -> row %d, offset %d / %#x" % (
+                got, width, rowid, first_cmd_offset, first_cmd_offset)
+            txt = "got %%s pixels than expected: %s, missing: %d" % (
+                summary, abs(width - got))
+
+            raise Exception(txt % ("LESS" if got < width else "MORE"))
+
+    finally:
+        PyBuffer_Release(&buf)
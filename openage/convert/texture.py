@@ -4,13 +4,13 @@
 
 # TODO pylint: disable=C,R
 
-import math
-
-from ..log import spam
+from ..log import spam, dbg
 
+from .binpack import get_packer, packing_efficiency
 from .dataformat import (exportable, data_definition,
                          struct_definition, data_formatter)
 from .hardcoded.terrain_tile_size import TILE_HALFSIZE
+from .png import write_png, DEFAULT_COMPRESSION_LEVEL, DEFAULT_FILTER
 
 from .blendomatic import BlendingMode
 
@@ -38,6 +38,9 @@ def subtexture_meta(tx, ty, hx, hy, cx, cy):
 class TextureImage:
     """
     represents a image created from a (r,g,b,a) matrix.
+
+    picture_data is a numpy uint8 array of shape (height, width, 4),
+    or (height, width, 2) with the palette index and pixel kind planes.
     """
 
     def __init__(self, picture_data, hotspot=None):
@@ -55,10 +58,6 @@ class TextureImage:
 
         self.data = picture_data
 
-    def get_pil_image(self):
-        from PIL import Image
-        return Image.fromarray(self.data)
-
 
 class Texture(exportable.Exportable):
     image_format = "png"
@@ -84,45 +83,108 @@ class Texture(exportable.Exportable):
     # player-specific colors will be in color blue, but with an alpha of 254
     player_id = 1
 
-    def __init__(self, input_data, palette=None):
+    def __init__(self, input_data, palette=None, packer=None, indexed=False,
+                 player_numbers=None):
         super().__init__()
         spam("creating Texture from %s" % (repr(input_data)))
 
-        from .slp import SLP
+        from .slp import SLP, rgba_lookup_table, player_lookup_table
+
+        # indexed textures store the palette index and pixel kind planes
+        # instead of rgba values, see save().
+        self.indexed = False
+        self.palette = palette
+
+        # if player numbers are given, the atlas contains all frames in
+        # the colors of each player: the subtexture of a frame for the
+        # n-th player is at index n * frame_count + frame.
+        variant_count = 1
 
         if isinstance(input_data, SLP):
             if palette is None:
                 raise Exception("palette needed for SLP -> texture generation")
-            frames = [
-                # TODO this needs some _serious_ performance work
-                # (at least a 10x improvement, 50x would be better).
-                # ideas: remove PIL and use libpng via CPPInterface,
-                #        cythonize parts of SLP.py
-                TextureImage(frame.get_picture_data(palette, self.player_id),
-                             hotspot=frame.info.hotspot)
-                for frame in input_data.frames
-            ]
+
+            if player_numbers is not None:
+                if indexed:
+                    raise Exception("indexed textures can't have "
+                                    "player color variants")
+
+                lookups = player_lookup_table(palette, player_numbers)
+                variant_count = len(player_numbers)
+
+            elif indexed:
+                self.indexed = True
+            else:
+                lookups = [rgba_lookup_table(palette, self.player_id)]
+
+            def draw_frame(idx, outs):
+                """
+                decodes the frame, and draws its variants onto the atlas.
+                """
+                frame = input_data.frames[idx]
+                if self.indexed:
+                    frame.draw_indexed_data(outs[0])
+                else:
+                    # each frame's colors are looked up once for all players.
+                    frame.draw_picture_data(lookups, outs)
+
+            # the frames are decoded one by one, and drawn right onto the
+            # atlas, so the images of all frames are never held at once.
+            frame_infos = input_data.frame_infos
+            self.image_data, (self.width, self.height), self.image_metadata\
+                = draw_atlas([info.size for info in frame_infos] * variant_count,
+                             [info.hotspot for info in frame_infos] * variant_count,
+                             draw_frame, (2,) if self.indexed else (4,),
+                             packer, variant_count)
+
         elif isinstance(input_data, BlendingMode):
             frames = [
                 TextureImage(
-                    tile.get_picture_data(),
+                    tile_data,
                     hotspot=(TILE_HALFSIZE["x"], TILE_HALFSIZE["y"])
                 )
-                for tile in input_data.alphamasks
+                for tile_data in input_data.get_picture_data()
             ]
+
+            self.image_data, (self.width, self.height), self.image_metadata\
+                = merge_frames(frames, packer)
         else:
             raise Exception("cannot create Texture from unknown source type")
 
-        self.image_data, (self.width, self.height), self.image_metadata\
-            = merge_frames(frames)
+    def packing_efficiency(self):
+        """
+        Returns the fraction of the atlas area that is covered by the frames.
+        """
+        return packing_efficiency([(entry["w"], entry["h"])
+                                   for entry in self.image_metadata],
+                                  self.width, self.height)
 
-    def save(self, targetdir, filename, meta_formats):
+    def save(self, targetdir, filename, meta_formats,
+             compression_level=DEFAULT_COMPRESSION_LEVEL,
+             png_filter=DEFAULT_FILTER):
         """
         save the texture png and csv to the given path in obj.
+
+        compression_level and png_filter configure the PNG encoder.
+
+        indexed textures are stored as a palette png of the palette indices,
+        and a grayscale '.kind.png' of the slp.PIXEL_* kinds. the engine
+        can then do the palette lookup and player recoloring at load time.
         """
         # generate PNG file
-        with targetdir[filename + ".png"].open("wb") as imagefile:
-            self.image_data.get_pil_image().save(imagefile, 'png')
+        if self.indexed:
+            with targetdir[filename + ".png"].open("wb") as imagefile:
+                write_png(imagefile, self.image_data.data[:, :, 0],
+                          compression_level, png_filter,
+                          palette=self.palette.palette)
+
+            with targetdir[filename + ".kind.png"].open("wb") as imagefile:
+                write_png(imagefile, self.image_data.data[:, :, 1],
+                          compression_level, png_filter)
+        else:
+            with targetdir[filename + ".png"].open("wb") as imagefile:
+                write_png(imagefile, self.image_data.data,
+                          compression_level, png_filter)
 
         # generate formatted texture metadata
         formatter = data_formatter.DataFormatter()
@@ -139,101 +201,128 @@ class Texture(exportable.Exportable):
         return [struct_definition.StructDefinition(cls)]
 
 
-def merge_frames(frames, max_width=0, max_height=0):
+def merge_frames(frames, packer=None, variant_count=1):
     """
     merge all given frames of this slp to a single image file.
 
     frames = [TextureImage, ...]
+    packer = binpack.Packer that places the frames, default if None.
+    variant_count = number of variants of the same frames (e.g. player
+                    colors) in frames. the frames of each variant follow
+                    each other, and all variants share the same layout.
 
-    returns = TextureImage, [drawn_frames_meta]
+    returns = TextureImage, (width, height), [drawn_frames_meta]
     """
 
-    import numpy
-
-    # TODO: actually optimize free space on the texture.
-    # if you ever wanted to implement a combinatoric optimisation
-    # algorithm, go for it, this function just waits for you.
-    # https://en.wikipedia.org/wiki/Bin_packing_problem
-    #
-    # for now, using max values for solving bin packing problem
-    # after determining the maximum frame width and height,
-    # each frame will be placed in a grid with fields of these sizes.
-    # this wastes storage, but works. If your blood boils now because you
-    # wanna optimize for the best alignment, read the above notice again,
-    # and implement a better version.
-
     if len(frames) == 0:
         raise Exception("cannot create texture with empty input frame list")
 
-    # single-frame texture, no merging needed
-    elif len(frames) == 1:
-        cx, cy = frames[0].hotspot
-        w, h = frames[0].width, frames[0].height
-        return frames[0], (w, h), [subtexture_meta(0, 0, w, h, cx, cy)]
+    frame_count = len(frames) // variant_count
+
+    def draw_frame(idx, outs):
+        """ blits the variants of the frame onto the atlas """
+        for variant, out in enumerate(outs):
+            out[...] = frames[variant * frame_count + idx].data
 
-    # if not predefined, get maximum frame size by checking all frames
-    if max_width == 0 or max_height == 0:
-        max_width = max([teximg.width for teximg in frames])
-        max_height = max([teximg.height for teximg in frames])
+    return draw_atlas([(teximg.width, teximg.height) for teximg in frames],
+                      [teximg.hotspot for teximg in frames],
+                      draw_frame, frames[0].data.shape[2:],
+                      packer, variant_count)
 
-    max_per_row = math.ceil(math.sqrt(len(frames)))
-    num_rows = math.ceil(len(frames) / max_per_row)
 
-    # we leave 1 pixel free in between two sprites
-    free_space_px = 1
-    width = (max_width + free_space_px) * max_per_row
-    height = (max_height + free_space_px + 1) * num_rows
+def draw_atlas(sizes, hotspots, draw_frame, pixel_shape,
+               packer=None, variant_count=1):
+    """
+    place frames on a texture atlas, and let them draw themselves onto it.
 
-    spam("merging %d frames to %dx%d atlas, %d pics per row, %d rows." % (
-        len(frames), width, height, max_per_row, num_rows))
+    sizes = [(width, height), ...] of all frames, and hotspots their
+            hotspots, ordered like the frames of merge_frames.
+    draw_frame = function (idx, outs) that draws frame idx onto outs,
+                 the atlas areas of its variants. it's called once for
+                 each frame, in order.
+    pixel_shape = shape of one atlas pixel, e.g. (4,) for rgba.
 
-    # resulting draw pane
-    draw_data = list()
-    for _ in range(height):
-        row_data = list()
-        for _ in range(width):
-            row_data.append((0, 0, 0, 0))
-        draw_data.append(row_data)
+    returns = TextureImage, (width, height), [drawn_frames_meta]
+    """
 
-    pos_x = 0
-    pos_y = 0
+    import numpy
 
-    drawn_frames_meta = list()
-    drawn_current_row = 0
+    if len(sizes) == 0:
+        raise Exception("cannot create texture with empty input frame list")
 
-    for sub_frame in frames:
-        sub_w = sub_frame.width
-        sub_h = sub_frame.height
+    if len(sizes) % variant_count != 0:
+        raise Exception("%d frames can't be split into %d variants" % (
+            len(sizes), variant_count))
 
-        spam("drawing frame %03d on atlas at %d x %d..." % (
-            len(drawn_frames_meta), pos_x, pos_y))
+    frame_count = len(sizes) // variant_count
 
-        for y, row_data in enumerate(sub_frame.data):
-            for x, pixel_data in enumerate(row_data):
-                draw_data[y + pos_y][x + pos_x] = pixel_data
+    if packer is None:
+        packer = get_packer()
 
-                # print(pixel_data)
+    # single frames are packed as well, so the atlas size constraints
+    # apply to them too.
+    # the packer leaves 1 pixel free in between two sprites
+    width, height, positions = packer.pack_variants(sizes[:frame_count],
+                                                    variant_count)
 
-        # generate subtexture meta information object
-        hotspot_x, hotspot_y = sub_frame.hotspot
-        drawn_frames_meta.append(subtexture_meta(pos_x, pos_y,
-                                                 sub_w, sub_h,
-                                                 hotspot_x, hotspot_y))
+    dbg("packed %d frames to %dx%d atlas, efficiency %.1f%%" % (
+        len(sizes), width, height,
+        100 * packing_efficiency(sizes, width, height)))
 
-        drawn_current_row += 1
+    # resulting draw pane, all frames are drawn onto it
+    atlas_data = numpy.zeros((height, width) + tuple(pixel_shape),
+                             dtype=numpy.uint8)
 
-        # place the subtexture with a 1px border
-        pos_x += max_width + free_space_px
+    for idx in range(frame_count):
+        spam("drawing frame %03d on atlas" % idx)
 
-        # see if we have to start a new row now
-        if drawn_current_row > max_per_row - 1:
-            drawn_current_row = 0
-            pos_x = 0
-            pos_y += max_height + free_space_px
+        outs = list()
+        for variant in range(variant_count):
+            (pos_x, pos_y), (sub_w, sub_h) = (
+                positions[variant * frame_count + idx],
+                sizes[variant * frame_count + idx])
+            outs.append(atlas_data[pos_y:pos_y + sub_h, pos_x:pos_x + sub_w])
 
-    atlas_data = numpy.array(draw_data, dtype=numpy.uint8)
-    atlas = TextureImage(atlas_data)
+        draw_frame(idx, outs)
 
-    spam("successfully merged %d frames to atlas." % len(frames))
+    # generate subtexture meta information objects
+    drawn_frames_meta = [
+        subtexture_meta(pos_x, pos_y, sub_w, sub_h, hotspot_x, hotspot_y)
+        for (pos_x, pos_y), (sub_w, sub_h), (hotspot_x, hotspot_y)
+        in zip(positions, sizes, hotspots)
+    ]
+
+    spam("successfully merged %d frames to atlas." % len(sizes))
+
+    return TextureImage(atlas_data), (width, height), drawn_frames_meta
+
+
+def test():
+    """
+    Merges single frames, which must obey the atlas size constraints.
+    """
+    import numpy
 
-    return atlas, (width, height), drawn_frames_meta
+    from ..testing.testing import assert_value, assert_raises, result
+
+    frame = TextureImage(numpy.full((30, 50, 4), 7, dtype=numpy.uint8), (3, 4))
+
+    # without constraints, the frame is the atlas
+    atlas, size, meta = merge_frames([frame], get_packer())
+    assert_value(size, (50, 30))
+    assert_value(meta, [subtexture_meta(0, 0, 50, 30, 3, 4)])
+    assert_value(numpy.array_equal(atlas.data, frame.data), True)
+
+    # power of two
+    atlas, size, meta = merge_frames([frame], get_packer(power_of_two=True))
+    assert_value(size, (64, 32))
+    assert_value(atlas.data.shape, (32, 64, 4))
+    assert_value(meta, [subtexture_meta(0, 0, 50, 30, 3, 4)])
+    assert_value(numpy.array_equal(atlas.data[:30, :50], frame.data), True)
+
+    # maximum size
+    merge_frames([frame], get_packer(max_size=50))
+    with assert_raises(Exception):
+        result(merge_frames([frame], get_packer(max_size=40)))
+    with assert_raises(Exception):
+        result(merge_frames([frame], get_packer(power_of_two=True, max_size=50)))
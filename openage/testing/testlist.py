@@ -24,13 +24,48 @@ def tests_py():
            "doctest on all modules from DOCTEST_MODULES")
     yield "openage.assets.test"
     yield "openage.cabextract.test.test"
+    yield ("openage.convert.binpack.test",
+           "packs texture atlases with all packers")
+    yield ("openage.convert.blendomatic.test",
+           "reads blendomatic tiles onto their rhombus")
     yield "openage.convert.changelog.test"
+    yield ("openage.convert.dataformat.binary_snippet.test",
+           "writes binary gamedata tables")
+    yield ("openage.convert.dataformat.columnar.test",
+           "stores read gamedata records as columns")
+    yield ("openage.convert.dataformat.columnar_cache.test",
+           "writes and opens gamedata cache files")
+    yield ("openage.convert.dataformat.csv_snippet.test",
+           "generates csv data in chunks")
+    yield ("openage.convert.dataformat.lazy_read.test",
+           "reads selected gamedata sections, and the others on demand")
+    yield ("openage.convert.dataformat.parallel_read.test",
+           "reads gamedata record lists in worker processes")
+    yield ("openage.convert.dataformat.read_plan.test",
+           "reads binary data with compiled read plans")
+    yield ("openage.convert.dataformat.read_source.test",
+           "reads structs from a decompressed stream")
+    yield ("openage.convert.mediacache.test",
+           "stores and evicts media conversion cache entries")
+    yield ("openage.convert.mediamanifest.test",
+           "tracks incrementally converted media files")
+    yield ("openage.convert.opus.test",
+           "encodes sounds to ogg opus streams")
+    yield ("openage.convert.png.test",
+           "writes PNG files with all scanline filters")
+    yield ("openage.convert.slp.test",
+           "decodes SLP drawing commands and rejects malformed frames")
+    yield ("openage.convert.texture.test",
+           "merges single frames into texture atlases")
     yield "openage.cppinterface.exctranslate_tests.cpp_to_py"
     yield ("openage.cppinterface.exctranslate_tests.cpp_to_py_bounce",
            "translates the exception back and forth a few times")
     yield ("openage.testing.misc_cpp.enum",
            "tests the interface for C++'s util::Enum class")
+    yield ("openage.util.profiler.test",
+           "measures steps and writes the profile report")
     yield "openage.util.threading.test_concurrent_chain"
+    yield "openage.util.threading.test_pipeline"
 
 
 def demos_py():
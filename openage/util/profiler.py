@@ -0,0 +1,337 @@
+# Copyright 2015-2015 the openage authors. See copying.md for legal info.
+
+"""
+Profiling of multi-step tasks like the asset conversion.
+
+A Profiler records the wall time, cpu time, data sizes and memory usage
+of each measured step, and summarizes them in a report.
+"""
+
+from collections import OrderedDict
+import json
+import sys
+from threading import Lock
+import time
+
+try:
+    import resource
+except ImportError:
+    # not available on windows; no memory usage is recorded there.
+    resource = None
+
+
+# number of slowest steps that are listed in reports by default
+DEFAULT_TOP = 20
+
+
+def peak_memory():
+    """
+    Returns the peak memory usage (resident set size) of this process
+    so far, in bytes, or None if it can't be determined.
+    """
+    if resource is None:
+        return None
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # linux reports KiB, osx bytes.
+    if sys.platform == "darwin":
+        return maxrss
+    return maxrss * 1024
+
+
+class Measurement:
+    """
+    A measured step: stage is the kind of step (e.g. "slp decode"),
+    item what it has processed (e.g. a file name), or None.
+
+    Used as context manager around the step, which may set in_bytes,
+    out_bytes and efficiency (the used fraction of the step's output,
+    e.g. the area of a texture atlas that is covered by its frames).
+    The step must run in a single thread: the cpu time is that of the
+    measuring thread, the work of other threads or processes isn't included.
+
+    peak_growth is the amount by which the step has raised the peak memory
+    usage of the process. If other steps run at the same time, it may be
+    caused by them as well.
+    """
+
+    def __init__(self, profiler, stage, item=None, in_bytes=None):
+        self.profiler = profiler
+        self.stage = stage
+        self.item = item
+        self.in_bytes = in_bytes
+        self.out_bytes = None
+        self.efficiency = None
+
+        self.wall = None
+        self.cpu = None
+        self.peak_memory = None
+        self.peak_growth = None
+        self.failed = False
+
+    def __enter__(self):
+        self.peak_memory = peak_memory()
+        self.cpu = time.thread_time()
+        self.wall = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.wall = time.perf_counter() - self.wall
+        self.cpu = time.thread_time() - self.cpu
+
+        peak_before = self.peak_memory
+        self.peak_memory = peak_memory()
+        if self.peak_memory is not None:
+            self.peak_growth = self.peak_memory - peak_before
+
+        self.failed = exc_type is not None
+        self.profiler.add(self)
+
+    def to_dict(self):
+        """
+        Returns the results as json-compatible dict.
+        """
+        return OrderedDict((
+            ("stage", self.stage),
+            ("item", self.item),
+            ("wall", self.wall),
+            ("cpu", self.cpu),
+            ("in_bytes", self.in_bytes),
+            ("out_bytes", self.out_bytes),
+            ("efficiency", self.efficiency),
+            ("peak_memory", self.peak_memory),
+            ("peak_growth", self.peak_growth),
+            ("failed", self.failed),
+        ))
+
+    def __repr__(self):
+        return "Measurement(%s, %s)" % (self.stage, self.item)
+
+
+class NullMeasurement:
+    """
+    Stands in for a Measurement when nothing is profiled.
+    """
+
+    def __init__(self):
+        self.in_bytes = None
+        self.out_bytes = None
+        self.efficiency = None
+        self.wall = None
+        self.cpu = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+class Profiler:
+    """
+    Collects the Measurements of steps that may run in multiple threads.
+
+        with profiler.measure("png encode", filename) as step:
+            data = encode(image)
+            step.out_bytes = len(data)
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.measurements = []
+
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+
+    def measure(self, stage, item=None, in_bytes=None):
+        """
+        Returns a Measurement of the step, to be used as context manager.
+        """
+        return Measurement(self, stage, item, in_bytes)
+
+    def add(self, measurement):
+        """
+        Records the finished measurement.
+        """
+        with self.lock:
+            self.measurements.append(measurement)
+
+    def record(self, stage, item=None, wall=0.0, cpu=None,
+               in_bytes=None, out_bytes=None):
+        """
+        Records a step that was timed differently, e.g. in parts.
+        """
+        measurement = Measurement(self, stage, item, in_bytes)
+        measurement.wall = wall
+        measurement.cpu = cpu
+        measurement.out_bytes = out_bytes
+        self.add(measurement)
+
+    def stages(self):
+        """
+        Returns the totals per stage, slowest stages first.
+        """
+        totals = OrderedDict()
+
+        with self.lock:
+            measurements = list(self.measurements)
+
+        for measurement in measurements:
+            if measurement.stage not in totals:
+                totals[measurement.stage] = OrderedDict((
+                    ("stage", measurement.stage),
+                    ("count", 0),
+                    ("wall", 0.0),
+                    ("cpu", None),
+                    ("in_bytes", None),
+                    ("out_bytes", None),
+                    ("peak_memory", None),
+                ))
+
+            total = totals[measurement.stage]
+            total["count"] += 1
+            total["wall"] += measurement.wall
+
+            # these stay None if no measurement of the stage has them.
+            for key in ("cpu", "in_bytes", "out_bytes"):
+                value = getattr(measurement, key)
+                if value is not None:
+                    total[key] = (total[key] or 0) + value
+
+            if measurement.peak_memory is not None:
+                total["peak_memory"] = max(total["peak_memory"] or 0,
+                                           measurement.peak_memory)
+
+        return sorted(totals.values(), key=lambda total: -total["wall"])
+
+    def slowest(self, top=DEFAULT_TOP):
+        """
+        Returns the top slowest measurements.
+        """
+        with self.lock:
+            measurements = list(self.measurements)
+
+        measurements.sort(key=lambda measurement: -measurement.wall)
+        return measurements[:top]
+
+    def report(self, top=DEFAULT_TOP):
+        """
+        Returns the report as json-compatible dict: the totals of the run
+        and of each stage, all measurements in the order they finished,
+        and, at the end, the top slowest measurements.
+        """
+        with self.lock:
+            measurements = list(self.measurements)
+
+        return OrderedDict((
+            ("total", OrderedDict((
+                ("wall", time.perf_counter() - self.start_wall),
+                ("cpu", time.process_time() - self.start_cpu),
+                ("peak_memory", peak_memory()),
+            ))),
+            ("stages", self.stages()),
+            ("items", [measurement.to_dict() for measurement in measurements]),
+            ("slowest", [measurement.to_dict()
+                         for measurement in self.slowest(top)]),
+        ))
+
+    def save(self, fileobj, top=DEFAULT_TOP):
+        """
+        Writes the report to the text file-like fileobj, as json.
+        """
+        json.dump(self.report(top), fileobj, indent=1)
+        fileobj.write("\n")
+
+    def summary(self, top=DEFAULT_TOP):
+        """
+        Returns the top slowest measurements as text lines.
+        """
+        lines = []
+        for measurement in self.slowest(top):
+            line = "%8.3fs %8.3fs cpu  %s" % (measurement.wall, measurement.cpu or 0,
+                                               measurement.stage)
+            if measurement.item is not None:
+                line += ": %s" % measurement.item
+            lines.append(line)
+
+        return lines
+
+
+class NullProfiler:
+    """
+    Has the interface of Profiler, but doesn't profile anything.
+    """
+
+    @staticmethod
+    def measure(stage, item=None, in_bytes=None):
+        """ Returns a NullMeasurement """
+        del stage, item, in_bytes
+        return NullMeasurement()
+
+    def add(self, measurement):
+        """ Ignores the measurement """
+        pass
+
+    def record(self, stage, item=None, wall=0.0, cpu=None,
+               in_bytes=None, out_bytes=None):
+        """ Ignores the step """
+        pass
+
+
+# the profiler that is used when profiling is disabled
+NULL_PROFILER = NullProfiler()
+
+
+def test():
+    """
+    Profiles some steps, and checks the report.
+    """
+    from io import StringIO
+    from ..testing.testing import assert_value, assert_raises, result
+
+    profiler = Profiler()
+
+    for idx in range(4):
+        with profiler.measure("sum", "item %d" % idx, in_bytes=idx) as step:
+            step.out_bytes = sum(range(idx * 200000))
+
+    with profiler.measure("pack", "atlas") as step:
+        step.efficiency = 0.75
+
+    with assert_raises(ValueError):
+        with profiler.measure("fail"):
+            result(int("nope"))
+
+    stages = {stage["stage"]: stage for stage in profiler.stages()}
+    assert_value(sorted((name, stage["count"]) for name, stage in stages.items()),
+                 [("fail", 1), ("pack", 1), ("sum", 4)])
+    assert_value(stages["sum"]["in_bytes"], 6)
+    assert_value(stages["sum"]["out_bytes"], sum(range(600000)) +
+                 sum(range(400000)) + sum(range(200000)))
+
+    # steps with known durations, slower than the measured ones
+    profiler.record("parts", "part 0", wall=20.0, out_bytes=10)
+    profiler.record("parts", "part 1", wall=30.0, out_bytes=20)
+    assert_value(profiler.stages()[0]["stage"], "parts")
+
+    slowest = profiler.slowest(2)
+    assert_value([measurement.item for measurement in slowest],
+                 ["part 1", "part 0"])
+    assert_value(len(profiler.summary(3)), 3)
+
+    outfile = StringIO()
+    profiler.save(outfile, top=1)
+    report = json.loads(outfile.getvalue())
+
+    assert_value(list(report), ["total", "stages", "items", "slowest"])
+    assert_value(len(report["items"]), 8)
+    assert_value(report["items"][4]["efficiency"], 0.75)
+    assert_value(report["items"][5]["failed"], True)
+    assert_value(report["slowest"][0]["item"], "part 1")
+    assert_value(report["slowest"][0]["out_bytes"], 20)
+
+    # the null profiler accepts the same calls
+    with NULL_PROFILER.measure("nothing", "item") as measurement:
+        measurement.out_bytes = 42
+        measurement.efficiency = 0.5
@@ -8,46 +8,55 @@ from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 import itertools
 import os
-from queue import Queue
+from queue import Queue, Empty, Full
+from threading import Condition, Event, Lock, Semaphore, Thread
 
 
-def concurrent_chain(generators, jobs=None):
+def concurrent_chain(generators, jobs=None, pool=None):
     """
     Similar to itertools.chain(), but runs the individual generators in a
     thread pool. The resulting items may be out of order accordingly.
 
+    The generators run in pool (a concurrent.futures.Executor) if it is
+    given, otherwise in a new thread pool with jobs threads.
+    The generators must not use the same pool themselves.
+
     When one generator raises an exception, all other currently-running
     generators are stopped (they may run until their next 'yield' statement).
     The exception is then raised.
     """
-    if jobs is None:
-        jobs = os.cpu_count()
-
-    if jobs == 1:
-        # we don't need to do all that threading stuff;
-        # let's just behave _precisely_ like itertools.chain.
-        for generator in generators:
-            yield from generator
+    if pool is None:
+        if jobs is None:
+            jobs = os.cpu_count()
+
+        if jobs == 1:
+            # we don't need to do all that threading stuff;
+            # let's just behave _precisely_ like itertools.chain.
+            for generator in generators:
+                yield from generator
+            return
+
+        with ThreadPoolExecutor(jobs) as pool:
+            yield from concurrent_chain(generators, pool=pool)
         return
 
     queue = ClosableQueue()
     running_generator_count = 0
 
-    with ThreadPoolExecutor(jobs) as pool:
-        for generator in generators:
-            pool.submit(generator_to_queue, generator, queue)
-            running_generator_count += 1
+    for generator in generators:
+        pool.submit(generator_to_queue, generator, queue)
+        running_generator_count += 1
 
-        while running_generator_count > 0:
-            event_type, value = queue.get()
+    while running_generator_count > 0:
+        event_type, value = queue.get()
 
-            if event_type == GeneratorEvent.VALUE:
-                yield value
-            elif event_type == GeneratorEvent.EXCEPTION:
-                queue.close("Exception in different generator")
-                raise value
-            elif event_type == GeneratorEvent.STOP_ITERATION:
-                running_generator_count -= 1
+        if event_type == GeneratorEvent.VALUE:
+            yield value
+        elif event_type == GeneratorEvent.EXCEPTION:
+            queue.close("Exception in different generator")
+            raise value
+        elif event_type == GeneratorEvent.STOP_ITERATION:
+            running_generator_count -= 1
 
 
 class ClosableQueue(Queue):
@@ -111,6 +120,312 @@ def generator_to_queue(generator, queue):
         queue.put((GeneratorEvent.EXCEPTION, exc))
 
 
+class ByteBudget:
+    """
+    Limits the number of bytes that are held at once,
+    e.g. by the items in a Pipeline.
+
+    acquire() blocks until the requested bytes fit into the limit.
+    A request larger than the limit is admitted when nothing else is held,
+    so it can't block forever.
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.closed = False
+        self.close_reason = None
+        self.condition = Condition()
+
+    def acquire(self, size):
+        """
+        Waits until size bytes are available, and takes them.
+        Raises RuntimeError(reason) if the budget has been closed.
+        """
+        with self.condition:
+            while True:
+                if self.closed:
+                    raise RuntimeError(self.close_reason)
+
+                if self.used == 0 or self.used + size <= self.limit:
+                    break
+
+                self.condition.wait()
+
+            self.used += size
+
+    def add(self, size):
+        """
+        Takes size bytes without waiting, even if that exceeds the limit.
+        For bytes that are already held, and can't wait for others.
+        """
+        with self.condition:
+            self.used += size
+
+    def release(self, size):
+        """
+        Returns size bytes that were acquired or added.
+        """
+        with self.condition:
+            self.used -= size
+            self.condition.notify_all()
+
+    def close(self, reason=None):
+        """
+        Any waiting and subsequent calls to acquire()
+        will raise RuntimeError(reason).
+        """
+        with self.condition:
+            self.closed = True
+            self.close_reason = reason
+            self.condition.notify_all()
+
+
+class Pipeline:
+    """
+    Passes items through a sequence of stages,
+    each of which runs in its own threads.
+
+    stages is a list of (function, thread count). Each function is called
+    with an item of the previous stage, and returns the item for the next
+    stage. The stages are connected by queues of limited size, so a slow
+    stage holds back the ones before it instead of accumulating items.
+
+    If pool (a concurrent.futures.Executor) is given, the calls of the
+    stages with multiple threads are submitted to it instead, with at most
+    thread count calls at once. Then, the pool must not be used for
+    anything else while the pipeline runs.
+
+    run() yields the results of the last stage, in the order in which
+    they are completed. When a stage raises an exception, all threads
+    are stopped, and the exception is raised by run().
+    """
+
+    # how often blocked threads check whether the pipeline was stopped
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, stages, queue_size=None, pool=None):
+        self.stages = stages
+        self.pool = pool
+
+        if queue_size is None:
+            queue_size = max(thread_count for _, thread_count in stages)
+
+        # the input queue of each stage, and the result queue.
+        self.queues = [Queue(queue_size) for _ in stages]
+        self.queues.append(Queue())
+
+        # number of running threads of each stage
+        self.running = [self.thread_count(idx) for idx in range(len(stages))]
+        self.running_lock = Lock()
+
+        self.stopped = Event()
+
+    def run(self, items):
+        """
+        Passes the items through the stages, and yields the results.
+        """
+        if all(thread_count == 1 for _, thread_count in self.stages):
+            # nothing would run concurrently but the stages themselves;
+            # process the items one by one, like concurrent_chain does.
+            for item in items:
+                for function, _ in self.stages:
+                    item = function(item)
+                yield item
+            return
+
+        threads = [Thread(target=self.feed, args=(items,), daemon=True)]
+        for idx in range(len(self.stages)):
+            if self.uses_pool(idx):
+                target = self.dispatch
+            else:
+                target = self.work
+
+            threads.extend(
+                Thread(target=target, args=(idx,), daemon=True)
+                for _ in range(self.thread_count(idx))
+            )
+
+        for thread in threads:
+            thread.start()
+
+        results = self.queues[-1]
+        try:
+            while True:
+                event_type, value = results.get()
+
+                if event_type == GeneratorEvent.VALUE:
+                    yield value
+                elif event_type == GeneratorEvent.EXCEPTION:
+                    raise value
+                elif event_type == GeneratorEvent.STOP_ITERATION:
+                    break
+
+        finally:
+            self.stopped.set()
+
+        for thread in threads:
+            thread.join()
+
+    def uses_pool(self, idx):
+        """
+        True if the calls of stage idx are submitted to the pool.
+        """
+        return self.pool is not None and self.stages[idx][1] > 1
+
+    def thread_count(self, idx):
+        """
+        The number of threads that take the items of stage idx:
+        one that submits them to the pool, or the workers of the stage.
+        """
+        if self.uses_pool(idx):
+            return 1
+
+        return self.stages[idx][1]
+
+    def put(self, idx, item):
+        """
+        Puts the item into the input queue of stage idx,
+        and waits for space in there. Returns False if the pipeline
+        was stopped in the meantime.
+        """
+        while not self.stopped.is_set():
+            try:
+                self.queues[idx].put(item, timeout=self.POLL_INTERVAL)
+                return True
+            except Full:
+                pass
+
+        return False
+
+    def get(self, idx):
+        """
+        Gets an item from the input queue of stage idx.
+        Returns (False, None) if the pipeline was stopped in the meantime.
+        """
+        while not self.stopped.is_set():
+            try:
+                return True, self.queues[idx].get(timeout=self.POLL_INTERVAL)
+            except Empty:
+                pass
+
+        return False, None
+
+    def fail(self, exc):
+        """
+        Reports the exception to run(), unless the pipeline is stopped
+        already (then exc is likely caused by that).
+        """
+        if not self.stopped.is_set():
+            self.queues[-1].put((GeneratorEvent.EXCEPTION, exc))
+
+    def feed(self, items):
+        """
+        Thread that puts the items into the queue of the first stage.
+        """
+        try:
+            for item in items:
+                if not self.put(0, (GeneratorEvent.VALUE, item)):
+                    return
+
+        except BaseException as exc:
+            self.fail(exc)
+            return
+
+        self.stop_stage(0)
+
+    def work(self, idx):
+        """
+        Thread of stage idx.
+        The last thread of each stage signals the end to the next stage.
+        """
+        function, _ = self.stages[idx]
+
+        try:
+            while True:
+                running, (event_type, item) = self.get(idx)
+                if not running:
+                    return
+
+                if event_type == GeneratorEvent.STOP_ITERATION:
+                    break
+
+                if not self.put(idx + 1, (GeneratorEvent.VALUE, function(item))):
+                    return
+
+        except BaseException as exc:
+            self.fail(exc)
+            return
+
+        with self.running_lock:
+            self.running[idx] -= 1
+            if self.running[idx] > 0:
+                return
+
+        self.stop_stage(idx + 1)
+
+    def dispatch(self, idx):
+        """
+        Thread of stage idx, which submits the calls of the stage
+        to the pool. The results are passed on when they are done.
+        """
+        function, limit = self.stages[idx]
+        slots = Semaphore(limit)
+
+        def forward(future):
+            """ passes the result of a call on to the next stage """
+            try:
+                self.put(idx + 1, (GeneratorEvent.VALUE, future.result()))
+            except BaseException as exc:
+                self.fail(exc)
+            finally:
+                slots.release()
+
+        def acquire_slot():
+            """ waits for a free slot, False if the pipeline was stopped """
+            while not self.stopped.is_set():
+                if slots.acquire(timeout=self.POLL_INTERVAL):
+                    return True
+
+            return False
+
+        try:
+            while True:
+                running, (event_type, item) = self.get(idx)
+                if not running:
+                    return
+
+                if event_type == GeneratorEvent.STOP_ITERATION:
+                    break
+
+                if not acquire_slot():
+                    return
+
+                self.pool.submit(function, item).add_done_callback(forward)
+
+        except BaseException as exc:
+            self.fail(exc)
+            return
+
+        # wait until all calls have passed on their results.
+        for _ in range(limit):
+            if not acquire_slot():
+                return
+
+        self.stop_stage(idx + 1)
+
+    def stop_stage(self, idx):
+        """
+        Signals the end of the items to the threads of stage idx.
+        """
+        if idx == len(self.stages):
+            self.queues[-1].put((GeneratorEvent.STOP_ITERATION, None))
+            return
+
+        for _ in range(self.thread_count(idx)):
+            if not self.put(idx, (GeneratorEvent.STOP_ITERATION, None)):
+                return
+
+
 def test_concurrent_chain():
     """ Tests concurrent_chain """
     from ..testing.testing import assert_value, assert_raises, result
@@ -132,3 +447,55 @@ def test_concurrent_chain():
     chain = concurrent_chain([range(10), range(20), errorgen(), range(30)], 2)
     with assert_raises(ValueError):
         result(list(chain))
+
+
+def test_pipeline():
+    """ Tests Pipeline and ByteBudget """
+    from ..testing.testing import assert_value, assert_raises, result
+
+    def fail_at_7(item):
+        """ stage that raises an exception for one item """
+        if item == 7:
+            raise ValueError()
+        return item
+
+    # concurrent, in a pool, and serial
+    with ThreadPoolExecutor(3) as pool:
+        for threads, stage_pool in ((3, None), (3, pool), (1, None)):
+            pipeline = Pipeline([(lambda x: x + 1, 1),
+                                 (lambda x: x * 2, threads),
+                                 (str, 1)], queue_size=2, pool=stage_pool)
+            assert_value(sorted(pipeline.run(range(50)), key=int),
+                         [str((x + 1) * 2) for x in range(50)])
+
+            pipeline = Pipeline([(lambda x: x, 1), (fail_at_7, threads)],
+                                pool=stage_pool)
+            with assert_raises(ValueError):
+                result(list(pipeline.run(range(50))))
+
+        # the pool can be used by the next ones
+        assert_value(sorted(concurrent_chain([range(10), range(5)], pool=pool)),
+                     sorted(itertools.chain(range(10), range(5))))
+
+    budget = ByteBudget(10)
+    budget.acquire(6)
+    budget.add(20)
+    budget.release(20)
+
+    # waits until the other 6 bytes are released
+    waiter = Thread(target=budget.acquire, args=(8,))
+    waiter.start()
+    waiter.join(0.05)
+    assert_value(waiter.is_alive(), True)
+
+    budget.release(6)
+    waiter.join()
+    assert_value(budget.used, 8)
+
+    # larger than the limit, but nothing else is held
+    budget.release(8)
+    budget.acquire(100)
+
+    budget.close("closed")
+    with assert_raises(RuntimeError):
+        budget.acquire(1)